@@ -0,0 +1,73 @@
+# blocks.py – Run local raster operators block by block across a process pool
+# A large grid is split into square blocks; each block is processed together with a halo of
+# neighbouring pixels and only its core is written back, so the stitched result is identical
+# to processing the whole grid at once while each worker only holds one padded block.
+import os
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+BLOCK_SIZE = int(os.environ.get("TERRAIN_BLOCK_SIZE", "1024"))
+WORKERS = int(os.environ.get("TERRAIN_WORKERS", str(os.cpu_count() or 1)))
+
+# core: slices of the block in grid coordinates; padded: core plus halo, clipped to the grid;
+# inner: the core's position inside the padded block
+Block = namedtuple("Block", ["core", "padded", "inner"])
+
+_executor = None
+
+def log(msg):
+    print(f"[BLOCKS] {msg}")
+
+def iter_blocks(shape, block_size=BLOCK_SIZE, halo=1):
+    """Yield a Block for every block_size x block_size tile of a (height, width) grid"""
+    height, width = shape
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            core_rows = slice(row, min(row + block_size, height))
+            core_cols = slice(col, min(col + block_size, width))
+            pad_rows = slice(max(core_rows.start - halo, 0), min(core_rows.stop + halo, height))
+            pad_cols = slice(max(core_cols.start - halo, 0), min(core_cols.stop + halo, width))
+            inner = (
+                slice(core_rows.start - pad_rows.start, core_rows.stop - pad_rows.start),
+                slice(core_cols.start - pad_cols.start, core_cols.stop - pad_cols.start),
+            )
+            yield Block((core_rows, core_cols), (pad_rows, pad_cols), inner)
+
+def get_executor():
+    """Shared process pool; spawned (not forked) so workers never inherit open GDAL handles"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+def map_blocks(func, shape, args=(), block_size=BLOCK_SIZE, halo=1, workers=WORKERS):
+    """
+    Apply func(block, *args) to every block and stitch the results
+
+    func must be a module-level function (it is pickled to the workers). It reads its own
+    padded input and returns {name: array} cropped to the block core.
+
+    Returns:
+        {name: array shaped like the grid}
+    """
+    blocks = list(iter_blocks(shape, block_size, halo))
+    outputs = {}
+
+    def store(block, result):
+        for name, values in result.items():
+            if name not in outputs:
+                outputs[name] = np.empty(shape, dtype=values.dtype)
+            outputs[name][block.core] = values
+
+    if workers <= 1 or len(blocks) == 1:
+        for block in blocks:
+            store(block, func(block, *args))
+        return outputs
+
+    log(f"{len(blocks)} blocks of {block_size}px over {shape[0]}x{shape[1]} on {workers} workers")
+    futures = {get_executor().submit(func, block, *args): block for block in blocks}
+    for future in as_completed(futures):
+        store(futures[future], future.result())
+    return outputs
@@ -5,8 +5,8 @@ import json
 import os
 import math
 import numpy as np
-import rasterio
 from utils import download_dem
+from dem import read_dem
 
 # Simple logging function
 def log(msg):
@@ -46,21 +46,20 @@ def generate_contours(bbox, interval=5, bold_interval=None):
         
         # CRITICAL: Verify DEM has valid, varying elevation data (not uniform)
         if dem_path and os.path.exists(dem_path):
-            with rasterio.open(dem_path) as src:
-                data = src.read(1)
-                valid_data = data[(data != src.nodata) & (data != 0) & ~np.isnan(data)]
-                
-                if len(valid_data) == 0:
-                    raise Exception("DEM contains no valid elevation data")
-                
-                # Check if data actually varies (not uniform - this is the key issue!)
-                data_std = np.std(valid_data)
-                data_range = np.max(valid_data) - np.min(valid_data)
-                
-                if data_std < 0.5 or data_range < 1.0:
-                    raise Exception(f"DEM data is uniform/invalid (std={data_std:.2f}m, range={data_range:.2f}m) - not real terrain")
-                
-                log(f"DEM validated: {len(valid_data)} valid points, elevation range {np.min(valid_data):.1f}m - {np.max(valid_data):.1f}m, std={data_std:.2f}m")
+            data, _, nodata = read_dem(dem_path)
+            valid_data = data[(data != nodata) & (data != 0) & ~np.isnan(data)]
+            
+            if len(valid_data) == 0:
+                raise Exception("DEM contains no valid elevation data")
+            
+            # Check if data actually varies (not uniform - this is the key issue!)
+            data_std = np.std(valid_data)
+            data_range = np.max(valid_data) - np.min(valid_data)
+            
+            if data_std < 0.5 or data_range < 1.0:
+                raise Exception(f"DEM data is uniform/invalid (std={data_std:.2f}m, range={data_range:.2f}m) - not real terrain")
+            
+            log(f"DEM validated: {len(valid_data)} valid points, elevation range {np.min(valid_data):.1f}m - {np.max(valid_data):.1f}m, std={data_std:.2f}m")
                 
     except Exception as e:
         dem_error = str(e)
@@ -9,8 +9,8 @@ import math
 import numpy as np
 import rasterio
 import time
-import requests
 from utils import download_dem
+from elevation_providers import lookup_elevations
 
 # Simple logging function
 def log(msg):
@@ -105,46 +105,17 @@ def generate_from_elevation_api(bbox, interval, bold_interval, start_time):
     lons = np.linspace(minx, maxx, grid_size)
     lats = np.linspace(miny, maxy, grid_size)
     
-    log(f"Fetching {grid_size * grid_size} elevation points from OpenElevation API...")
+    # Providers are tried fastest-first: the local DEM cache answers in-process,
+    # and only points it cannot cover go out to OpenElevation
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing='ij')
+    log(f"Looking up {grid_size * grid_size} elevation points...")
+    elevation_grid = lookup_elevations(lat_grid, lon_grid).astype(np.float32)
     
-    # Prepare locations
-    locations = []
-    for lat in lats:
-        for lon in lons:
-            locations.append({"latitude": float(lat), "longitude": float(lon)})
-    
-    # Fetch in batches (API handles up to 1000 points per request)
-    elevation_grid = np.full((len(lats), len(lons)), np.nan, dtype=np.float32)
-    
-    batch_size = 1000  # API limit
-    total_points = len(locations)
-    
-    try:
-        for batch_start in range(0, total_points, batch_size):
-            batch = locations[batch_start:batch_start + batch_size]
-            log(f"Fetching batch {batch_start//batch_size + 1}/{(total_points + batch_size - 1)//batch_size} ({len(batch)} points)...")
-            
-            response = requests.post(
-                "https://api.open-elevation.com/api/v1/lookup",
-                json={"locations": batch},
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                results = response.json().get('results', [])
-                for idx, result in enumerate(results):
-                    if batch_start + idx < len(locations):
-                        elev = result.get('elevation')
-                        if elev is not None and elev != -32768:
-                            loc = locations[batch_start + idx]
-                            lat_idx = np.argmin(np.abs(lats - loc['latitude']))
-                            lon_idx = np.argmin(np.abs(lons - loc['longitude']))
-                            elevation_grid[lat_idx, lon_idx] = float(elev)
-            else:
-                log(f"API returned status {response.status_code} for batch {batch_start//batch_size + 1}")
-    except Exception as e:
-        log(f"Elevation API failed: {e}")
-        raise Exception(f"Failed to fetch elevation data: {e}")
+    return contours_from_grid(elevation_grid, lats, lons, bbox, interval, bold_interval, start_time)
+
+def contours_from_grid(elevation_grid, lats, lons, bbox, interval, bold_interval, start_time):
+    """Fill gaps in a sampled elevation grid (rows = lats, cols = lons) and trace its contours"""
+    minx, miny, maxx, maxy = map(float, bbox.split(","))
     
     # Fill NaN with interpolation
     valid_data = elevation_grid[~np.isnan(elevation_grid)]
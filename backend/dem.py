@@ -1,21 +1,350 @@
 # dem.py – DEM extraction utilities
-import rasterio
+import os
+import gzip
+import struct
+from io import BytesIO
 import numpy as np
-from utils import download_dem
+from rasterio.windows import Window
+from rasterio.transform import Affine
+from utils import download_dem, download_single_dem_tile, is_india_region, cached_tile_path
+import dem_store
+import raster_pool
+import user_dem
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Binary grid header: magic, version, dtype code, width, height, bounds, scale, offset, nodata
+GRID_MAGIC = b"PDEM"
+GRID_HEADER = struct.Struct("<4sBBHII4dfff")
+GRID_DTYPES = {"f32": 1, "i16": 2}
+
+# Uncached 1° tiles one sample_elevations call may download; each can wait out provider timeouts
+MAX_DOWNLOAD_TILES = int(os.environ.get("DEM_MAX_DOWNLOAD_TILES", "8"))
+
+def read_dem(dem_path):
+    """
+    Read a whole DEM band
+
+    Served zero-copy from the memory-mapped store when it is enabled,
+    otherwise decoded from the GeoTIFF.
+
+    Returns:
+        (array, transform, nodata)
+    """
+    tile = dem_store.open_tile(dem_path)
+    if tile is not None:
+        return tile.array, tile.transform, tile.nodata
+
+    with raster_pool.open_dataset(dem_path) as src:
+        return src.read(1), src.transform, src.nodata
+
+def read_dem_window(dem_path, minx, miny, maxx, maxy, halo=0):
+    """
+    Read the pixels of a DEM covering a bbox, plus an optional pixel halo
+
+    Returns:
+        (array, window transform, nodata)
+    """
+    tile = dem_store.open_tile(dem_path)
+    if tile is not None:
+        arr, transform = tile.window(minx, miny, maxx, maxy, halo)
+        return arr, transform, tile.nodata
+
+    with raster_pool.open_dataset(dem_path) as src:
+        rows, cols = dem_store.bounds_to_slices(src.transform, src.shape, minx, miny, maxx, maxy, halo)
+        window = Window.from_slices(rows, cols)
+        return src.read(1, window=window), src.window_transform(window), src.nodata
+
+def dem_window_slices(dem_path, minx, miny, maxx, maxy, halo=0):
+    """
+    Pixel extent of the window read_dem_window would return, without reading it
+
+    Returns:
+        (row slice, col slice, window transform)
+    """
+    tile = dem_store.open_tile(dem_path)
+    if tile is not None:
+        transform, shape = tile.transform, tile.shape
+    else:
+        with raster_pool.open_dataset(dem_path) as src:
+            transform, shape = src.transform, src.shape
+    rows, cols = dem_store.bounds_to_slices(transform, shape, minx, miny, maxx, maxy, halo)
+    return rows, cols, transform * Affine.translation(cols.start, rows.start)
+
+def read_dem_pixels(dem_path, rows, cols):
+    """
+    Read a pixel window of a DEM by row/col slices
+
+    Returns:
+        (array, nodata)
+    """
+    tile = dem_store.open_tile(dem_path)
+    if tile is not None:
+        return tile.array[rows, cols], tile.nodata
+
+    with raster_pool.open_dataset(dem_path) as src:
+        return src.read(1, window=Window.from_slices(rows, cols)), src.nodata
+
+def _elevation(data, nodata):
+    """float64 copy of raw DEM pixels with nodata as NaN"""
+    data = data.astype(np.float64)
+    if nodata is not None and not np.isnan(nodata):
+        data[data == nodata] = np.nan
+    return data
+
+def bilinear_sample(arr, transform, lons, lats, nodata=None):
+    """
+    Bilinearly interpolate a north-up raster at arrays of coordinates
+
+    Corners that are nodata/NaN are dropped and the remaining weights renormalised.
+    Points outside the raster come back as NaN.
+    """
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    height, width = arr.shape
+    result = np.full(lons.shape, np.nan, dtype=np.float64)
+    if height == 0 or width == 0:
+        return result
+
+    # Fractional pixel coordinates relative to pixel centres
+    inv = ~transform
+    fx = inv.a * lons + inv.b * lats + inv.c - 0.5
+    fy = inv.d * lons + inv.e * lats + inv.f - 0.5
+    inside = (fx >= -0.5) & (fx <= width - 0.5) & (fy >= -0.5) & (fy <= height - 0.5)
+    fx = np.clip(fx[inside], 0, width - 1)
+    fy = np.clip(fy[inside], 0, height - 1)
+
+    x0 = np.minimum(np.floor(fx).astype(np.int64), max(width - 2, 0))
+    y0 = np.minimum(np.floor(fy).astype(np.int64), max(height - 2, 0))
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+    wx = fx - x0
+    wy = fy - y0
+
+    corners = np.stack([arr[y0, x0], arr[y0, x1], arr[y1, x0], arr[y1, x1]]).astype(np.float64)
+    weights = np.stack([(1 - wx) * (1 - wy), wx * (1 - wy), (1 - wx) * wy, wx * wy])
+    valid = ~np.isnan(corners)
+    if nodata is not None and not np.isnan(nodata):
+        valid &= corners != nodata
+    weights = np.where(valid, weights, 0.0)
+    total = weights.sum(axis=0)
+    values = (np.where(valid, corners, 0.0) * weights).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result[inside] = np.where(total > 0, values / total, np.nan)
+    return result
+
+def sample_elevations(lats, lons, cached_only=False):
+    """
+    Bilinear elevations for many points at once
+
+    Points inside a registered user DEM are sampled from it first. The rest are
+    grouped by 1° DEM tile; each tile is read once (only the window around its
+    points) and sampled in a single vectorised pass. With
+    `cached_only`, tiles missing from the local cache are left as NaN instead
+    of being downloaded.
+
+    Returns:
+        float64 array shaped like `lats`, NaN where no DEM is available
+
+    Raises:
+        ValueError: for non-finite or out-of-range coordinates, or when more than
+            MAX_DOWNLOAD_TILES uncached tiles would have to be downloaded
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    flat_lats = lats.ravel()
+    flat_lons = lons.ravel()
+    if not (np.all(np.abs(flat_lats) <= 90) and np.all(np.abs(flat_lons) <= 180)):
+        raise ValueError("Coordinates must be finite with |lat| <= 90 and |lon| <= 180")
+    result = np.full(flat_lats.shape, np.nan, dtype=np.float64)
+    if flat_lats.size == 0:
+        return result.reshape(lats.shape)
+
+    user_dem.sample_user_dems(flat_lats, flat_lons, result)
+    pending = np.nonzero(np.isnan(result))[0]
+    if pending.size == 0:
+        return result.reshape(lats.shape)
+
+    tile_keys = np.stack([np.floor(flat_lats[pending]), np.floor(flat_lons[pending])], axis=1).astype(np.int64)
+    tiles, inverse = np.unique(tile_keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+
+    if not cached_only:
+        missing = sum(cached_tile_path(int(t_lat), int(t_lon)) is None for t_lat, t_lon in tiles)
+        if missing > MAX_DOWNLOAD_TILES:
+            raise ValueError(f"Points span {missing} uncached DEM tiles; at most {MAX_DOWNLOAD_TILES} "
+                             "can be downloaded per request")
+
+    for index, (tile_lat, tile_lon) in enumerate(tiles):
+        members = pending[inverse == index]
+        tile_lat, tile_lon = int(tile_lat), int(tile_lon)
+        if cached_only:
+            dem_path = cached_tile_path(tile_lat, tile_lon)
+        else:
+            dem_path = download_single_dem_tile(tile_lat, tile_lon, is_india_region(tile_lat + 0.5, tile_lon + 0.5))
+        if not dem_path:
+            continue
+
+        pts_lat = flat_lats[members]
+        pts_lon = flat_lons[members]
+        arr, transform, nodata = read_dem_window(
+            dem_path, pts_lon.min(), pts_lat.min(), pts_lon.max(), pts_lat.max(), halo=1
+        )
+        result[members] = bilinear_sample(arr, transform, pts_lon, pts_lat, nodata)
+
+    return result.reshape(lats.shape)
+
+def elevations_to_json(values, decimals=2):
+    """Round an elevation array for JSON output, mapping NaN to null"""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.round(values, decimals).astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+def lookup_locations(locations):
+    """
+    OpenElevation-compatible lookup answered from the local DEM tiles
+
+    Only user DEMs and tiles already in the cache are read; nothing is downloaded.
+
+    Args:
+        locations: list of {"latitude": .., "longitude": ..} dicts
+
+    Returns:
+        {"results": [{"latitude", "longitude", "elevation"}, ...]}, elevation null where
+        unknown or not cached
+    """
+    lats = np.array([loc["latitude"] for loc in locations], dtype=np.float64)
+    lons = np.array([loc["longitude"] for loc in locations], dtype=np.float64)
+    elevations = elevations_to_json(sample_elevations(lats, lons, cached_only=True))
+    return {
+        "results": [
+            {"latitude": lat, "longitude": lon, "elevation": elev}
+            for lat, lon, elev in zip(lats.tolist(), lons.tolist(), elevations)
+        ]
+    }
+
+def get_dem_points(lats, lons):
+    """Elevations for a batch of points (JSON-ready)"""
+    elevations = sample_elevations(lats, lons)
+    return {
+        "count": int(elevations.size),
+        "interpolation": "bilinear",
+        "elevations": elevations_to_json(elevations)
+    }
 
 def get_dem_stats(lat, lon):
     dem_path = download_dem(lat, lon)
-    with rasterio.open(dem_path) as dem:
-        value = list(dem.sample([(lon, lat)]))[0][0]
+
+    tile = dem_store.open_tile(dem_path)
+    if tile is not None:
+        value = tile.sample([lon], [lat])[0]
+    else:
+        with raster_pool.open_dataset(dem_path) as dem:
+            value = list(dem.sample([(lon, lat)]))[0][0]
     return {"lat": lat, "lon": lon, "elevation_m": float(value)}
 
-def get_dem_tile(bbox):
+def resample_grid(arr, transform, nodata, bounds, width, height):
+    """Bilinearly resample a DEM window onto a width x height grid spanning `bounds`"""
+    minx, miny, maxx, maxy = bounds
+    xs = minx + (np.arange(width) + 0.5) * (maxx - minx) / width
+    ys = maxy - (np.arange(height) + 0.5) * (maxy - miny) / height
+    lon_grid, lat_grid = np.meshgrid(xs, ys)
+    return bilinear_sample(arr, transform, lon_grid, lat_grid, nodata).astype(np.float32)
+
+def encode_grid(arr, bounds, fmt="f32", nodata=None):
+    """
+    Pack an elevation grid as a compact little-endian binary payload
+
+    f32: raw float32 (NaN = no data)
+    i16: int16 with value = raw * scale + offset (-32768 = no data)
+    """
+    grid = _elevation(np.asarray(arr), nodata)
+    height, width = grid.shape
+    valid = grid[~np.isnan(grid)]
+
+    if fmt == "i16":
+        lo = float(valid.min()) if valid.size else 0.0
+        hi = float(valid.max()) if valid.size else 0.0
+        offset = (lo + hi) / 2
+        scale = max((hi - lo) / 65534, 0.001)
+        packed = np.full(grid.shape, -32768, dtype="<i2")
+        mask = ~np.isnan(grid)
+        packed[mask] = np.clip(np.round((grid[mask] - offset) / scale), -32767, 32767)
+        nodata_out = -32768.0
+    else:
+        scale, offset, nodata_out = 1.0, 0.0, float("nan")
+        packed = grid.astype("<f4")
+
+    header = GRID_HEADER.pack(GRID_MAGIC, 1, GRID_DTYPES[fmt], 0, width, height,
+                              *bounds, scale, offset, nodata_out)
+    return header + packed.tobytes()
+
+def compress_payload(payload, compression=None):
+    """Compress a response body; returns (bytes, content-encoding or None)"""
+    if not compression or compression == "none":
+        return payload, None
+    if compression == "gzip":
+        return gzip.compress(payload, compresslevel=5), "gzip"
+    if compression == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor(level=3).compress(payload), "zstd"
+    raise ValueError(f"Unsupported compression: {compression}")
+
+def read_dem_tile(bbox, width=None, height=None):
+    """
+    Elevation grid for a bbox, optionally resampled to width x height
+
+    Returns:
+        (grid, bounds, nodata)
+    """
     # bbox format: "minLon,minLat,maxLon,maxLat"
     minx, miny, maxx, maxy = map(float, bbox.split(","))
     dem_path = download_dem((miny + maxy)/2, (minx + maxx)/2)
 
-    with rasterio.open(dem_path) as dem:
-        window = dem.window(minx, miny, maxx, maxy)
-        arr = dem.read(1, window=window)
+    if width or height:
+        arr, transform, nodata = read_dem_window(dem_path, minx, miny, maxx, maxy, halo=1)
+        # Keep the aspect ratio when only one side is given
+        if not height:
+            height = max(1, round(width * arr.shape[0] / max(arr.shape[1], 1)))
+        if not width:
+            width = max(1, round(height * arr.shape[1] / max(arr.shape[0], 1)))
+        bounds = (minx, miny, maxx, maxy)
+        return resample_grid(arr, transform, nodata, bounds, int(width), int(height)), bounds, None
+
+    arr, transform, nodata = read_dem_window(dem_path, minx, miny, maxx, maxy)
+    rows, cols = arr.shape
+    bounds = (transform.c, transform.f + rows * transform.e, transform.c + cols * transform.a, transform.f)
+    return arr, bounds, nodata
+
+def get_dem_tile(bbox, width=None, height=None):
+    arr, bounds, _ = read_dem_tile(bbox, width, height)
+    grid = elevations_to_json(arr) if np.issubdtype(arr.dtype, np.floating) else arr.tolist()
+    return {"bbox": bbox, "bounds": list(bounds), "width": arr.shape[1], "height": arr.shape[0],
+            "elevation_grid": grid}
+
+def get_dem_tile_binary(bbox, fmt="f32", compression=None, width=None, height=None):
+    """
+    Elevation grid as a binary download
+
+    fmt: "f32" / "i16" (header + raw little-endian grid, see GRID_HEADER) or "npy"
 
-    return {"bbox": bbox, "elevation_grid": arr.tolist()}
+    Returns:
+        (body bytes, content-encoding or None)
+    """
+    arr, bounds, nodata = read_dem_tile(bbox, width, height)
+    if fmt == "npy":
+        grid = np.asarray(arr, dtype=np.float32)
+        if nodata is not None and not np.isnan(nodata):
+            grid = np.where(grid == nodata, np.nan, grid)
+        buffer = BytesIO()
+        np.save(buffer, grid)
+        payload = buffer.getvalue()
+    else:
+        payload = encode_grid(arr, bounds, fmt, nodata)
+    return compress_payload(payload, compression)
@@ -0,0 +1,179 @@
+# dem_store.py – Memory-mapped raw elevation store for hot DEM tiles
+# Keeps tiles as uncompressed .npy arrays next to a small JSON georeference header,
+# so windows can be sliced straight out of the OS page cache with no decompression
+# and no copy. Every worker process mapping the same file shares the same pages.
+import os
+import json
+import math
+import numpy as np
+from rasterio.transform import Affine
+import raster_pool
+from lru import LRUCache
+
+MMAP_FOLDER = os.environ.get("DEM_MMAP_FOLDER", "data/dem_mmap")
+MMAP_ENABLED = os.environ.get("DEM_MMAP_STORE", "0").lower() in ("1", "true", "yes")
+MMAP_MAX_TILES = int(os.environ.get("DEM_MMAP_MAX_TILES", "64"))
+
+# Native SRTM tiles are int16; everything else is stored as float32
+STORE_DTYPES = ("int16", "float32")
+
+# Mapped tiles keyed on (path, source mtime), so a rewritten source is never served stale
+_tiles = LRUCache(max_entries=MMAP_MAX_TILES)
+
+def log(msg):
+    print(f"[DEM_STORE] {msg}")
+
+def is_enabled():
+    """True when the memory-mapped store is switched on (DEM_MMAP_STORE=1)"""
+    return MMAP_ENABLED
+
+class StoreTile:
+    """A memory-mapped elevation array plus its georeference"""
+
+    def __init__(self, array, transform, nodata=None, crs=None):
+        self.array = array
+        self.transform = transform
+        self.nodata = nodata
+        self.crs = crs
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def window(self, minx, miny, maxx, maxy, halo=0):
+        """
+        Slice the pixels covering a bbox (plus an optional halo) without copying
+
+        Returns:
+            (array view, window transform)
+        """
+        rows, cols = bounds_to_slices(self.transform, self.array.shape, minx, miny, maxx, maxy, halo)
+        view = self.array[rows, cols]
+        return view, self.transform * Affine.translation(cols.start, rows.start)
+
+    def sample(self, lons, lats):
+        """Nearest-pixel elevations for arrays of coordinates (NaN outside the tile)"""
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        inv = ~self.transform
+        cols = np.floor(inv.a * lons + inv.b * lats + inv.c).astype(np.int64)
+        rows = np.floor(inv.d * lons + inv.e * lats + inv.f).astype(np.int64)
+        height, width = self.array.shape
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        values = np.full(lons.shape, np.nan, dtype=np.float64)
+        values[inside] = self.array[rows[inside], cols[inside]]
+        if self.nodata is not None and not np.isnan(self.nodata):
+            values[values == self.nodata] = np.nan
+        return values
+
+def bounds_to_slices(transform, shape, minx, miny, maxx, maxy, halo=0):
+    """
+    Convert a geographic bbox into row/col slices of a north-up raster,
+    expanded by `halo` pixels and clamped to the raster extent
+    """
+    height, width = shape
+    col_start = int(math.floor((minx - transform.c) / transform.a)) - halo
+    col_stop = int(math.ceil((maxx - transform.c) / transform.a)) + halo
+    row_start = int(math.floor((maxy - transform.f) / transform.e)) - halo
+    row_stop = int(math.ceil((miny - transform.f) / transform.e)) + halo
+
+    col_start = min(max(col_start, 0), width)
+    col_stop = min(max(col_stop, col_start), width)
+    row_start = min(max(row_start, 0), height)
+    row_stop = min(max(row_stop, row_start), height)
+    return slice(row_start, row_stop), slice(col_start, col_stop)
+
+def store_paths(dem_path):
+    """Paths of the .npy payload and .json header for a source raster"""
+    name = os.path.splitext(os.path.basename(dem_path))[0]
+    return os.path.join(MMAP_FOLDER, f"{name}.npy"), os.path.join(MMAP_FOLDER, f"{name}.json")
+
+def convert(dem_path):
+    """
+    Decode a GeoTIFF once into the raw store
+
+    Writes are done to temporary names and renamed into place, so readers in
+    other processes never observe a half-written tile.
+    """
+    npy_path, header_path = store_paths(dem_path)
+    os.makedirs(MMAP_FOLDER, exist_ok=True)
+
+    with raster_pool.open_dataset(dem_path) as src:
+        data = src.read(1)
+        dtype = data.dtype.name if data.dtype.name in STORE_DTYPES else "float32"
+        header = {
+            "transform": list(src.transform)[:6],
+            "crs": src.crs.to_string() if src.crs else None,
+            "nodata": None if src.nodata is None else float(src.nodata),
+            "dtype": dtype,
+            "width": src.width,
+            "height": src.height,
+            "source_mtime": os.path.getmtime(dem_path),
+        }
+
+    tmp_npy = f"{npy_path}.{os.getpid()}.tmp"
+    tmp_header = f"{header_path}.{os.getpid()}.tmp"
+    with open(tmp_npy, "wb") as f:
+        np.save(f, np.ascontiguousarray(data, dtype=dtype))
+    with open(tmp_header, "w") as f:
+        json.dump(header, f)
+    os.replace(tmp_npy, npy_path)
+    os.replace(tmp_header, header_path)
+
+    log(f"Stored {os.path.basename(dem_path)} as raw {dtype} {header['height']}x{header['width']}")
+    return npy_path
+
+def _is_current(dem_path, header_path):
+    try:
+        with open(header_path) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if os.path.exists(dem_path) and os.path.getmtime(dem_path) > header.get("source_mtime", 0):
+        return None
+    return header
+
+def open_tile(dem_path, create=True):
+    """
+    Map a DEM into memory from the raw store, converting it on first use
+
+    Returns:
+        StoreTile, or None when the store is disabled or the tile is unavailable
+    """
+    if not MMAP_ENABLED or not dem_path:
+        return None
+
+    path = os.path.abspath(dem_path)
+    try:
+        key = (path, os.path.getmtime(path))
+    except OSError:
+        key = (path, None)
+    # Only the first caller converts or maps a tile; concurrent callers wait for it
+    return _tiles.get_or_compute(key, lambda: _map_tile(dem_path, create))
+
+def _map_tile(dem_path, create):
+    npy_path, header_path = store_paths(dem_path)
+    header = _is_current(dem_path, header_path)
+    try:
+        if header is None:
+            if not create or not os.path.exists(dem_path):
+                return None
+            convert(dem_path)
+            header = _is_current(dem_path, header_path)
+
+        array = np.load(npy_path, mmap_mode="r")
+        return StoreTile(
+            array,
+            Affine(*header["transform"]),
+            nodata=header.get("nodata"),
+            crs=header.get("crs"),
+        )
+    except Exception as e:
+        log(f"Could not map {dem_path}: {e}")
+        return None
+
+def evict(dem_path):
+    """Forget a mapped tile (e.g. after its source raster was rewritten)"""
+    path = os.path.abspath(dem_path)
+    for key in [k for k in _tiles.keys() if k[0] == path]:
+        _tiles.pop(key)
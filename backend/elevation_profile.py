@@ -0,0 +1,171 @@
+# elevation_profile.py – Elevation profiles along polylines (swales, diversion drains, keylines)
+import numpy as np
+from dem import sample_elevations, elevations_to_json
+from raster_vector import METERS_PER_DEG_LAT, METERS_PER_DEG_LON
+
+MAX_PROFILE_POINTS = 200000
+
+def _list(value, message):
+    if not isinstance(value, list):
+        raise ValueError(message)
+    return value
+
+def extract_lines(payload):
+    """
+    Pull polylines out of a request body
+
+    Accepts {"lines": [[[lon, lat], ...], ...]} or any GeoJSON LineString,
+    MultiLineString, Feature or FeatureCollection.
+
+    Returns:
+        list of (n, 2) float arrays in lon/lat order
+
+    Raises:
+        ValueError for a body that is not a JSON object or holds malformed lines
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("Body must be a JSON object: {\"lines\": [...]} or GeoJSON")
+    if "lines" in payload:
+        raw_lines = payload["lines"]
+    else:
+        raw_lines = []
+        stack = [payload]
+        while stack:
+            obj = stack.pop()
+            if not isinstance(obj, dict):
+                raise ValueError("GeoJSON features and geometries must be objects")
+            kind = obj.get("type")
+            if kind == "FeatureCollection":
+                stack.extend(reversed(_list(obj.get("features", []), "'features' must be a list")))
+            elif kind == "Feature":
+                if obj.get("geometry"):
+                    stack.append(obj["geometry"])
+            elif kind == "LineString":
+                raw_lines.append(obj.get("coordinates"))
+            elif kind == "MultiLineString":
+                raw_lines.extend(_list(obj.get("coordinates"), "MultiLineString coordinates must be a list of lines"))
+    raw_lines = _list(raw_lines, "'lines' must be a list of [[lon, lat], ...] polylines")
+
+    lines = []
+    for coords in raw_lines:
+        try:
+            arr = np.asarray(coords, dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("Line positions must be [lon, lat] numbers")
+        if arr.ndim != 2 or arr.shape[0] < 2 or arr.shape[1] < 2:
+            raise ValueError("Each line needs at least two [lon, lat] positions")
+        lines.append(arr[:, :2])
+    return lines
+
+def segment_lengths(coords):
+    """Length in metres of each segment of a lon/lat polyline"""
+    lons, lats = coords[:, 0], coords[:, 1]
+    mid_lat = np.radians((lats[1:] + lats[:-1]) / 2)
+    dx = np.diff(lons) * METERS_PER_DEG_LON * np.cos(mid_lat)
+    dy = np.diff(lats) * METERS_PER_DEG_LAT
+    return np.hypot(dx, dy)
+
+def densify_line(coords, spacing):
+    """
+    Resample a lon/lat polyline every `spacing` metres, always keeping its end point
+
+    Returns:
+        (lons, lats, distances_m)
+    """
+    lons, lats = coords[:, 0], coords[:, 1]
+    seg = segment_lengths(coords)
+
+    # Drop repeated vertices so distances stay strictly increasing
+    keep = np.concatenate([[True], seg > 0])
+    lons, lats = lons[keep], lats[keep]
+    cumulative = np.concatenate([[0.0], np.cumsum(seg[seg > 0])])
+    total = cumulative[-1]
+
+    if total == 0:
+        return lons[:1], lats[:1], np.zeros(1)
+
+    distances = np.arange(0.0, total, spacing)
+    if distances[-1] < total:
+        distances = np.append(distances, total)
+    return np.interp(distances, cumulative, lons), np.interp(distances, cumulative, lats), distances
+
+def gradient_ratio(gradient):
+    """Express a gradient as a 1:N string (e.g. 0.0025 -> '1:400')"""
+    if gradient is None or not np.isfinite(gradient) or gradient == 0:
+        return None
+    return f"1:{round(1 / abs(gradient))}"
+
+def summarize_profile(distances, elevations, gradients):
+    valid = ~np.isnan(elevations)
+    if not np.any(valid):
+        return {"length_m": round(float(distances[-1]), 1)}
+
+    first = elevations[valid][0]
+    last = elevations[valid][-1]
+    run = float(distances[valid][-1] - distances[valid][0])
+    mean_gradient = (last - first) / run if run > 0 else 0.0
+    steps = np.diff(elevations[valid])
+
+    return {
+        "length_m": round(float(distances[-1]), 1),
+        "min_elevation": round(float(np.min(elevations[valid])), 2),
+        "max_elevation": round(float(np.max(elevations[valid])), 2),
+        "net_change_m": round(float(last - first), 2),
+        "total_ascent_m": round(float(steps[steps > 0].sum()), 2),
+        "total_descent_m": round(float(abs(steps[steps < 0].sum())), 2),
+        "mean_gradient": round(float(mean_gradient), 5),
+        "mean_gradient_ratio": gradient_ratio(mean_gradient),
+        "max_abs_gradient": round(float(np.nanmax(np.abs(gradients))), 5) if gradients.size else 0.0,
+    }
+
+def profile_lines(lines, spacing=10.0):
+    """
+    Elevation, distance and gradient arrays along many polylines
+
+    Every line is densified at `spacing` metres, then all samples are
+    interpolated from the DEM in one vectorised call.
+
+    Returns:
+        dict with one profile per input line
+    """
+    if not spacing > 0:
+        raise ValueError("spacing must be > 0")
+
+    # Bound the sample count from the line lengths before allocating any samples
+    estimated = sum(int(np.ceil(np.nansum(segment_lengths(coords)) / spacing)) + 1 for coords in lines)
+    if estimated > MAX_PROFILE_POINTS:
+        raise ValueError(f"Profile would need {estimated} samples; increase spacing (max {MAX_PROFILE_POINTS})")
+
+    dense = [densify_line(coords, spacing) for coords in lines]
+    total_points = sum(len(d[2]) for d in dense)
+
+    if dense:
+        all_lons = np.concatenate([d[0] for d in dense])
+        all_lats = np.concatenate([d[1] for d in dense])
+        all_elev = sample_elevations(all_lats, all_lons)
+        splits = np.cumsum([len(d[2]) for d in dense])[:-1]
+        per_line = np.split(all_elev, splits)
+    else:
+        per_line = []
+
+    profiles = []
+    for (lons, lats, distances), elevations in zip(dense, per_line):
+        if len(distances) > 1:
+            with np.errstate(invalid="ignore"):
+                gradients = np.gradient(elevations, distances)
+        else:
+            gradients = np.zeros(1)
+        profiles.append({
+            "coordinates": np.round(np.stack([lons, lats], axis=1), 7).tolist(),
+            "distance_m": np.round(distances, 2).tolist(),
+            "elevation_m": elevations_to_json(elevations),
+            "gradient": elevations_to_json(gradients, decimals=5),
+            "summary": summarize_profile(distances, elevations, gradients),
+        })
+
+    return {
+        "spacing_m": spacing,
+        "count": len(profiles),
+        "sample_count": int(total_points),
+        "profiles": profiles,
+    }
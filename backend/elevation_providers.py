@@ -0,0 +1,350 @@
+# elevation_providers.py – Pluggable elevation sources with health scoring and circuit breaking
+# Every place that needs elevation (tile downloads, point lookups) goes through one
+# registry. Providers are tried fastest-healthy-first; a provider that keeps failing
+# is skipped for a cooling-off period instead of costing a full timeout per request.
+import os
+import time
+import threading
+import numpy as np
+import requests
+import rasterio
+import dem_store
+import raster_pool
+import user_dem
+
+# Health tuning
+EWMA_ALPHA = 0.3
+FAILURES_TO_OPEN = 3
+COOLDOWN_SECONDS = 60
+MAX_COOLDOWN_SECONDS = 900
+
+def log(msg):
+    print(f"[PROVIDERS] {msg}")
+
+class ProviderMiss(Exception):
+    """The provider answered, but has no (valid) data for this request - not a health failure"""
+
+class CircuitOpen(Exception):
+    """The provider's circuit is open (or its half-open probe is already in flight); not called"""
+
+class ProviderHealth:
+    """Latency/error tracking plus a simple circuit breaker for one provider"""
+
+    def __init__(self, expected_latency):
+        self.latency = expected_latency
+        self.successes = 0
+        self.misses = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.cooldown = COOLDOWN_SECONDS
+        self.last_error = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def _observe(self, seconds):
+        self.latency = (1 - EWMA_ALPHA) * self.latency + EWMA_ALPHA * seconds
+
+    def record_success(self, seconds):
+        with self._lock:
+            self._observe(seconds)
+            self.successes += 1
+            self.consecutive_failures = 0
+            self.probing = False
+            self.cooldown = COOLDOWN_SECONDS
+
+    def record_miss(self, seconds):
+        with self._lock:
+            self._observe(seconds)
+            self.misses += 1
+            self.consecutive_failures = 0
+            self.probing = False
+
+    def record_failure(self, seconds, error):
+        with self._lock:
+            self._observe(seconds)
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = str(error)[:200]
+            self.probing = False
+            if self.consecutive_failures >= FAILURES_TO_OPEN:
+                # Open (or re-open after a failed half-open probe) with exponential backoff
+                self.open_until = time.time() + self.cooldown
+                self.cooldown = min(self.cooldown * 2, MAX_COOLDOWN_SECONDS)
+
+    def available(self):
+        """Closed, or open but past its cooldown with no half-open probe in flight"""
+        with self._lock:
+            return time.time() >= self.open_until and not self.probing
+
+    def begin_call(self):
+        """
+        Claim a call: always granted while closed; once open, only to the single half-open
+        probe past the cooldown, until that probe is recorded as a success, miss or failure
+
+        Returns:
+            True if the caller may call the provider
+        """
+        with self._lock:
+            if self.consecutive_failures < FAILURES_TO_OPEN:
+                return True
+            if self.probing or time.time() < self.open_until:
+                return False
+            self.probing = True
+            return True
+
+    def expected_cost(self):
+        """Average latency divided by a smoothed success rate"""
+        answered = self.successes + self.misses
+        success_rate = (answered + 1) / (answered + self.failures + 2)
+        return self.latency / success_rate
+
+    def snapshot(self):
+        return {
+            "latency_s": round(self.latency, 3),
+            "successes": self.successes,
+            "misses": self.misses,
+            "failures": self.failures,
+            "circuit_open": not self.available(),
+            "last_error": self.last_error,
+        }
+
+class ElevationProvider:
+    """
+    Base class for an elevation source
+
+    Tile providers implement fetch_tile(); point providers implement lookup().
+    Raise ProviderMiss for "no data here" and any other exception for an outage.
+    """
+    name = "provider"
+    serves_tiles = False
+    serves_points = False
+    india_only = False
+    preferred = False   # Ranked ahead of faster providers (higher-resolution data)
+    timeout = 15
+    expected_latency = 5.0
+
+    def fetch_tile(self, tile_lat, tile_lon, path):
+        """Write a validated GeoTIFF for the 1° tile to `path`"""
+        raise NotImplementedError
+
+    def lookup(self, lats, lons):
+        """Elevations for flat coordinate arrays (NaN where unknown)"""
+        raise NotImplementedError
+
+def validate_dem_file(path, description):
+    """
+    Reject downloads that are not real terrain (unreadable, empty, or uniform)
+
+    Raises:
+        ProviderMiss describing why the file was rejected
+    """
+    try:
+        with rasterio.open(path) as src:
+            if src.count == 0 or src.width == 0 or src.height == 0:
+                raise ProviderMiss("empty raster")
+            # Check if data is valid (not all zeros or nodata)
+            data = src.read(1)
+            valid_data = data[(data != src.nodata) & (data != 0) & ~np.isnan(data)]
+    except ProviderMiss:
+        raise
+    except Exception as e:
+        raise ProviderMiss(f"Invalid file format: {e}")
+
+    if len(valid_data) == 0:
+        raise ProviderMiss("No valid data")
+
+    # CRITICAL: Check if data actually varies (not uniform)
+    # Require at least 1m variation and 0.5m standard deviation
+    data_std = np.std(valid_data)
+    data_range = np.max(valid_data) - np.min(valid_data)
+    if data_std < 0.5 or data_range < 1.0:
+        raise ProviderMiss(f"Uniform data (std={data_std:.2f}, range={data_range:.2f})")
+
+    log(f"✅ Successfully downloaded {description}: {len(valid_data)} points, range {np.min(valid_data):.1f}m - {np.max(valid_data):.1f}m")
+
+class HttpTileProvider(ElevationProvider):
+    """Downloads a whole 1° tile from a URL template and validates it"""
+    serves_tiles = True
+
+    def __init__(self, name, url_template, description, india_only=False, timeout=15, expected_latency=5.0):
+        self.name = name
+        self.url_template = url_template
+        self.description = description
+        self.india_only = india_only
+        self.timeout = timeout
+        self.expected_latency = expected_latency
+
+    def url(self, tile_lat, tile_lon):
+        from utils import get_srtm_tile_name
+        return self.url_template.format(lat=tile_lat, lon=tile_lon, srtm=get_srtm_tile_name(tile_lat, tile_lon))
+
+    def fetch_tile(self, tile_lat, tile_lon, path):
+        url = self.url(tile_lat, tile_lon)
+        log(f"Trying {self.description}: {url}")
+
+        r = requests.get(url, timeout=self.timeout, headers={'User-Agent': 'Permaculture-App/1.0'}, allow_redirects=True)
+        if r.status_code >= 500:
+            raise Exception(f"HTTP {r.status_code}")
+        if r.status_code != 200 or len(r.content) <= 1000:
+            raise ProviderMiss(f"HTTP {r.status_code}, content length: {len(r.content)}")
+
+        # Validate under a temporary name; only a good tile is renamed into the cache
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(r.content)
+            validate_dem_file(tmp_path, self.description)
+            os.replace(tmp_path, path)
+            dem_store.evict(path)
+            raster_pool.evict(path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+class LocalCacheProvider(ElevationProvider):
+    """Tiles already on disk (answers in-process, so it is almost always ranked first)"""
+    name = "local_cache"
+    serves_tiles = True
+    serves_points = True
+    expected_latency = 0.01
+
+    def fetch_tile(self, tile_lat, tile_lon, path):
+        if not os.path.exists(path):
+            raise ProviderMiss("not cached")
+
+    def lookup(self, lats, lons):
+        from dem import sample_elevations
+        values = sample_elevations(lats, lons, cached_only=True)
+        if np.all(np.isnan(values)):
+            raise ProviderMiss("no cached tile covers these points")
+        return values
+
+class UserDEMProvider(ElevationProvider):
+    """User-uploaded rasters (drone surveys etc.), finest resolution first"""
+    name = "user_dem"
+    serves_points = True
+    preferred = True
+    expected_latency = 0.02
+
+    def lookup(self, lats, lons):
+        values = user_dem.sample_user_dems(lats, lons)
+        if np.all(np.isnan(values)):
+            raise ProviderMiss("no user DEM covers these points")
+        return values
+
+class OpenElevationProvider(ElevationProvider):
+    """Public OpenElevation point API"""
+    name = "open_elevation"
+    serves_points = True
+    timeout = 30
+    expected_latency = 8.0
+
+    def lookup(self, lats, lons):
+        from utils import fetch_elevations_api
+        values = fetch_elevations_api(lats, lons, timeout=self.timeout).astype(np.float64)
+        if np.all(np.isnan(values)):
+            raise Exception("no elevations returned")
+        return values
+
+class ProviderRegistry:
+    """Orders providers by health and routes tile and point requests through them"""
+
+    def __init__(self, providers):
+        self.providers = list(providers)
+        self.health = {p.name: ProviderHealth(p.expected_latency) for p in self.providers}
+
+    def ordered(self, kind, is_india=True):
+        candidates = [
+            p for p in self.providers
+            if getattr(p, f"serves_{kind}") and (is_india or not p.india_only)
+        ]
+        healthy = [p for p in candidates if self.health[p.name].available()]
+        skipped = len(candidates) - len(healthy)
+        if skipped:
+            log(f"Skipping {skipped} {kind} provider(s) with open circuits")
+        # Stable sort keeps the configured order among providers with equal cost
+        return sorted(healthy, key=lambda p: (not p.preferred, self.health[p.name].expected_cost()))
+
+    def _call(self, provider, func, *args):
+        health = self.health[provider.name]
+        if not health.begin_call():
+            raise CircuitOpen(provider.name)
+        start = time.time()
+        try:
+            result = func(*args)
+        except ProviderMiss as e:
+            health.record_miss(time.time() - start)
+            log(f"{getattr(provider, 'description', provider.name)}: {e}")
+            raise
+        except Exception as e:
+            health.record_failure(time.time() - start, e)
+            log(f"{getattr(provider, 'description', provider.name)}: Error - {e}")
+            raise
+        health.record_success(time.time() - start)
+        return result
+
+    def fetch_tile(self, tile_lat, tile_lon, path, is_india=True):
+        """Try tile providers in order; returns the provider name that produced `path`, or None"""
+        for provider in self.ordered("tiles", is_india):
+            try:
+                self._call(provider, provider.fetch_tile, tile_lat, tile_lon, path)
+                return provider.name
+            except Exception:
+                continue
+        return None
+
+    def lookup(self, lats, lons):
+        """
+        Elevations for coordinate arrays, filling gaps provider by provider
+
+        Returns:
+            float64 array shaped like `lats`, NaN where no provider had data
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        flat_lats = lats.ravel()
+        flat_lons = np.asarray(lons, dtype=np.float64).ravel()
+        values = np.full(flat_lats.shape, np.nan, dtype=np.float64)
+
+        for provider in self.ordered("points"):
+            missing = np.isnan(values)
+            if not np.any(missing):
+                break
+            try:
+                found = self._call(provider, provider.lookup, flat_lats[missing], flat_lons[missing])
+            except Exception:
+                continue
+            values[missing] = found
+            log(f"{provider.name} answered {int(np.count_nonzero(~np.isnan(found)))}/{int(missing.sum())} points")
+
+        return values.reshape(lats.shape)
+
+    def stats(self):
+        return {name: health.snapshot() for name, health in self.health.items()}
+
+registry = ProviderRegistry([
+    LocalCacheProvider(),
+    UserDEMProvider(),
+    HttpTileProvider("terrain_tiles", "https://s3.amazonaws.com/elevation-tiles-prod/terrarium/{lat}/{lon}.png",
+                     "Terrain Tiles SRTM 30m", india_only=True, expected_latency=3.0),
+    # SRTM GeoTIFFs with correct naming: N/S + lat + E/W + lon (e.g. N26E088)
+    HttpTileProvider("srtm_skadi", "https://s3.amazonaws.com/elevation-tiles-prod/skadi/{srtm}.tif",
+                     "SRTM 30m via AWS Skadi (correct naming)", expected_latency=4.0),
+    HttpTileProvider("srtm_skadi_alt", "https://elevation-tiles-prod.s3.amazonaws.com/skadi/{srtm}.tif",
+                     "SRTM 30m via AWS (alt)", expected_latency=4.5),
+    HttpTileProvider("mapbox_terrain",
+                     "https://api.mapbox.com/v4/mapbox.terrain-rgb/{lon}/{lat}/10.pngraw?access_token=pk.eyJ1IjoibWFwYm94IiwiYSI6ImNpejY4NXV4NTYyZ2gycXA4N2pmbDZmangifQ.-g_vE53SD2WrJ6tFX7QHmA",
+                     "Mapbox Terrain RGB (SRTM-based)", india_only=True, expected_latency=5.0),
+    HttpTileProvider("opentopomap", "https://opentopomap.org/dem/{lat}_{lon}.tif",
+                     "OpenTopoMap DEM (SRTM-based)", expected_latency=6.0),
+    OpenElevationProvider(),
+])
+
+def fetch_tile(tile_lat, tile_lon, path, is_india=True):
+    return registry.fetch_tile(tile_lat, tile_lon, path, is_india)
+
+def lookup_elevations(lats, lons):
+    return registry.lookup(lats, lons)
+
+def stats():
+    return registry.stats()
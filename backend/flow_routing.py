@@ -0,0 +1,806 @@
+# flow_routing.py – Built-in hydrology engine: depression filling, D8 routing, accumulation, streams, ponds
+# Used by hydro.py when whitebox is unavailable (or fails); everything runs in-process on the
+# bbox window, so no GeoTIFF round trips through /tmp.
+import heapq
+import math
+from collections import deque
+import numpy as np
+from rasterio import features
+
+from raster_vector import METERS_PER_DEG_LAT, METERS_PER_DEG_LON
+
+try:
+    from scipy import ndimage, sparse
+    from scipy.sparse import csgraph
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+
+# D8 neighbours as (row, col) steps, clockwise from east; direction codes index this tuple
+D8_STEPS = ((0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1))
+# Code for cells with no downslope neighbour (outlets on the window edge or next to nodata)
+NO_FLOW = -1
+# Floor for epsilon raises, so cells at sea level still get a visible gradient
+_ULP_ONE = math.ulp(1.0)
+
+def _seed_cells(nodata):
+    """Valid cells of a NaN-bordered grid that touch the border or a nodata hole"""
+    height, width = nodata.shape[0] - 2, nodata.shape[1] - 2
+    touches_nodata = np.zeros_like(nodata)
+    for dr, dc in D8_STEPS:
+        touches_nodata[1:-1, 1:-1] |= nodata[1 + dr:height + 1 + dr, 1 + dc:width + 1 + dc]
+    return touches_nodata & ~nodata
+
+def fill_depressions(dem_data, epsilon=True):
+    """
+    Depression filling with the priority-flood result (Barnes et al. 2014)
+
+    Cells are flooded inwards from the window edge and nodata holes in elevation order;
+    any cell lower than the cell it was reached from is raised to it. With epsilon the
+    raise adds the smallest float increments, so filled flats keep a gradient towards
+    their outlet and every cell gets a D8 direction.
+
+    Runs vectorized on the basin graph (scipy) when available, otherwise as a pure-Python
+    priority queue.
+
+    Args:
+        dem_data: 2D elevation array, NaN for nodata
+        epsilon: Give filled areas a minimal drainage gradient
+
+    Returns:
+        float64 array shaped like dem_data
+    """
+    height, width = dem_data.shape
+    # A NaN border means the window edge needs no bounds checks and acts as the outlet
+    padded = np.full((height + 2, width + 2), np.nan)
+    padded[1:-1, 1:-1] = dem_data
+    nodata = np.isnan(padded)
+    seeds = _seed_cells(nodata)
+    if not seeds.any():
+        return padded[1:-1, 1:-1]
+
+    if SCIPY_AVAILABLE:
+        filled = _fill_basins(padded, nodata, seeds)
+        if epsilon:
+            filled = _drain_flats(filled, nodata, seeds)
+    else:
+        filled = _fill_priority_flood(padded, nodata, seeds, epsilon)
+    return filled[1:-1, 1:-1]
+
+def _fill_basins(padded, nodata, seeds):
+    """
+    Plain fill from the basin graph, vectorized (scipy)
+
+    Cells follow their lowest neighbour to a terminal: a seed (outlet) or a closed pit, where
+    flat pits that touch an equally high draining cell continue through it. Adjacent basins
+    are joined by their lowest crossing, and the minimax route from the outlets to every
+    basin, read off a minimum spanning tree, is the level it fills to. Only the (few) basins
+    are visited one at a time.
+    """
+    height, width = padded.shape
+    size = height * width
+    inner = (slice(1, -1), slice(1, -1))
+    z = np.where(nodata, np.inf, padded)
+    index = np.arange(size, dtype=np.int32 if size < 2 ** 31 else np.int64).reshape(height, width)
+
+    # Lowest neighbour as a D8 code; seeds are outlets
+    code = np.full((height - 2, width - 2), NO_FLOW, dtype=np.int8)
+    lowest = z[inner]
+    for c, (dr, dc) in enumerate(D8_STEPS):
+        neighbour = z[1 + dr:height - 1 + dr, 1 + dc:width - 1 + dc]
+        np.putmask(code, neighbour < lowest, c)
+        lowest = np.minimum(lowest, neighbour)
+    code[seeds[inner] | nodata[inner]] = NO_FLOW
+    step = np.array([dr * width + dc for dr, dc in D8_STEPS] + [0], dtype=index.dtype)
+    receiver = index.copy()
+    receiver[inner] += step[code]
+    pits = np.zeros_like(nodata)
+    pits[inner] = (code == NO_FLOW) & ~nodata[inner] & ~seeds[inner]
+    if not pits.any():
+        return padded.copy()
+
+    # Flat pit patches drain through an equally high neighbour that does drain, if they have one
+    labels, count = ndimage.label(pits, structure=np.ones((3, 3), dtype=bool))
+    target = np.full(count + 1, -1, dtype=index.dtype)
+    for dr, dc in D8_STEPS:
+        neighbour = (slice(1 + dr, height - 1 + dr), slice(1 + dc, width - 1 + dc))
+        exit_ = pits[inner] & ~pits[neighbour] & ~nodata[neighbour] & (z[neighbour] == z[inner])
+        target[labels[inner][exit_]] = index[neighbour][exit_]
+    pit_cells = np.flatnonzero(pits)
+    pit_labels = labels.ravel()[pit_cells]
+    representative = np.full(count + 1, -1, dtype=index.dtype)
+    representative[pit_labels] = pit_cells
+    receiver = receiver.ravel()
+    receiver[pit_cells] = np.where(target[pit_labels] >= 0, target[pit_labels], representative[pit_labels])
+
+    closed = np.unique(representative[1:][target[1:] < 0])
+    if closed.size == 0:
+        return padded.copy()
+    # Each tree of the receiver forest drains to one terminal
+    moves = receiver != index.ravel()
+    indptr = np.zeros(size + 1, dtype=index.dtype)
+    np.cumsum(moves, out=indptr[1:])
+    forest = sparse.csr_matrix((np.ones(indptr[-1], dtype=np.int8), receiver[moves], indptr), shape=(size, size))
+    _, component = csgraph.connected_components(forest, directed=True, connection="weak")
+    basin_of = np.zeros(component.max() + 1, dtype=index.dtype)
+    basin_of[component[closed]] = np.arange(1, closed.size + 1)
+    basin = basin_of[component].reshape(height, width)
+
+    # Lowest crossing between each pair of adjacent basins
+    pairs, levels = [], []
+    for dr, dc in D8_STEPS[:4]:
+        a = (slice(0, height - dr), slice(max(0, -dc), width - max(0, dc)))
+        b = (slice(dr, height), slice(max(0, dc), width - max(0, -dc)))
+        cross = (basin[a] != basin[b]) & ~nodata[a] & ~nodata[b]
+        ba, bb = basin[a][cross].astype(np.int64), basin[b][cross].astype(np.int64)
+        pairs.append(np.minimum(ba, bb) * (closed.size + 1) + np.maximum(ba, bb))
+        levels.append(np.maximum(z[a], z[b])[cross])
+    pairs = np.concatenate(pairs)
+    levels = np.concatenate(levels)
+    order = np.argsort(pairs)
+    pairs, levels = pairs[order], levels[order]
+    first = np.flatnonzero(np.r_[True, pairs[1:] != pairs[:-1]])
+    pairs, levels = pairs[first], np.minimum.reduceat(levels, first)
+
+    # Ranks keep the MST weights exact and positive; minimax levels map back to elevations
+    values, rank = np.unique(levels, return_inverse=True)
+    nodes = closed.size + 1
+    graph = sparse.csr_matrix((rank + 1.0, (pairs // nodes, pairs % nodes)), shape=(nodes, nodes))
+    tree = csgraph.minimum_spanning_tree(graph)
+    tree = (tree + tree.T).tocsr()
+    visit, parent = csgraph.breadth_first_order(tree, 0, directed=False, return_predecessors=True)
+    edge_rank = np.asarray(tree[parent[visit[1:]], visit[1:]]).ravel().astype(np.int64) - 1
+    # Parents come first in breadth-first order; a route's level is its highest crossing
+    spill = [-1] * nodes
+    for node, up, r in zip(visit[1:].tolist(), parent[visit[1:]].tolist(), edge_rank.tolist()):
+        spill[node] = max(spill[up], r)
+    spill = np.array(spill)
+    spill_level = np.where(spill >= 0, values[np.maximum(spill, 0)], -np.inf)
+
+    filled = np.maximum(padded, spill_level[basin])
+    filled[nodata] = np.nan
+    return filled
+
+def _drain_flats(filled, nodata, seeds):
+    """
+    Raise flat cells by float increments that grow with their distance from a drain
+
+    A flat cell has no lower neighbour and is not a seed. One breadth-first search over
+    equal-level neighbours, started from every cell that does drain (or is a seed), gives
+    each flat cell its step distance to a drain; raising it by that many increments leaves
+    a neighbour one step closer, and lower. Distances only depend on the flat itself, so a
+    refill of a sub-window reproduces them.
+    """
+    height, width = filled.shape[0] - 2, filled.shape[1] - 2
+    inner = (slice(1, -1), slice(1, -1))
+    z = filled[inner]
+    has_lower = np.zeros(z.shape, dtype=bool)
+    for dr, dc in D8_STEPS:
+        # NaN neighbours compare False
+        has_lower |= filled[1 + dr:height + 1 + dr, 1 + dc:width + 1 + dc] < z
+    flat = ~nodata[inner] & ~seeds[inner] & ~has_lower
+    if not flat.any():
+        return filled
+
+    # Edges between equal-level neighbours where at least one end is flat
+    links = []
+    member = flat.copy()
+    for dr, dc in D8_STEPS[:4]:
+        a = (slice(0, height - dr), slice(max(0, -dc), width - max(0, dc)))
+        b = (slice(dr, height), slice(max(0, dc), width - max(0, -dc)))
+        link = (z[a] == z[b]) & (flat[a] | flat[b])
+        member[a] |= link
+        member[b] |= link
+        links.append((a, b, link))
+    ids = np.cumsum(member).reshape(height, width) - 1
+    count = int(member.sum())
+    heads = np.concatenate([ids[a][link] for a, b, link in links])
+    tails = np.concatenate([ids[b][link] for a, b, link in links])
+    # A virtual node joined to every draining member starts the search everywhere at once
+    sources = ids[member & ~flat]
+    heads = np.concatenate([heads, np.full(sources.size, count)])
+    tails = np.concatenate([tails, sources])
+    graph = sparse.csr_matrix((np.ones(heads.size, dtype=np.int8), (heads, tails)), shape=(count + 1, count + 1))
+    _, parent = csgraph.breadth_first_order(graph, count, directed=False, return_predecessors=True)
+    parent[parent < 0] = count
+    # Steps to a drain by pointer doubling along the search tree (drains themselves are 0)
+    steps = (parent != count).astype(np.int32)
+    jump = parent
+    active = np.flatnonzero(jump != count)
+    while active.size:
+        steps[active] += steps[jump[active]]
+        jump[active] = jump[jump[active]]
+        active = active[jump[active] != count]
+
+    level = z[member]
+    raised = z.copy()
+    raised[member] = level + steps[:-1] * _increment(level)
+    filled[inner] = raised
+    return filled
+
+def _increment(level):
+    """Smallest raise that D8 still sees as a drop (plain ulps vanish near zero elevation)"""
+    return np.maximum(np.spacing(np.abs(level)), _ULP_ONE)
+
+def _fill_priority_flood(padded, nodata, seeds, epsilon):
+    """Heap-based priority-flood over a NaN-bordered grid, O(n log n) in pure Python"""
+    stride = padded.shape[1]
+    seeds = np.flatnonzero(seeds)
+    z = padded.ravel().tolist()
+    closed = bytearray(nodata.ravel().astype(np.uint8).tobytes())
+    for cell in seeds.tolist():
+        closed[cell] = 1
+    heap = [(z[cell], cell) for cell in seeds.tolist()]
+    heapq.heapify(heap)
+
+    offsets = tuple(dr * stride + dc for dr, dc in D8_STEPS)
+    # Cells raised into a depression are drained from a FIFO queue, which skips the heap
+    pit = deque()
+    while heap or pit:
+        if pit:
+            cell = pit.popleft()
+            level = z[cell]
+        else:
+            level, cell = heapq.heappop(heap)
+        for offset in offsets:
+            neighbour = cell + offset
+            if closed[neighbour]:
+                continue
+            closed[neighbour] = 1
+            if z[neighbour] <= level:
+                z[neighbour] = level + max(math.ulp(level), _ULP_ONE) if epsilon else level
+                pit.append(neighbour)
+            else:
+                heapq.heappush(heap, (z[neighbour], neighbour))
+
+    return np.array(z).reshape(padded.shape)
+
+def pixel_distances(shape, transform):
+    """
+    Ground distance in meters to each D8 neighbour for every row (EPSG:4326 grid)
+
+    Returns:
+        (height, 8) array
+    """
+    rows = np.arange(shape[0])
+    row_lats = transform.f + (rows + 0.5) * transform.e
+    size_x = abs(transform.a) * METERS_PER_DEG_LON * np.cos(np.radians(row_lats))
+    size_y = np.full(shape[0], abs(transform.e) * METERS_PER_DEG_LAT)
+    return np.stack([np.hypot(dr * size_y, dc * size_x) for dr, dc in D8_STEPS], axis=1)
+
+def d8_directions(filled, transform, distances=None):
+    """
+    Steepest-descent D8 direction over the full 8-neighbourhood, vectorized
+
+    Args:
+        distances: Optional pixel_distances rows to use instead of deriving them from
+            transform (keeps sub-windows bit-identical with the full grid)
+
+    Returns:
+        int8 array of D8_STEPS indices, NO_FLOW where no neighbour is lower
+    """
+    height, width = filled.shape
+    padded = np.pad(filled, 1, constant_values=np.nan)
+    if distances is None:
+        distances = pixel_distances(filled.shape, transform)
+
+    best_drop = np.zeros(filled.shape)
+    directions = np.full(filled.shape, NO_FLOW, dtype=np.int8)
+    with np.errstate(invalid="ignore"):
+        for code, (dr, dc) in enumerate(D8_STEPS):
+            neighbour = padded[1 + dr:height + 1 + dr, 1 + dc:width + 1 + dc]
+            drop = (filled - neighbour) / distances[:, code][:, None]
+            steeper = drop > best_drop
+            best_drop[steeper] = drop[steeper]
+            directions[steeper] = code
+    return directions
+
+def downstream_index(directions):
+    """
+    Flat index of each cell's D8 receiver
+
+    Returns:
+        int64 array shaped like directions, -1 for NO_FLOW cells
+    """
+    height, width = directions.shape
+    step_rows = np.array([dr for dr, _ in D8_STEPS] + [0])
+    step_cols = np.array([dc for _, dc in D8_STEPS] + [0])
+    rows, cols = np.indices(directions.shape)
+    # NO_FLOW (-1) picks the trailing zero step
+    target = (rows + step_rows[directions]) * width + cols + step_cols[directions]
+    return np.where(directions == NO_FLOW, -1, target)
+
+def flow_accumulation(downstream, weights=None):
+    """
+    Upstream cell count (or weight sum) per cell in O(n), by topological order of the D8 graph
+
+    Cells are released level by level once all their donors are done (indegree reaches
+    zero), so each level is a single vectorized step.
+
+    Args:
+        downstream: Flat receiver index per cell (see downstream_index), -1 for none
+        weights: Optional per-cell contribution (defaults to 1, counting the cell itself)
+
+    Returns:
+        (accumulation, levels): float64 array shaped like downstream, and the flat cell
+        indices grouped by level; every donor sits in an earlier level than its receiver
+    """
+    receivers = downstream.ravel()
+    n = receivers.size
+    acc = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64).ravel().copy()
+    has_receiver = receivers >= 0
+    indegree = np.bincount(receivers[has_receiver], minlength=n)
+
+    levels = []
+    frontier = np.flatnonzero(indegree == 0)
+    while frontier.size:
+        levels.append(frontier)
+        donors = frontier[has_receiver[frontier]]
+        targets = receivers[donors]
+        np.add.at(acc, targets, acc[donors])
+        np.subtract.at(indegree, targets, 1)
+        targets = np.unique(targets)
+        frontier = targets[indegree[targets] == 0]
+    return acc.reshape(downstream.shape), levels
+
+def subgraph_levels(receivers, mask):
+    """
+    Topological levels of the D8 graph restricted to the cells in a flat boolean mask
+
+    Returns:
+        list of flat cell index arrays, as flow_accumulation's levels
+    """
+    cells = np.flatnonzero(mask)
+    position = np.full(receivers.size, -1, dtype=np.int64)
+    position[cells] = np.arange(cells.size)
+    targets = receivers[cells]
+    sub_receivers = np.where(targets >= 0, position[np.maximum(targets, 0)], -1)
+    _, levels = flow_accumulation(sub_receivers)
+    return [cells[level] for level in levels]
+
+def strahler_order(downstream, streams, levels, known=None):
+    """
+    Strahler order of stream cells, propagated level by level (see flow_accumulation)
+
+    A cell takes the highest order among its stream donors, plus one where two or more
+    donors share that order; sources are order 1.
+
+    Args:
+        known: Optional order grid for the cells outside `levels`; only the cells in
+            `levels` are recomputed, fed by their known stream donors
+
+    Returns:
+        int16 array shaped like downstream, 0 off the stream network
+    """
+    receivers = downstream.ravel()
+    is_stream = streams.ravel()
+    n = receivers.size
+    strahler = np.zeros(n, dtype=np.int16) if known is None else known.ravel().astype(np.int16)
+    max_in = np.zeros(n, dtype=np.int16)
+    count_max = np.zeros(n, dtype=np.int64)
+
+    def merge(donors):
+        # Fold the donors' orders into the running (max, count of max) of their receivers
+        donors = donors[is_stream[receivers[donors]]]
+        if not donors.size:
+            return
+        targets, inverse = np.unique(receivers[donors], return_inverse=True)
+        level_max = np.zeros(targets.size, dtype=np.int16)
+        np.maximum.at(level_max, inverse, strahler[donors])
+        level_count = np.bincount(inverse[strahler[donors] == level_max[inverse]], minlength=targets.size)
+        higher = level_max > max_in[targets]
+        same = level_max == max_in[targets]
+        max_in[targets[higher]] = level_max[higher]
+        count_max[targets[higher]] = level_count[higher]
+        count_max[targets[same]] += level_count[same]
+
+    if known is not None and levels:
+        inside = np.zeros(n, dtype=bool)
+        inside[np.concatenate(levels)] = True
+        strahler[inside] = 0
+        outside = np.flatnonzero(is_stream & ~inside & (receivers >= 0))
+        merge(outside[inside[receivers[outside]]])
+
+    for level in levels:
+        cells = level[is_stream[level]]
+        if not cells.size:
+            continue
+        strahler[cells] = np.where(count_max[cells] >= 2, max_in[cells] + 1, np.maximum(max_in[cells], 1))
+        merge(cells[receivers[cells] >= 0])
+    return strahler.reshape(downstream.shape)
+
+def extract_streams(downstream, accumulation, threshold, transform, levels=None, strahler=None, starts=None):
+    """
+    Trace cells with accumulation >= threshold into multi-vertex stream links
+
+    A link starts at a source (no stream donors) or a confluence (two or more) and
+    follows D8 receivers until the next confluence or the end of the network.
+
+    Args:
+        levels: Topological levels of the whole grid (see flow_accumulation); when
+            omitted they are computed for the stream cells alone
+        strahler: Precomputed strahler_order grid (levels are then not needed)
+        starts: Optional flat indices; only links starting at one of them are traced
+
+    Returns:
+        list of dicts with 'coordinates' (pixel-centre lon/lat), 'strahler', 'accumulation'
+        (cells draining through the link's last vertex) and 'cells' (flat indices)
+    """
+    receivers = downstream.ravel()
+    acc = accumulation.ravel()
+    streams = accumulation >= threshold
+    is_stream = streams.ravel()
+    if strahler is None:
+        if levels is None:
+            levels = subgraph_levels(receivers, is_stream)
+        strahler = strahler_order(downstream, streams, levels)
+    strahler = strahler.ravel()
+
+    stream_cells = np.flatnonzero(is_stream)
+    targets = receivers[stream_cells]
+    targets = targets[(targets >= 0)]
+    stream_in = np.bincount(targets[is_stream[targets]], minlength=receivers.size)
+    if starts is not None:
+        stream_cells = np.unique(np.asarray(starts, dtype=np.int64))
+        stream_cells = stream_cells[is_stream[stream_cells]]
+
+    width = downstream.shape[1]
+    receivers_list = receivers.tolist()
+    links = []
+    for start in stream_cells[stream_in[stream_cells] != 1].tolist():
+        cells = [start]
+        cell = receivers_list[start]
+        while cell >= 0 and is_stream[cell]:
+            cells.append(cell)
+            if stream_in[cell] != 1:
+                # Confluence: it ends this link and starts its own
+                break
+            cell = receivers_list[cell]
+        if len(cells) < 2:
+            continue
+        path = np.array(cells)
+        lons = transform.c + (path % width + 0.5) * transform.a
+        lats = transform.f + (path // width + 0.5) * transform.e
+        links.append({
+            'coordinates': np.column_stack([lons, lats]).tolist(),
+            'strahler': int(strahler[start]),
+            'accumulation': float(acc[path[-1]]),
+            'cells': path,
+        })
+    return links
+
+def update_streams(links, strahler, downstream, accumulation, threshold, transform, region, dirty=None):
+    """
+    extract_streams after some cells changed receiver, retracing only the links they touch
+
+    Stream status, order and accumulation can only change in cells downstream of a
+    changed receiver, so links clear of that region (and of `dirty`) are kept as they are.
+
+    Args:
+        links, strahler: extract_streams links and strahler_order grid before the change
+        region: Flat bool mask holding every cell whose receiver or accumulation changed,
+            closed downstream (see update_accumulation)
+        dirty: Optional flat bool mask of further cells whose links must be retraced
+
+    Returns:
+        (links, strahler) as for the whole grid, links ordered by start cell
+    """
+    receivers = downstream.ravel()
+    streams = accumulation >= threshold
+    strahler = strahler_order(downstream, streams, subgraph_levels(receivers, region), known=strahler)
+
+    touched = region if dirty is None else region | dirty
+    kept = []
+    starts = [np.flatnonzero(touched & streams.ravel())]
+    for link in links:
+        if touched[link['cells']].any():
+            # Upstream of the touched cells its path is unchanged, so it starts where it did
+            starts.append(link['cells'][:1])
+        else:
+            kept.append(link)
+    traced = extract_streams(downstream, accumulation, threshold, transform, strahler=strahler,
+                             starts=np.concatenate(starts))
+    return sorted(kept + traced, key=lambda link: int(link['cells'][0])), strahler
+
+def stream_pour_points(downstream, accumulation, threshold):
+    """
+    Automatic pour points: stream cells that flow into a confluence, and stream outlets
+
+    Returns:
+        flat cell indices
+    """
+    receivers = downstream.ravel()
+    cells = np.flatnonzero(accumulation.ravel() >= threshold)
+    targets = receivers[cells]
+    outlet = targets < 0
+    # Receivers of stream cells are stream cells too (accumulation only grows downstream)
+    stream_in = np.bincount(targets[~outlet], minlength=receivers.size)
+    into_confluence = ~outlet & (stream_in[np.where(outlet, 0, targets)] >= 2)
+    return cells[outlet | into_confluence]
+
+def label_watersheds(downstream, levels, pour_cells):
+    """
+    Watershed label per cell, by walking the D8 graph from the outlets upstream in O(n)
+
+    Levels (see flow_accumulation) are visited in reverse, so each receiver is labelled
+    before its donors copy its label. A pour point starts its own watershed.
+
+    Returns:
+        int32 array shaped like downstream: 1..len(pour_cells), 0 where no pour point is reached
+    """
+    receivers = downstream.ravel()
+    labels = np.zeros(receivers.size, dtype=np.int32)
+    labels[pour_cells] = np.arange(1, len(pour_cells) + 1)
+    for level in reversed(levels):
+        cells = level[(labels[level] == 0) & (receivers[level] >= 0)]
+        labels[cells] = labels[receivers[cells]]
+    return labels.reshape(downstream.shape)
+
+def update_watersheds(downstream, labels, pour_cells, old_pour_cells, changed):
+    """
+    label_watersheds after some cells changed receiver or the pour points moved
+
+    Only cells whose path reaches a changed cell or a moved pour point before any other
+    pour point can change watershed; the search upstream stops at unmoved pour points.
+
+    Args:
+        labels: label_watersheds grid for old_pour_cells before the change
+        pour_cells, old_pour_cells: Sorted flat indices of the pour points after and before
+        changed: Flat indices of cells whose D8 receiver changed
+
+    Returns:
+        (labels, relabelled): the label_watersheds grid for pour_cells, and a flat bool
+        mask of the cells that were labelled afresh
+    """
+    receivers = downstream.ravel()
+    pour_cells = np.asarray(pour_cells, dtype=np.int64)
+    old_pour_cells = np.asarray(old_pour_cells, dtype=np.int64)
+    seeds = np.union1d(np.asarray(changed, dtype=np.int64), np.setxor1d(pour_cells, old_pour_cells))
+    barrier = np.zeros(receivers.size, dtype=bool)
+    barrier[pour_cells] = True
+    barrier[seeds] = False
+    relabelled = upstream_mask(downstream, seeds, barrier=barrier).ravel()
+
+    # Renumber the kept watersheds for the new pour point list
+    position = np.searchsorted(pour_cells, old_pour_cells)
+    kept = position < pour_cells.size
+    kept[kept] = pour_cells[position[kept]] == old_pour_cells[kept]
+    renumber = np.zeros(old_pour_cells.size + 1, dtype=np.int32)
+    renumber[1:][kept] = position[kept] + 1
+    new_labels = renumber[labels.ravel()]
+
+    new_labels[relabelled] = 0
+    new_labels[pour_cells] = np.arange(1, pour_cells.size + 1)
+    for level in reversed(subgraph_levels(receivers, relabelled)):
+        cells = level[(new_labels[level] == 0) & (receivers[level] >= 0)]
+        new_labels[cells] = new_labels[receivers[cells]]
+    return new_labels.reshape(downstream.shape), relabelled
+
+def pixel_areas(shape, transform):
+    """
+    Ground area in m² of every pixel (EPSG:4326 grid)
+
+    Returns:
+        float64 array shaped like the grid
+    """
+    row_lats = transform.f + (np.arange(shape[0]) + 0.5) * transform.e
+    row_area = (abs(transform.a) * METERS_PER_DEG_LON * np.cos(np.radians(row_lats))
+                * abs(transform.e) * METERS_PER_DEG_LAT)
+    return np.broadcast_to(row_area[:, None], shape)
+
+def label_regions(mask):
+    """
+    8-connected component labels of a boolean raster
+
+    Returns:
+        (int32 labels, count); 0 outside the mask
+    """
+    if SCIPY_AVAILABLE:
+        labels, count = ndimage.label(mask, structure=np.ones((3, 3), dtype=bool))
+        return labels.astype(np.int32, copy=False), count
+    # Without scipy: trace the regions as shapes and burn them back with their index
+    shapes = [geom for geom, _ in features.shapes(mask.astype(np.uint8), mask=mask, connectivity=8)]
+    if not shapes:
+        return np.zeros(mask.shape, dtype=np.int32), 0
+    labels = features.rasterize(zip(shapes, range(1, len(shapes) + 1)), out_shape=mask.shape,
+                                dtype=np.int32, all_touched=False)
+    return np.where(mask, labels, 0).astype(np.int32), len(shapes)
+
+def find_depressions(elevation, filled, transform, min_depth=0.1, areas=None):
+    """
+    Closed depressions: connected cells the fill raised by more than min_depth
+
+    Every statistic is a single bincount/ufunc reduction over the depression cells.
+
+    Args:
+        elevation: Original DEM, NaN for nodata
+        filled: fill_depressions(elevation)
+        min_depth: Fill depth in meters below which a cell is not counted
+        areas: Optional pixel_areas of the grid (for a window cut from a larger one)
+
+    Returns:
+        (labels, stats): int32 label raster (0 outside depressions) and a dict of arrays
+        indexed by label - 1: 'pixels', 'area_m2', 'volume_m3', 'max_depth', 'deepest_cell'
+        (flat index), 'spill_elevation' and 'first_cell' (first flat index in raster order)
+    """
+    depth = np.nan_to_num(filled - elevation)
+    labels, count = label_regions(depth > min_depth)
+
+    flat_labels = labels.ravel()
+    cells = np.flatnonzero(flat_labels)
+    ids = flat_labels[cells]
+    cell_depth = depth.ravel()[cells]
+    if areas is None:
+        areas = pixel_areas(labels.shape, transform)
+    cell_area = areas.ravel()[cells]
+
+    max_depth = np.zeros(count + 1)
+    np.maximum.at(max_depth, ids, cell_depth)
+    # Deepest cell per depression (any one of them on ties)
+    at_max = cell_depth == max_depth[ids]
+    deepest = np.zeros(count + 1, dtype=np.int64)
+    deepest[ids[at_max]] = cells[at_max]
+    deepest = deepest[1:]
+    first = np.full(count + 1, labels.size, dtype=np.int64)
+    np.minimum.at(first, ids, cells)
+
+    stats = {
+        'pixels': np.bincount(ids, minlength=count + 1)[1:],
+        'area_m2': np.bincount(ids, weights=cell_area, minlength=count + 1)[1:],
+        'volume_m3': np.bincount(ids, weights=cell_area * cell_depth, minlength=count + 1)[1:],
+        'max_depth': max_depth[1:],
+        'deepest_cell': deepest,
+        'spill_elevation': filled.ravel()[deepest],
+        'first_cell': first[1:],
+    }
+    return labels, stats
+
+def update_depressions(labels, stats, elevation, filled, transform, changed, min_depth=0.1):
+    """
+    find_depressions after the elevation or fill changed in some cells, re-measuring only
+    the depressions next to them
+
+    A depression clear of the changed cells keeps its extent, so only those touching them
+    are relabelled, on a window around them. Labels follow the first cell in raster order.
+
+    Args:
+        labels, stats: find_depressions output before the change
+        changed: bool raster of cells whose elevation or filled level changed
+
+    Returns:
+        (labels, stats, renumber): as find_depressions on the new grids, and the new label
+        of each old one (indexed by old label, 0 where it was re-measured)
+    """
+    if not changed.any():
+        return labels, stats, np.arange(len(stats['pixels']) + 1, dtype=np.int32)
+    near = dilate(changed)
+    stale = np.unique(labels[near])
+    stale = stale[stale > 0]
+    is_stale = np.zeros(len(stats['pixels']) + 1, dtype=bool)
+    is_stale[stale] = True
+    rows, cols = np.nonzero(near | is_stale[labels])
+    window = (slice(rows.min(), rows.max() + 1), slice(cols.min(), cols.max() + 1))
+    width = labels.shape[1]
+    local, local_stats = find_depressions(elevation[window], filled[window], transform, min_depth,
+                                          areas=pixel_areas(labels.shape, transform)[window])
+
+    # Depressions now touching the changed cells lie inside the window (their other cells
+    # belonged to the stale ones)
+    fresh = np.unique(local[near[window]])
+    fresh = fresh[fresh > 0]
+    local_width = local.shape[1]
+    for key in ('deepest_cell', 'first_cell'):
+        cells = local_stats[key]
+        local_stats[key] = (window[0].start + cells // local_width) * width + window[1].start + cells % local_width
+
+    kept = np.flatnonzero(~is_stale[1:])
+    merged = {key: np.concatenate([stats[key][kept], local_stats[key][fresh - 1]]) for key in stats}
+    order = np.argsort(merged['first_cell'], kind="stable")
+    merged = {key: values[order] for key, values in merged.items()}
+    new_label = np.empty(order.size, dtype=np.int32)
+    new_label[order] = np.arange(1, order.size + 1)
+
+    renumber = np.zeros(len(stats['pixels']) + 1, dtype=np.int32)
+    renumber[kept + 1] = new_label[:kept.size]
+    new_labels = renumber[labels]
+    local_renumber = np.zeros(len(local_stats['pixels']) + 1, dtype=np.int32)
+    local_renumber[fresh] = new_label[kept.size:]
+    new_labels[window] = np.where(local_renumber[local] > 0, local_renumber[local], new_labels[window])
+    return new_labels, merged, renumber
+
+def dilate(mask):
+    """Grow a boolean raster by one cell in all 8 directions"""
+    height, width = mask.shape
+    padded = np.pad(mask, 1)
+    grown = mask.copy()
+    for dr, dc in D8_STEPS:
+        grown |= padded[1 + dr:height + 1 + dr, 1 + dc:width + 1 + dc]
+    return grown
+
+def upstream_mask(downstream, seeds, barrier=None):
+    """
+    Seed cells and every cell that drains into them
+
+    Breadth-first over donor lists built with one argsort (CSR layout), one vectorized
+    step per upstream ring.
+
+    Args:
+        barrier: Optional flat bool mask of cells that are reached but not searched past
+
+    Returns:
+        bool array shaped like downstream
+    """
+    receivers = downstream.ravel()
+    donors = np.argsort(receivers, kind="stable")
+    counts = np.bincount(receivers[receivers >= 0], minlength=receivers.size)
+    # Donors of cell c are donors[starts[c]:starts[c] + counts[c]] (the -1s sort first)
+    starts = np.cumsum(counts) - counts + np.count_nonzero(receivers < 0)
+
+    reached = np.zeros(receivers.size, dtype=bool)
+    frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+    reached[frontier] = True
+    while frontier.size:
+        n_donors = counts[frontier]
+        total = int(n_donors.sum())
+        if not total:
+            break
+        offsets = np.arange(total) - np.repeat(np.cumsum(n_donors) - n_donors, n_donors)
+        found = donors[np.repeat(starts[frontier], n_donors) + offsets]
+        frontier = found[~reached[found]]
+        reached[frontier] = True
+        if barrier is not None:
+            frontier = frontier[~barrier[frontier]]
+    return reached.reshape(downstream.shape)
+
+def downstream_mask(downstreams, seeds):
+    """
+    Seed cells and every cell below them along any of the given receiver grids
+
+    Returns:
+        flat bool array
+    """
+    receivers = [downstream.ravel() for downstream in downstreams]
+    reached = np.zeros(receivers[0].size, dtype=bool)
+    frontier = np.unique(np.asarray(seeds, dtype=np.int64))
+    reached[frontier] = True
+    while frontier.size:
+        targets = np.unique(np.concatenate([r[frontier] for r in receivers]))
+        targets = targets[targets >= 0]
+        frontier = targets[~reached[targets]]
+        reached[frontier] = True
+    return reached
+
+def update_accumulation(old_downstream, new_downstream, accumulation, changed):
+    """
+    Flow accumulation after some cells changed receiver, recomputed only below them
+
+    Only cells downstream of a change (along the old or the new routing) can gain or lose
+    upstream area; they are re-accumulated as a subgraph whose inflow from unchanged
+    donors is taken from the old accumulation.
+
+    Args:
+        changed: Flat indices of cells whose D8 receiver changed
+
+    Returns:
+        (accumulation, region): flat bool mask of the cells recomputed, closed downstream
+        along both routings
+    """
+    receivers = new_downstream.ravel()
+    acc = accumulation.ravel().astype(np.float64)
+    region = downstream_mask((old_downstream, new_downstream), changed)
+    cells = np.flatnonzero(region)
+    if not cells.size:
+        return accumulation, region
+
+    # Unchanged donors outside the region feed it with their (unchanged) accumulation
+    has_receiver = receivers >= 0
+    inflow = ~region & has_receiver & region[np.maximum(receivers, 0)]
+    weights = 1 + np.bincount(receivers[inflow], weights=acc[inflow], minlength=acc.size)[cells]
+
+    position = np.full(acc.size, -1, dtype=np.int64)
+    position[cells] = np.arange(cells.size)
+    targets = receivers[cells]
+    sub_receivers = np.where(targets >= 0, position[np.maximum(targets, 0)], -1)
+    sub_acc, _ = flow_accumulation(sub_receivers, weights=weights)
+    acc[cells] = sub_acc
+    return acc.reshape(accumulation.shape), region
@@ -1,7 +1,24 @@
 # hydro.py – Hydrology computation backend
+# Every run works on the bbox window of the DEM. Whitebox jobs get their own scratch directory
+# and run in a bounded pool; finished results are cached per window so repeat requests skip
+# the pipeline entirely.
 import os
 import json
+import math
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
 from utils import download_dem
+from dem import read_dem_window, _elevation
+from rasterio import features
+from lru import LRUCache
+from raster_vector import polygonize
+from flow_routing import (D8_STEPS, NO_FLOW, fill_depressions, d8_directions, downstream_index, flow_accumulation,
+                          subgraph_levels, strahler_order, extract_streams, update_streams, stream_pour_points,
+                          label_watersheds, update_watersheds, pixel_areas, pixel_distances, find_depressions,
+                          update_depressions, label_regions, dilate, upstream_mask, update_accumulation)
 
 # Try to import whitebox, but make it optional
 try:
@@ -9,118 +26,571 @@ try:
     WHITEBOX_AVAILABLE = True
 except ImportError:
     WHITEBOX_AVAILABLE = False
-    print("[HYDRO] Warning: whitebox not available, using simplified hydrology")
+    print("[HYDRO] Warning: whitebox not available, using built-in hydrology")
 
-def run_hydrology(bbox):
+# Upslope cells needed to start a stream (both the whitebox and built-in pipelines)
+STREAM_THRESHOLD = 100
+# User pour points snap to the highest-accumulation cell within this many pixels
+SNAP_PIXELS = 2
+# Pond candidates: cells filled deeper than MIN_POND_DEPTH (m), regions of at least
+# MIN_POND_PIXELS, the MAX_PONDS largest by storage volume
+MIN_POND_DEPTH = 0.1
+MIN_POND_PIXELS = 4
+MAX_PONDS = 50
+
+WORKERS = int(os.environ.get("HYDRO_WORKERS", "2"))
+CACHE_MB = int(os.environ.get("HYDRO_CACHE_MB", "256"))
+# Parent directory for per-run whitebox workspaces (system temp dir by default)
+WORK_FOLDER = os.environ.get("HYDRO_WORK_FOLDER") or None
+
+class HydroResult:
+    """
+    Finished hydrology for one DEM window
+
+    Results derived by apply_edits pass in the parts they carried over or updated locally;
+    whatever is not passed in is computed for the whole window.
+
+    Attributes:
+        geojson: FeatureCollection returned by /hydrology (streams, automatic catchments, ponds)
+        streams: Stream features
+        ponds: Pond candidate features, largest storage first
+        elevation: Original DEM window, NaN for nodata
+        filled: Depression-filled elevation grid
+        accumulation: Upslope cell count per pixel
+        directions: D8 direction codes (see flow_routing.D8_STEPS)
+        transform: Affine transform of the grids
+        source: 'whitebox' or 'builtin'
+        network: (links, strahler) of the built-in stream extraction, None for whitebox streams
+        watersheds: (pour_cells, labels): automatic pour points and their label_watersheds grid
+        catchments: {pour cell: catchment feature} for the automatic pour points
+        depressions: find_depressions (labels, stats) of the pond candidates
+        pond_rings: {depression label: polygon rings} of the depressions traced so far
+    """
+
+    def __init__(self, streams, elevation, filled, accumulation, directions, transform, source, routing=None,
+                 network=None, watersheds=None, catchments=None, depressions=None, pond_rings=None):
+        self.streams = streams
+        self.elevation = elevation
+        self.filled = filled
+        self.accumulation = accumulation
+        self.directions = directions
+        self.transform = transform
+        self.source = source
+        self.network = network
+        if watersheds is None:
+            downstream, levels = routing or (None, None)
+            if downstream is None:
+                downstream = self.downstream()
+                _, levels = flow_accumulation(downstream)
+            pour_cells = stream_pour_points(downstream, accumulation, STREAM_THRESHOLD)
+            watersheds = (pour_cells, label_watersheds(downstream, levels, pour_cells))
+        self.watersheds = watersheds
+        self.catchments = _automatic_catchments(self, catchments or {})
+        self.depressions = depressions or find_depressions(elevation, filled, transform, MIN_POND_DEPTH)
+        self.pond_rings = pond_rings or {}
+        self.ponds = pond_features(self)
+
+        pour_cells = self.watersheds[0]
+        catchment_list = []
+        for label, cell in enumerate(pour_cells.tolist(), start=1):
+            feature = self.catchments.get(cell)
+            if feature is not None:
+                # Ids follow the pour point order, which shifts as pour points come and go
+                catchment_list.append({**feature, 'properties': dict(feature['properties'], id=label)})
+        self.geojson = feature_collection(streams + catchment_list + self.ponds, source)
+
+    def downstream(self):
+        return downstream_index(self.directions)
+
+    def nbytes(self):
+        # The GeoJSON is counted at its serialized size
+        grids = (self.elevation, self.filled, self.accumulation, self.directions, self.watersheds[1],
+                 self.depressions[0])
+        if self.network is not None:
+            grids += (self.network[1],)
+        return sum(grid.nbytes for grid in grids) + len(json.dumps(self.geojson))
+
+_cache = LRUCache(max_entries=64, max_bytes=CACHE_MB * 1024 * 1024, sizeof=lambda result: result.nbytes())
+_pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="hydro")
+
+def run_hydrology(bbox, pour_points=None):
     """
     Generate hydrology data (catchments, flow accumulation, natural ponds)
-    Uses whitebox if available, otherwise returns simplified data
+    Uses whitebox if available, otherwise the built-in flow_routing engine
+
+    Args:
+        bbox: "minx,miny,maxx,maxy" bounding box string
+        pour_points: Optional [(lon, lat), ...] outlets to delineate catchments for;
+            by default catchments drain to stream junctions and outlets
+    """
+    dem_path, minx, miny, maxx, maxy = _dem_for_bbox(bbox)
+    return hydrology_response(load_hydrology(dem_path, minx, miny, maxx, maxy), pour_points)
+
+def edit_hydrology(bbox, edits, pour_points=None):
+    """
+    Hydrology of a bbox after elevation edits (swales, bunds, check dams)
+
+    Fill, flow direction and accumulation are recomputed only around the edits, starting
+    from the cached result for the longest already-applied prefix of `edits`, so adding
+    one structure at a time stays interactive.
+
+    Args:
+        bbox: "minx,miny,maxx,maxy" bounding box string
+        edits: [{"geometry": GeoJSON LineString/Polygon (or Multi-), "height": target
+            elevation in m | "offset": change in m}, ...], applied in order
+        pour_points: As for run_hydrology
+
+    Raises:
+        ValueError for malformed edits
     """
+    for edit in edits:
+        _validate_edit(edit)
+    dem_path, minx, miny, maxx, maxy = _dem_for_bbox(bbox)
+    key = _window_key(dem_path, minx, miny, maxx, maxy)
+    edit_keys = tuple(json.dumps(edit, sort_keys=True) for edit in edits)
+
+    for applied in range(len(edits), 0, -1):
+        result = _cache.get(key + edit_keys[:applied])
+        if result is not None:
+            break
+    else:
+        applied = 0
+        result = load_hydrology(dem_path, minx, miny, maxx, maxy)
+
+    if applied < len(edits):
+        result = _cache.get_or_compute(key + edit_keys, lambda: apply_edits(result, edits[applied:]))
+    return hydrology_response(result, pour_points)
+
+def hydrology_response(result, pour_points=None):
+    """/hydrology FeatureCollection, with catchments for user pour points if given"""
+    if not pour_points:
+        return result.geojson
+    catchments = catchment_features(result, snap_pour_points(result, pour_points))
+    return feature_collection(result.streams + catchments + result.ponds, result.source)
+
+def _dem_for_bbox(bbox):
     minx, miny, maxx, maxy = map(float, bbox.split(","))
     center_lat = (miny + maxy) / 2
     center_lon = (minx + maxx) / 2
-    
+
     # Download DEM
     dem_path = download_dem(center_lat, center_lon, bbox=(minx, miny, maxx, maxy))
-    
+
     if not dem_path or not os.path.exists(dem_path):
         raise Exception("Failed to download DEM for hydrology analysis")
-    
-    # Use whitebox if available
+    return dem_path, minx, miny, maxx, maxy
+
+def _window_key(dem_path, minx, miny, maxx, maxy):
+    return (os.path.abspath(dem_path), os.path.getmtime(dem_path),
+            round(minx, 7), round(miny, 7), round(maxx, 7), round(maxy, 7))
+
+def load_hydrology(dem_path, minx, miny, maxx, maxy):
+    """
+    HydroResult for the DEM pixels covering a bbox, cached per window
+
+    Returns:
+        HydroResult
+    """
+    key = _window_key(dem_path, minx, miny, maxx, maxy)
+    # Identical windows requested concurrently share one job in the bounded pool
+    return _cache.get_or_compute(key, lambda: _pool.submit(_compute, dem_path, minx, miny, maxx, maxy).result())
+
+def _compute(dem_path, minx, miny, maxx, maxy):
+    # Only the bbox (plus a one-pixel halo for the neighbour comparisons), not the whole tile
+    dem_data, transform, nodata = read_dem_window(dem_path, minx, miny, maxx, maxy, halo=1)
     if WHITEBOX_AVAILABLE:
         try:
-            wbt = whitebox.WhiteboxTools()
-            wbt.work_dir = "/tmp"
-
-            filled = "/tmp/filled.tif"
-            flowdir = "/tmp/flowdir.tif"
-            flowacc = "/tmp/flowacc.tif"
-            streams = "/tmp/streams.tif"
-            streams_vec = "/tmp/streams.geojson"
-
-            wbt.fill_depressions(dem_path, filled)
-            wbt.d8_pointer(filled, flowdir)
-            wbt.d8_flow_accumulation(flowdir, flowacc, out_type="cells")
-            wbt.extract_streams(flowacc, streams, threshold=100)
-            wbt.raster_streams_to_vector(streams, flowdir, streams_vec)
-
-            if os.path.exists(streams_vec):
-                return json.load(open(streams_vec))
+            return _run_whitebox(dem_data, transform, nodata)
         except Exception as e:
-            print(f"[HYDRO] Whitebox processing failed: {e}, using simplified approach")
-    
-    # Simplified hydrology (fallback when whitebox not available)
-    # Generate basic flow lines based on DEM slope
-    import numpy as np
-    import rasterio
-    
-    with rasterio.open(dem_path) as src:
-        dem_data = src.read(1)
-        transform = src.transform
-        height, width = dem_data.shape
-        
-        # Simple flow direction calculation
-        features = []
-        
-        # Sample grid for flow lines
-        step = max(1, min(20, width // 50))
-        
-        for i in range(0, height, step):
-            for j in range(0, width, step):
-                if i + 1 >= height or j + 1 >= width:
-                    continue
-                
-                # Calculate local slope direction
-                z = dem_data[i, j]
-                z_right = dem_data[i, j + 1] if j + 1 < width else z
-                z_down = dem_data[i + 1, j] if i + 1 < height else z
-                
-                # Determine flow direction
-                if z_right < z and z_down < z:
-                    # Flow to lower elevation
-                    lon1, lat1 = rasterio.transform.xy(transform, i, j)
-                    lon2, lat2 = rasterio.transform.xy(transform, i + 1, j + 1)
-                    
-                    # Check if within bbox
-                    if minx <= lon1 <= maxx and miny <= lat1 <= maxy:
-                        features.append({
-                            'type': 'Feature',
-                            'geometry': {
-                                'type': 'LineString',
-                                'coordinates': [[lon1, lat1], [lon2, lat2]]
-                            },
-                            'properties': {
-                                'type': 'flow',
-                                'elevation': float(z)
-                            }
-                        })
-        
-        # Create catchments (simplified - based on elevation)
-        catchments = []
-        for i in range(0, height, step * 2):
-            for j in range(0, width, step * 2):
-                lon, lat = rasterio.transform.xy(transform, i, j)
-                if minx <= lon <= maxx and miny <= lat <= maxy:
-                    z = dem_data[i, j]
-                    # Low areas = potential catchments
-                    if z < np.percentile(dem_data[~np.isnan(dem_data)], 30):
-                        catchments.append({
-                            'type': 'Feature',
-                            'geometry': {
-                                'type': 'Point',
-                                'coordinates': [lon, lat]
-                            },
-                            'properties': {
-                                'type': 'catchment',
-                                'elevation': float(z)
-                            }
-                        })
-        
-        return {
-            'type': 'FeatureCollection',
-            'features': features + catchments,
+            print(f"[HYDRO] Whitebox processing failed: {e}, using built-in hydrology")
+    return _run_builtin(dem_data, transform, nodata)
+
+def _run_whitebox(dem_data, transform, nodata):
+    """Five-tool whitebox pipeline in a private workspace that is removed afterwards"""
+    workdir = tempfile.mkdtemp(prefix="hydro-", dir=WORK_FOLDER)
+    try:
+        dem = os.path.join(workdir, "dem.tif")
+        filled = os.path.join(workdir, "filled.tif")
+        flowdir = os.path.join(workdir, "flowdir.tif")
+        flowacc = os.path.join(workdir, "flowacc.tif")
+        streams = os.path.join(workdir, "streams.tif")
+        streams_vec = os.path.join(workdir, "streams.geojson")
+
+        with rasterio.open(dem, "w", driver="GTiff", height=dem_data.shape[0], width=dem_data.shape[1],
+                           count=1, dtype=dem_data.dtype, crs="EPSG:4326", transform=transform,
+                           nodata=nodata) as dst:
+            dst.write(dem_data, 1)
+
+        wbt = whitebox.WhiteboxTools()
+        wbt.work_dir = workdir
+        wbt.set_verbose_mode(False)
+
+        wbt.fill_depressions(dem, filled)
+        wbt.d8_pointer(filled, flowdir)
+        wbt.d8_flow_accumulation(flowdir, flowacc, out_type="cells")
+        wbt.extract_streams(flowacc, streams, threshold=STREAM_THRESHOLD)
+        wbt.raster_streams_to_vector(streams, flowdir, streams_vec)
+
+        if not os.path.exists(streams_vec):
+            return None
+        with open(streams_vec) as f:
+            streams = json.load(f)['features']
+        for feature in streams:
+            feature.setdefault('properties', {})['type'] = 'flow'
+        with rasterio.open(filled) as src:
+            filled_data = _elevation(src.read(1), src.nodata)
+        with rasterio.open(flowacc) as src:
+            accumulation = src.read(1).astype(np.float64)
+        with rasterio.open(flowdir) as src:
+            directions = whitebox_directions(src.read(1), src.nodata)
+        return HydroResult(streams, _elevation(dem_data, nodata), filled_data, accumulation, directions,
+                           transform, 'whitebox')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# Whitebox d8_pointer codes (1 = NE, then clockwise in powers of two) in D8_STEPS order
+WHITEBOX_POINTERS = (2, 4, 8, 16, 32, 64, 128, 1)
+
+def whitebox_directions(pointer, nodata=None):
+    """
+    Built-in D8 direction codes from a whitebox d8_pointer raster
+
+    Returns:
+        int8 array of D8_STEPS indices, NO_FLOW for 0 (no downslope neighbour), nodata and
+        pointers that leave the grid
+    """
+    lookup = np.full(256, NO_FLOW, dtype=np.int8)
+    lookup[list(WHITEBOX_POINTERS)] = np.arange(len(WHITEBOX_POINTERS))
+    valid = np.isfinite(pointer) & (pointer >= 0) & (pointer <= 255)
+    if nodata is not None:
+        valid &= pointer != nodata
+    directions = np.where(valid, lookup[np.where(valid, pointer, 0).astype(np.int64)], NO_FLOW).astype(np.int8)
+
+    height, width = directions.shape
+    rows, cols = np.indices(directions.shape)
+    for code, (dr, dc) in enumerate(D8_STEPS):
+        off_grid = (rows + dr < 0) | (rows + dr >= height) | (cols + dc < 0) | (cols + dc >= width)
+        directions[(directions == code) & off_grid] = NO_FLOW
+    return directions
+
+def _run_builtin(dem_data, transform, nodata):
+    """Built-in hydrology (fallback when whitebox is not available)"""
+    # Depression-filled surface and steepest-descent direction over all 8 neighbours
+    elevation = _elevation(dem_data, nodata)
+    filled = fill_depressions(elevation)
+    directions = d8_directions(filled, transform)
+
+    downstream = downstream_index(directions)
+    accumulation, levels = flow_accumulation(downstream)
+
+    network = stream_network(downstream, accumulation, transform, levels=levels)
+    return HydroResult(stream_features(network[0], filled), elevation, filled, accumulation, directions,
+                       transform, 'builtin', routing=(downstream, levels), network=network)
+
+def stream_network(downstream, accumulation, transform, levels=None):
+    """
+    Stream links and Strahler order grid (see flow_routing.extract_streams)
+
+    Args:
+        levels: Topological levels of the whole grid; by default those of the stream cells
+
+    Returns:
+        (links, strahler)
+    """
+    streams = accumulation >= STREAM_THRESHOLD
+    if levels is None:
+        levels = subgraph_levels(downstream.ravel(), streams.ravel())
+    strahler = strahler_order(downstream, streams, levels)
+    return extract_streams(downstream, accumulation, STREAM_THRESHOLD, transform, strahler=strahler), strahler
+
+def stream_features(links, filled):
+    """Stream network as multi-vertex links with Strahler order"""
+    streams = []
+    for link in links:
+        streams.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': link['coordinates']
+            },
+            'properties': {
+                'type': 'flow',
+                'strahler': link['strahler'],
+                'flow_accumulation': link['accumulation'],
+                'elevation': float(filled.flat[link['cells'][0]])
+            }
+        })
+    return streams
+
+def snap_pour_points(result, points):
+    """
+    Flat cell indices for (lon, lat) pour points, each moved to the highest-accumulation
+    cell within SNAP_PIXELS so it lands on the flow path
+
+    Raises:
+        ValueError when a point lies outside the DEM window
+    """
+    height, width = result.accumulation.shape
+    inverse = ~result.transform
+    cells = []
+    for lon, lat in points:
+        x, y = inverse * (lon, lat)
+        # Floor, not truncation: points just left of / above the window have negative indices
+        col, row = (math.floor(v) if math.isfinite(v) else -1 for v in (x, y))
+        if not (0 <= row < height and 0 <= col < width):
+            raise ValueError(f"Pour point {lon},{lat} is outside the analysis area")
+        rows = slice(max(row - SNAP_PIXELS, 0), row + SNAP_PIXELS + 1)
+        cols = slice(max(col - SNAP_PIXELS, 0), col + SNAP_PIXELS + 1)
+        nearby = np.nan_to_num(result.accumulation[rows, cols], nan=-1)
+        r, c = np.unravel_index(int(np.argmax(nearby)), nearby.shape)
+        cells.append((rows.start + r) * width + cols.start + c)
+    return np.array(cells, dtype=np.int64)
+
+def catchment_features(result, pour_cells, routing=None, labels=None, outlets=None):
+    """
+    Catchment polygons draining to each pour point
+
+    Args:
+        result: HydroResult
+        pour_cells: Flat cell indices of the outlets
+        routing: Optional (downstream, levels) already computed for result.directions
+        labels: Optional label_watersheds grid for pour_cells (routing is then not needed)
+        outlets: Optional labels (pour_cells positions + 1) to build; all by default
+
+    Returns:
+        list of MultiPolygon features with area and outlet properties
+    """
+    if not len(pour_cells):
+        return []
+    if labels is None:
+        downstream, levels = routing or (None, None)
+        if downstream is None:
+            downstream = result.downstream()
+            _, levels = flow_accumulation(downstream)
+        labels = label_watersheds(downstream, levels, pour_cells)
+    build = np.zeros(len(pour_cells) + 1, dtype=bool)
+    if outlets is None:
+        build[1:] = True
+    else:
+        build[np.asarray(outlets, dtype=np.int64)] = True
+    mask = build[labels]
+    rows, cols = np.nonzero(mask)
+    if not rows.size:
+        return []
+
+    # Only the window holding the requested catchments is measured and traced
+    window = (slice(rows.min(), rows.max() + 1), slice(cols.min(), cols.max() + 1))
+    transform = result.transform
+    window_labels, window_mask = labels[window], mask[window]
+    areas = np.bincount(window_labels[window_mask], minlength=len(pour_cells) + 1,
+                        weights=pixel_areas(labels.shape, transform)[window][window_mask])
+
+    polygons = {}
+    for label, rings, _ in polygonize(window_labels, transform, mask=window_mask, connectivity=8,
+                                      offset=(window[0].start, window[1].start)):
+        polygons.setdefault(label, []).append(rings)
+
+    width = labels.shape[1]
+    features = []
+    for label, cell in enumerate(pour_cells.tolist(), start=1):
+        if label not in polygons:
+            continue
+        row, col = divmod(cell, width)
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'MultiPolygon',
+                'coordinates': polygons[label]
+            },
+            'properties': {
+                'type': 'catchment',
+                'id': label,
+                'area_ha': round(float(areas[label]) / 10000, 3),
+                'pour_point': [transform.c + (col + 0.5) * transform.a, transform.f + (row + 0.5) * transform.e],
+                'elevation': float(result.filled[row, col]),
+                'flow_accumulation': float(result.accumulation[row, col])
+            }
+        })
+    return features
+
+def _automatic_catchments(result, carried):
+    """
+    {pour cell: feature} for result.watersheds, building only the pour points not in `carried`
+    """
+    pour_cells, labels = result.watersheds
+    catchments = {}
+    missing = []
+    for label, cell in enumerate(pour_cells.tolist(), start=1):
+        if cell in carried:
+            catchments[cell] = carried[cell]
+        else:
+            missing.append(label)
+    if missing:
+        for feature in catchment_features(result, pour_cells, labels=labels, outlets=missing):
+            catchments[int(pour_cells[feature['properties']['id'] - 1])] = feature
+    return catchments
+
+def pond_features(result):
+    """
+    Natural pond candidates: closed depressions of the original DEM, ranked by storage volume
+
+    Only depressions missing from result.pond_rings are traced (and then added to it).
+
+    Returns:
+        list of MultiPolygon features, rank 1 = largest volume
+    """
+    labels, stats = result.depressions
+    candidates = np.flatnonzero(stats['pixels'] >= MIN_POND_PIXELS)
+    ranked = candidates[np.argsort(-stats['volume_m3'][candidates], kind="stable")][:MAX_PONDS]
+    if not ranked.size:
+        return []
+
+    transform = result.transform
+    polygons = result.pond_rings
+    untraced = [index + 1 for index in ranked.tolist() if index + 1 not in polygons]
+    if untraced:
+        keep = np.zeros(len(stats['pixels']) + 1, dtype=bool)
+        keep[untraced] = True
+        mask = keep[labels]
+        rows, cols = np.nonzero(mask)
+        window = (slice(rows.min(), rows.max() + 1), slice(cols.min(), cols.max() + 1))
+        for label, rings, _ in polygonize(labels[window], transform, mask=mask[window], connectivity=8,
+                                          offset=(window[0].start, window[1].start)):
+            polygons.setdefault(label, []).append(rings)
+
+    width = labels.shape[1]
+    features = []
+    for rank, index in enumerate(ranked.tolist(), start=1):
+        row, col = divmod(int(stats['deepest_cell'][index]), width)
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'MultiPolygon',
+                'coordinates': polygons[index + 1]
+            },
             'properties': {
-                'source': 'simplified',
-                'note': 'Whitebox not available, using simplified hydrology'
+                'type': 'pond',
+                'rank': rank,
+                'area_ha': round(float(stats['area_m2'][index]) / 10000, 3),
+                'max_depth_m': round(float(stats['max_depth'][index]), 2),
+                'volume_m3': round(float(stats['volume_m3'][index]), 1),
+                'spill_elevation': round(float(stats['spill_elevation'][index]), 2),
+                'deepest_point': [transform.c + (col + 0.5) * transform.a, transform.f + (row + 0.5) * transform.e]
             }
+        })
+    return features
+
+def feature_collection(features, source):
+    """The /hydrology response"""
+    note = ('Whitebox hydrology' if source == 'whitebox'
+            else 'Whitebox not available, using built-in priority-flood/D8 hydrology')
+    return {
+        'type': 'FeatureCollection',
+        'features': features,
+        'properties': {
+            'source': source,
+            'note': note
         }
+    }
+
+EDIT_GEOMETRIES = ("LineString", "MultiLineString", "Polygon", "MultiPolygon")
+
+def _validate_edit(edit):
+    geometry = edit.get("geometry") if isinstance(edit, dict) else None
+    if not isinstance(geometry, dict) or geometry.get("type") not in EDIT_GEOMETRIES:
+        raise ValueError(f"Each edit needs a geometry of type {', '.join(EDIT_GEOMETRIES)}")
+    if ("height" in edit) == ("offset" in edit):
+        raise ValueError("Each edit needs exactly one of 'height' or 'offset'")
+    if not isinstance(edit.get("height", edit.get("offset")), (int, float)):
+        raise ValueError("Edit 'height'/'offset' must be a number of meters")
+
+def apply_edits(result, edits):
+    """
+    New HydroResult with elevation edits burned in, recomputed locally
+
+    Only cells draining through an edit (or lying in a depression it touches) can change
+    their filled level; fill runs on their bounding window with every other cell pinned
+    to its cached filled value. D8 is redone one cell around that region, and
+    accumulation only below cells whose direction changed. Stream links, catchments and
+    ponds are rebuilt only where routing, accumulation or fill changed; the rest of the
+    cached result is carried over.
+    """
+    transform = result.transform
+    shape = result.elevation.shape
+    elevation = result.elevation.copy()
+    edited = np.zeros(shape, dtype=bool)
+    for edit in edits:
+        burn = features.rasterize([(edit["geometry"], 1)], out_shape=shape, transform=transform,
+                                  all_touched=True, dtype=np.uint8).astype(bool)
+        burn &= ~np.isnan(elevation)
+        if "height" in edit:
+            elevation[burn] = float(edit["height"])
+        else:
+            elevation[burn] += float(edit["offset"])
+        edited |= burn
+    if not edited.any():
+        return result
+
+    # Depressions (and epsilon-drained flats) touching an edit can spill differently
+    ponded, _ = label_regions(result.filled > result.elevation)
+    touched = np.unique(ponded[dilate(edited)])
+    seeds = edited | np.isin(ponded, touched[touched > 0])
+    old_downstream = result.downstream()
+    region = upstream_mask(old_downstream, np.flatnonzero(seeds))
+
+    rows, cols = np.nonzero(dilate(dilate(region)))
+    window = (slice(rows.min(), rows.max() + 1), slice(cols.min(), cols.max() + 1))
+
+    local = fill_depressions(np.where(region, elevation, result.filled)[window])
+    pinned = ~region[window]
+    if not np.allclose(local[pinned], result.filled[window][pinned], rtol=0, atol=1e-6, equal_nan=True):
+        # The edit reaches beyond the region (e.g. a breached divide): recompute everything
+        print("[HYDRO] Edit affects cells outside its drainage region, recomputing the whole window")
+        return _run_builtin(elevation, transform, None)
+    filled = result.filled.copy()
+    filled[window] = np.where(pinned, result.filled[window], local)
+
+    directions = result.directions.copy()
+    redo = dilate(region)[window]
+    distances = pixel_distances(shape, transform)[window[0]]
+    directions[window][redo] = d8_directions(filled[window], transform, distances=distances)[redo]
+    new_downstream = downstream_index(directions)
+    changed = np.flatnonzero(directions != result.directions)
+    accumulation, reaccumulated = update_accumulation(old_downstream, new_downstream, result.accumulation, changed)
+    refilled = (filled != result.filled) & ~np.isnan(filled)
+    retouched = reaccumulated | refilled.ravel()
+
+    if result.network is None:
+        network = stream_network(new_downstream, accumulation, transform)
+    else:
+        network = update_streams(*result.network, new_downstream, accumulation, STREAM_THRESHOLD, transform,
+                                 reaccumulated, dirty=refilled.ravel())
+
+    old_pour_cells, old_labels = result.watersheds
+    pour_cells = stream_pour_points(new_downstream, accumulation, STREAM_THRESHOLD)
+    labels, relabelled = update_watersheds(new_downstream, old_labels, pour_cells, old_pour_cells, changed)
+    # Catchments that gained or lost cells, or whose outlet cell changed, are rebuilt
+    stale = retouched.copy()
+    for cells, grid in ((old_pour_cells, old_labels), (pour_cells, labels)):
+        touched = np.unique(grid.ravel()[relabelled])
+        stale[cells[touched[touched > 0] - 1]] = True
+    catchments = {cell: feature for cell, feature in result.catchments.items() if not stale[cell]}
+
+    depression_labels, depression_stats, renumber = update_depressions(
+        *result.depressions, elevation, filled, transform, edited | refilled, MIN_POND_DEPTH)
+    pond_rings = {int(renumber[label]): rings for label, rings in result.pond_rings.items() if renumber[label]}
+
+    edited_result = HydroResult(stream_features(network[0], filled), elevation, filled, accumulation, directions,
+                                transform, result.source, network=network, watersheds=(pour_cells, labels),
+                                catchments=catchments, depressions=(depression_labels, depression_stats),
+                                pond_rings=pond_rings)
+    edited_result.geojson['properties'].update({
+        'edited_cells': int(edited.sum()),
+        'refilled_cells': int(region.sum()),
+        'reaccumulated_cells': int(reaccumulated.sum())
+    })
+    return edited_result
+
+def stats():
+    """Cache counters for /metrics"""
+    return _cache.stats()
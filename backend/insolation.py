@@ -0,0 +1,364 @@
+# insolation.py – Terrain-aware sun hours and clear-sky irradiation over a DEM window
+# Horizons are swept once per window and direction (Dozier-style convex hull walk along
+# resampled profiles), then combined with the vectorized sun positions from sun.py. Both the
+# horizons and the finished rasters are cached per window.
+import os
+import math
+from datetime import datetime, timezone
+from io import BytesIO
+import numpy as np
+
+from dem import (dem_window_slices, read_dem_pixels, bilinear_sample, encode_grid, compress_payload,
+                 elevations_to_json, _elevation)
+from lru import LRUCache
+from raster_vector import METERS_PER_DEG_LAT, METERS_PER_DEG_LON
+from sun import solar_position
+from terrain import terrain_gradients
+from utils import download_dem
+
+# Terrain this far beyond the bbox can still cast shadows into it
+HORIZON_RADIUS_M = float(os.environ.get("INSOLATION_HORIZON_M", "5000"))
+DEFAULT_DIRECTIONS = int(os.environ.get("INSOLATION_DIRECTIONS", "16"))
+STEP_MINUTES = int(os.environ.get("INSOLATION_STEP_MINUTES", "10"))
+MAX_PIXELS = int(os.environ.get("INSOLATION_MAX_PIXELS", "1000000"))
+CACHE_MB = int(os.environ.get("INSOLATION_CACHE_MB", "256"))
+
+# Months per period; the seasons follow the IMD calendar (winter is Jan, Feb and Dec of the year)
+PERIODS = {
+    "annual": tuple(range(1, 13)),
+    "winter": (1, 2, 12),
+    "summer": (3, 4, 5),
+    "monsoon": (6, 7, 8, 9),
+    "post_monsoon": (10, 11)
+}
+
+LAYERS = ("sun_hours", "irradiation", "sky_view")
+
+# Clear-sky model: Meinel direct normal irradiance with diffuse as a fixed share of it
+SOLAR_CONSTANT = 1361.0
+DIFFUSE_FRACTION = 0.1
+
+# NaN stand-in for profile samples off the DEM; low enough never to become a horizon
+_NO_TERRAIN = -1.0e6
+
+def horizon_sweep(profiles, spacing):
+    """
+    Horizon slope of every sample of parallel elevation profiles, looking towards increasing index
+
+    Walks each profile backwards keeping, per sample, a pointer to its horizon point. The horizon
+    of sample i is found by hopping from i+1 along that pointer chain while the next point rises
+    above the current sight line; the chain is the upper convex hull of the rest of the profile,
+    so a profile costs O(n) hops in total. Lines advance independently (each step either hops or
+    settles one sample), which keeps the vectorized loop at under 2n steps.
+
+    Args:
+        profiles: (lines, samples) elevations, equally spaced
+        spacing: Distance between samples in meters
+
+    Returns:
+        (lines, samples) tangent of the horizon elevation angle (-inf at the far end)
+    """
+    lines, samples = profiles.shape
+    line_index = np.arange(lines)
+    horizon = np.full((lines, samples), -1, dtype=np.int64)
+    tangent = np.full((lines, samples), -np.inf)
+    i = np.full(lines, samples - 2)
+    j = i + 1
+    while samples > 1:
+        active = i >= 0
+        if not active.any():
+            break
+        at = np.maximum(i, 0)
+        slope = (profiles[line_index, j] - profiles[line_index, at]) / (np.maximum(j - at, 1) * spacing)
+        nxt = horizon[line_index, j]
+        hop = active & (nxt >= 0) & (tangent[line_index, j] > slope)
+        settle = active & ~hop
+        horizon[line_index[settle], i[settle]] = j[settle]
+        tangent[line_index[settle], i[settle]] = slope[settle]
+        i = i - settle
+        j = np.where(hop, nxt, np.where(settle, i + 1, j))
+    return tangent
+
+def horizon_angles(elevation, transform, cells, directions=DEFAULT_DIRECTIONS):
+    """
+    Horizon elevation angles of selected cells in equally spaced azimuths
+
+    The grid is resampled along lines rotated to each azimuth (bilinear, at the finer pixel
+    size), swept with horizon_sweep in both directions of the line, and read back at the
+    sample nearest each cell.
+
+    Args:
+        elevation: North-up EPSG:4326 grid (NaN = no data); everything in it can cast shadows
+        transform: Grid transform
+        cells: (rows, cols) slices of the cells to report
+        directions: Number of azimuths (even), the first one due north, clockwise
+
+    Returns:
+        (directions, rows, cols) float32 horizon angles in degrees
+    """
+    height, width = elevation.shape
+    lat0 = transform.f + transform.e * height / 2
+    lon0 = transform.c + transform.a * width / 2
+    kx = METERS_PER_DEG_LON * math.cos(math.radians(lat0))
+    ky = METERS_PER_DEG_LAT
+    spacing = min(abs(transform.a) * kx, abs(transform.e) * ky)
+    half = int(math.ceil(0.5 * math.hypot(width * abs(transform.a) * kx, height * abs(transform.e) * ky) / spacing))
+    offsets = np.arange(-half, half + 1) * spacing
+
+    # Metric offsets of the reported cell centres from the grid centre
+    rows = np.arange(cells[0].start, cells[0].stop)
+    cols = np.arange(cells[1].start, cells[1].stop)
+    north = ((transform.f + (rows + 0.5) * transform.e - lat0) * ky)[:, None]
+    east = ((transform.c + (cols + 0.5) * transform.a - lon0) * kx)[None, :]
+
+    angles = np.empty((directions, len(rows), len(cols)), dtype=np.float32)
+    for d in range(directions // 2):
+        theta = 2 * math.pi * d / directions
+        sin_t, cos_t = math.sin(theta), math.cos(theta)
+        # u runs along the azimuth, v across it
+        u, v = offsets[None, :], offsets[:, None]
+        lons = lon0 + (u * sin_t + v * cos_t) / kx
+        lats = lat0 + (u * cos_t - v * sin_t) / ky
+        profiles = bilinear_sample(elevation, transform, lons, lats)
+        profiles[np.isnan(profiles)] = _NO_TERRAIN
+
+        iu = np.rint((east * sin_t + north * cos_t) / spacing).astype(np.int64) + half
+        iv = np.rint((east * cos_t - north * sin_t) / spacing).astype(np.int64) + half
+        ahead = horizon_sweep(profiles, spacing)
+        behind = horizon_sweep(profiles[:, ::-1], spacing)[:, ::-1]
+        angles[d] = np.degrees(np.arctan(ahead[iv, iu]))
+        angles[d + directions // 2] = np.degrees(np.arctan(behind[iv, iu]))
+    return angles
+
+def period_times(period, year, step=STEP_MINUTES):
+    """
+    UTC timestamps every step minutes (at mid-interval) over the days of a period
+
+    Returns:
+        (timestamps, number of days)
+    """
+    months = PERIODS[period]
+    start = np.datetime64(f"{year}-01-01")
+    days = np.arange(start, start + np.timedelta64(366, "D"), dtype="datetime64[D]")
+    days = days[days.astype("datetime64[Y]") == start.astype("datetime64[Y]")]
+    month = days.astype("datetime64[M]").astype(int) % 12 + 1
+    days = days[np.isin(month, months)]
+    day_unix = days.astype("datetime64[s]").astype(np.float64)
+    offsets = np.arange(0, 1440, step, dtype=np.float64) * 60 + step * 30
+    return (day_unix[:, None] + offsets[None, :]).ravel(), len(days)
+
+def clear_sky(altitude):
+    """
+    Direct normal and diffuse horizontal irradiance (W/m²) for sun altitudes above the horizon
+
+    Meinel's attenuation with the Kasten-Young air mass; diffuse is DIFFUSE_FRACTION of direct.
+    """
+    air_mass = 1.0 / (np.sin(np.radians(altitude)) + 0.50572 * (altitude + 6.07995) ** -1.6364)
+    direct = SOLAR_CONSTANT * 0.7 ** (air_mass ** 0.678)
+    return direct, DIFFUSE_FRACTION * direct
+
+def insolation_layers(horizons, dy, dx, altitude, azimuth, step, days):
+    """
+    Sun hours, irradiation and sky-view factor from horizons and sun positions
+
+    Each sun position is assigned to the nearest horizon azimuth. Within an azimuth, positions
+    are sorted by altitude so a cell's visible set is a suffix found with one searchsorted, and
+    prefix sums of the beam components give its direct irradiation without a per-time loop.
+    Self-shading needs no separate test: a slope facing away from the sun rises above it in the
+    horizon, so the summed incidence is only clipped at zero.
+
+    Args:
+        horizons: (directions, rows, cols) horizon angles in degrees
+        dy, dx: Terrain gradients of the cells (rows run south)
+        altitude, azimuth: Sun positions in degrees, daylight only
+        step: Minutes each position stands for
+        days: Days in the period
+
+    Returns:
+        dict of (rows, cols) float32 arrays: sun_hours (mean per day), irradiation (kWh/m² over
+        the period) and sky_view (0-1)
+    """
+    directions = horizons.shape[0]
+    hours = step / 60.0
+    direct, diffuse = clear_sky(altitude)
+    alt, az = np.radians(altitude), np.radians(azimuth)
+    # Direct-beam energy per position as (east, north, up) components in kWh/m²
+    beam = np.stack([np.cos(alt) * np.sin(az), np.cos(alt) * np.cos(az), np.sin(alt)]) * direct * hours / 1000.0
+    tan_sun = np.tan(alt)
+    bins = np.rint(azimuth / (360.0 / directions)).astype(np.int64) % directions
+
+    shape = horizons.shape[1:]
+    visible = np.zeros(shape, dtype=np.int64)
+    energy = np.zeros((3,) + shape)
+    for b in range(directions):
+        in_bin = np.flatnonzero(bins == b)
+        if in_bin.size == 0:
+            continue
+        order = in_bin[np.argsort(tan_sun[in_bin])]
+        count = order.size - np.searchsorted(tan_sun[order], np.tan(np.radians(horizons[b])), side="right")
+        visible += count
+        # suffix[k] = energy of the k highest positions
+        suffix = np.concatenate([np.zeros((3, 1)), np.cumsum(beam[:, order[::-1]], axis=1)], axis=1)
+        energy += suffix[:, count]
+
+    incidence = (-dx * energy[0] + dy * energy[1] + energy[2]) / np.sqrt(1 + dx ** 2 + dy ** 2)
+    sky_view = 1.0 - np.mean(np.sin(np.radians(np.maximum(horizons, 0))), axis=0)
+    irradiation = np.maximum(incidence, 0) + sky_view * diffuse.sum() * hours / 1000.0
+    return {
+        "sun_hours": (visible * hours / max(days, 1)).astype(np.float32),
+        "irradiation": irradiation.astype(np.float32),
+        "sky_view": sky_view.astype(np.float32)
+    }
+
+def _window_nbytes(value):
+    return sum(arr.nbytes for arr in value.values() if isinstance(arr, np.ndarray))
+
+_horizon_cache = LRUCache(max_entries=32, max_bytes=CACHE_MB * 1024 * 1024 // 2, sizeof=_window_nbytes)
+_result_cache = LRUCache(max_entries=64, max_bytes=CACHE_MB * 1024 * 1024 // 2,
+                         sizeof=lambda result: _window_nbytes(result["layers"]))
+
+def _parse_bbox(bbox):
+    try:
+        minx, miny, maxx, maxy = map(float, bbox.split(","))
+    except ValueError:
+        raise ValueError("bbox must be 'minx,miny,maxx,maxy'")
+    if minx >= maxx or miny >= maxy:
+        raise ValueError("bbox must have minx < maxx and miny < maxy")
+    return minx, miny, maxx, maxy
+
+def load_horizons(bbox, directions=DEFAULT_DIRECTIONS):
+    """
+    Horizon angles and terrain gradients for the DEM pixels covering a bbox, cached per window
+
+    Returns:
+        dict with horizons, dy, dx, elevation (bbox cells only), transform, bounds and center
+    """
+    minx, miny, maxx, maxy = _parse_bbox(bbox)
+    center_lat, center_lon = (miny + maxy) / 2, (minx + maxx) / 2
+    buffer_x = HORIZON_RADIUS_M / (METERS_PER_DEG_LON * math.cos(math.radians(center_lat)))
+    buffer_y = HORIZON_RADIUS_M / METERS_PER_DEG_LAT
+    dem_path = download_dem(center_lat, center_lon,
+                            bbox=(minx - buffer_x, miny - buffer_y, maxx + buffer_x, maxy + buffer_y))
+
+    key = (os.path.abspath(dem_path), os.path.getmtime(dem_path),
+           round(minx, 7), round(miny, 7), round(maxx, 7), round(maxy, 7), directions)
+    window = _horizon_cache.get(key)
+    if window is not None:
+        return window
+
+    rows, cols, transform = dem_window_slices(dem_path, minx, miny, maxx, maxy)
+    height, width = rows.stop - rows.start, cols.stop - cols.start
+    if height < 2 or width < 2:
+        raise ValueError("DEM does not cover the requested area")
+    if height * width > MAX_PIXELS:
+        raise ValueError(f"bbox covers {height * width} DEM pixels, the limit is {MAX_PIXELS}")
+
+    halo = int(math.ceil(max(HORIZON_RADIUS_M / (abs(transform.a) * METERS_PER_DEG_LON * math.cos(math.radians(center_lat))),
+                             HORIZON_RADIUS_M / (abs(transform.e) * METERS_PER_DEG_LAT))))
+    outer_rows, outer_cols, outer_transform = dem_window_slices(dem_path, minx, miny, maxx, maxy, halo=halo)
+    data, nodata = read_dem_pixels(dem_path, outer_rows, outer_cols)
+    elevation = _elevation(data, nodata)
+    cells = (slice(rows.start - outer_rows.start, rows.stop - outer_rows.start),
+             slice(cols.start - outer_cols.start, cols.stop - outer_cols.start))
+
+    print(f"[INSOLATION] Sweeping {directions} horizons over {elevation.shape[0]}x{elevation.shape[1]} pixels")
+    dy, dx = terrain_gradients(elevation, outer_transform)
+    bounds = (transform.c, transform.f + height * transform.e, transform.c + width * transform.a, transform.f)
+    return _horizon_cache.put(key, {
+        "horizons": horizon_angles(elevation, outer_transform, cells, directions),
+        "dy": dy[cells], "dx": dx[cells], "elevation": elevation[cells],
+        "transform": transform, "bounds": bounds, "center": (center_lat, center_lon), "key": key
+    })
+
+def compute_insolation(bbox, period="annual", year=None, directions=DEFAULT_DIRECTIONS):
+    """
+    Sun hours, clear-sky irradiation and sky-view factor rasters for a bbox
+
+    Sun positions are taken at the bbox centre every STEP_MINUTES over the period.
+
+    Args:
+        bbox: "minx,miny,maxx,maxy"
+        period: "annual" or a season in PERIODS
+        year: Calendar year (default: the current one)
+        directions: Horizon azimuths, even, 4-64
+
+    Returns:
+        dict with layers (LAYERS -> float32 arrays), bounds and summary figures
+
+    Raises:
+        ValueError on bad arguments or when the DEM does not cover the bbox
+    """
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    if directions < 4 or directions > 64 or directions % 2:
+        raise ValueError("directions must be an even number between 4 and 64")
+    year = int(year) if year is not None else datetime.now(timezone.utc).year
+    if not 1900 <= year <= 2100:
+        raise ValueError("year must be between 1900 and 2100")
+
+    window = load_horizons(bbox, directions)
+    key = window["key"] + (period, year, STEP_MINUTES)
+    result = _result_cache.get(key)
+    if result is not None:
+        return result
+
+    times, days = period_times(period, year)
+    altitude, azimuth = solar_position(times, *window["center"])
+    daylight = altitude > 0
+    layers = insolation_layers(window["horizons"], window["dy"], window["dx"],
+                               altitude[daylight], azimuth[daylight], STEP_MINUTES, days)
+    nodata = np.isnan(window["elevation"])
+    for arr in layers.values():
+        arr[nodata] = np.nan
+
+    flat_hours = daylight.sum() * STEP_MINUTES / 60.0 / max(days, 1)
+    sun_hours = layers["sun_hours"]
+    return _result_cache.put(key, {
+        "layers": layers,
+        "bounds": window["bounds"],
+        "period": period,
+        "year": year,
+        "days": days,
+        "directions": directions,
+        "summary": {
+            "unobstructed_sun_hours": round(float(flat_hours), 2),
+            "mean_sun_hours": round(float(np.nanmean(sun_hours)), 2) if not nodata.all() else None,
+            "min_sun_hours": round(float(np.nanmin(sun_hours)), 2) if not nodata.all() else None,
+            "mean_irradiation_kwh_m2": round(float(np.nanmean(layers["irradiation"])), 1) if not nodata.all() else None
+        }
+    })
+
+def get_insolation(bbox, period="annual", year=None, directions=DEFAULT_DIRECTIONS):
+    """JSON response: every layer as a nested list (null = no data) plus the summary"""
+    result = compute_insolation(bbox, period, year, directions)
+    height, width = result["layers"]["sun_hours"].shape
+    response = {"bbox": bbox, "bounds": list(result["bounds"]), "width": width, "height": height,
+                "period": result["period"], "year": result["year"], "days": result["days"],
+                "directions": result["directions"], "summary": result["summary"]}
+    for name in LAYERS:
+        response[name] = elevations_to_json(result["layers"][name], decimals=3 if name == "sky_view" else 2)
+    return response
+
+def get_insolation_binary(bbox, layer, fmt="f32", compression=None, period="annual", year=None,
+                          directions=DEFAULT_DIRECTIONS):
+    """
+    One layer as a binary download in the /dem/tile formats ("f32", "i16" or "npy")
+
+    Returns:
+        (body bytes, content-encoding or None)
+    """
+    if layer not in LAYERS:
+        raise ValueError(f"layer must be one of {', '.join(LAYERS)}")
+    result = compute_insolation(bbox, period, year, directions)
+    grid = result["layers"][layer]
+    if fmt == "npy":
+        buffer = BytesIO()
+        np.save(buffer, grid)
+        payload = buffer.getvalue()
+    else:
+        payload = encode_grid(grid, result["bounds"], fmt)
+    return compress_payload(payload, compression)
+
+def stats():
+    """Cache counters for /metrics"""
+    return {"horizons": _horizon_cache.stats(), "results": _result_cache.stats()}
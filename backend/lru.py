@@ -0,0 +1,150 @@
+# lru.py – Small thread-safe LRU cache shared by the backend's in-process caches
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class LRUCache:
+    """
+    Bounded mapping with least-recently-used eviction
+
+    Args:
+        max_entries: Maximum number of entries kept
+        max_bytes: Optional total size budget, measured with `sizeof`
+        sizeof: Callable returning the size of a value in bytes
+        on_evict: Called as on_evict(key, value) for every entry dropped by
+            eviction, replacement or pop. Runs outside the cache lock.
+
+    get_or_compute() deduplicates concurrent misses: identical keys requested
+    at the same time share one computation.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, sizeof=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self.on_evict = on_evict
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        dropped = []
+        with self._lock:
+            if key in self._data:
+                old = self._data.pop(key)
+                self._bytes -= self._sizes.pop(key)
+                if old is not value:
+                    dropped.append((key, old))
+            size = self.sizeof(value)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._data) > 1 and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                old_key, old = self._data.popitem(last=False)
+                self._bytes -= self._sizes.pop(old_key)
+                self.evictions += 1
+                dropped.append((old_key, old))
+        self._dispose(dropped)
+        return value
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached value for `key`, else compute() stored under it
+
+        Only the first caller for a missing key runs compute(), outside the cache
+        lock; concurrent callers wait for its value or exception. A None result
+        is returned to everyone but not cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            if key in self._data:
+                return self._data[key]
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value = self._data.pop(key)
+            self._bytes -= self._sizes.pop(key)
+        self._dispose([(key, value)])
+        return value
+
+    def clear(self):
+        with self._lock:
+            dropped = list(self._data.items())
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+        self._dispose(dropped)
+
+    def _dispose(self, dropped):
+        if self.on_evict is None:
+            return
+        for key, value in dropped:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                print(f"[LRU] Eviction callback failed for {key}: {e}")
+
+    def stats(self):
+        """Counters for the /metrics endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+            }
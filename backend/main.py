@@ -1,17 +1,37 @@
 # main.py – FastAPI backend for Permaculture India Pro
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, Query
+from fastapi import FastAPI, UploadFile, File, Query, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 
-from dem import get_dem_stats, get_dem_tile
+from dem import get_dem_stats, get_dem_tile, get_dem_tile_binary, get_dem_points, sample_elevations, lookup_locations
 from contours import generate_contours
 from contours_fast import generate_contours_fast
-from hydro import run_hydrology
-from sun import sun_path
+from hydro import run_hydrology, edit_hydrology
+from sun import cached_sun_path, cached_sun_path_modes, DEFAULT_TZ_HOURS
+from insolation import get_insolation, get_insolation_binary
 from ai import ask_ai
 from slope_aspect import generate_slope_aspect
+from elevation_profile import extract_lines, profile_lines
 from fastapi.responses import Response
 import json
+import numpy as np
+import raster_pool
+import elevation_providers
+import user_dem
+import terrain_tiles
+import terrain
+import hydro
+import insolation
+import sun
+
+MAX_BATCH_POINTS = 200000
+
+async def read_json(request):
+    """Parse a JSON request body; malformed JSON is a 400, not a 500"""
+    try:
+        return await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be valid JSON")
 
 app = FastAPI(title="Permaculture India – PRO Backend")
 
@@ -25,19 +45,186 @@ app.add_middleware(
     expose_headers=["*"],  # Expose all headers
 )
 
+@app.on_event("startup")
+def warm_caches():
+    sun.start_india_table()
+
 # ---- ROUTES -----
 
 @app.get("/")
 def health():
     return {"status": "OK", "message": "Permaculture PRO backend running"}
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Cache and pool counters for monitoring"""
+    return {
+        "dataset_pool": raster_pool.stats(),
+        "elevation_providers": elevation_providers.stats(),
+        "terrain_tiles": terrain_tiles.stats(),
+        "terrain_derivatives": terrain.stats(),
+        "hydrology": hydro.stats(),
+        "insolation": insolation.stats(),
+        "sun": sun.stats()
+    }
+
 @app.get("/dem")
 def dem_endpoint(lat: float, lon: float):
     return get_dem_stats(lat, lon)
 
+@app.post("/dem/points")
+async def dem_points_endpoint(request: Request, format: str = "json", dtype: str = "f8"):
+    """
+    Bilinear elevations for many points in one round trip
+
+    Body (JSON): {"points": [[lat, lon], ...]} or {"lats": [...], "lons": [...]}
+    Body (application/octet-stream): interleaved little-endian lat,lon pairs;
+        `dtype` selects f8 (default) or f4
+    format: "json" (default) or "binary" for little-endian float32 elevations (NaN = no data)
+    """
+    if request.headers.get("content-type", "").startswith("application/octet-stream"):
+        if dtype not in ("f4", "f8"):
+            raise HTTPException(status_code=400, detail="dtype must be 'f4' or 'f8'")
+        body = await request.body()
+        itemsize = np.dtype(f"<{dtype}").itemsize
+        if len(body) % (2 * itemsize):
+            raise HTTPException(status_code=400, detail="Binary payload must contain lat,lon pairs")
+        raw = np.frombuffer(body, dtype=f"<{dtype}")
+        lats, lons = raw[0::2], raw[1::2]
+    else:
+        payload = await read_json(request)
+        try:
+            if "points" in payload:
+                points = np.asarray(payload["points"], dtype=np.float64)
+                if points.ndim > 1 and points.shape[-1] != 2:
+                    raise ValueError("points must be [lat, lon] pairs")
+                points = points.reshape(-1, 2)
+                lats, lons = points[:, 0], points[:, 1]
+            else:
+                lats = np.asarray(payload.get("lats", []), dtype=np.float64).ravel()
+                lons = np.asarray(payload.get("lons", []), dtype=np.float64).ravel()
+        except (AttributeError, KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=400,
+                                detail="Body must be {\"points\": [[lat, lon], ...]} or {\"lats\": [...], \"lons\": [...]}")
+        if lats.shape != lons.shape:
+            raise HTTPException(status_code=400, detail="lats and lons must have the same length")
+
+    if lats.size > MAX_BATCH_POINTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_POINTS} points per request")
+
+    try:
+        if format == "binary":
+            elevations = sample_elevations(lats, lons).astype("<f4")
+            return Response(content=elevations.tobytes(), media_type="application/octet-stream",
+                            headers={"X-Point-Count": str(elevations.size)})
+        return get_dem_points(lats, lons)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/dem/tile")
-def dem_tile(bbox: str):
-    return get_dem_tile(bbox)
+def dem_tile(bbox: str, format: str = "json", compression: str = "none",
+             width: int = Query(None, ge=1, le=4096), height: int = Query(None, ge=1, le=4096)):
+    """
+    Elevation grid for a bbox
+
+    Args:
+        bbox: Bounding box "minx,miny,maxx,maxy"
+        format: "json" (default), "f32" / "i16" (binary grid with a PDEM header), or "npy"
+        compression: "none", "gzip" or "zstd" (binary formats only, sent as Content-Encoding)
+        width, height: Resample server-side to this grid size (one is enough to keep the aspect ratio)
+    """
+    if format == "json":
+        return get_dem_tile(bbox, width, height)
+    if format not in ("f32", "i16", "npy"):
+        raise HTTPException(status_code=400, detail="format must be 'json', 'f32', 'i16' or 'npy'")
+
+    try:
+        body, encoding = get_dem_tile_binary(bbox, format, compression, width, height)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if format == "npy":
+        headers["Content-Disposition"] = f"attachment; filename=dem_{bbox.replace(',', '_')}.npy"
+    return Response(content=body, media_type="application/octet-stream", headers=headers)
+
+@app.get("/api/v1/lookup")
+def lookup_get_endpoint(locations: str):
+    """OpenElevation-compatible lookup: ?locations=lat,lon|lat,lon"""
+    try:
+        parsed = []
+        for pair in locations.split("|"):
+            lat, lon = pair.split(",")
+            parsed.append({"latitude": float(lat), "longitude": float(lon)})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="locations must look like 'lat,lon|lat,lon'")
+    try:
+        return lookup_locations(parsed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/api/v1/lookup")
+async def lookup_post_endpoint(request: Request):
+    """OpenElevation-compatible lookup: {"locations": [{"latitude": .., "longitude": ..}, ...]}"""
+    payload = await read_json(request)
+    locations = payload.get("locations") if isinstance(payload, dict) else None
+    if not isinstance(locations, list):
+        raise HTTPException(status_code=400, detail="Body must be {\"locations\": [...]}")
+    if len(locations) > MAX_BATCH_POINTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_POINTS} locations per request")
+    try:
+        return lookup_locations(locations)
+    except (KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Each location needs numeric latitude and longitude")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/profile")
+async def profile_endpoint(request: Request, spacing: float = Query(10, gt=0)):
+    """
+    Elevation profiles along one or many polylines (swales, diversion drains, keylines)
+
+    Body: {"lines": [[[lon, lat], ...], ...], "spacing": 10} or a GeoJSON
+    LineString / MultiLineString / Feature / FeatureCollection.
+    spacing: Sample spacing in meters (body value wins over the query parameter)
+
+    Returns distance, elevation and gradient (rise/run, positive uphill) arrays per line.
+    """
+    payload = await read_json(request)
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Body must be a JSON object: {\"lines\": [...]} or GeoJSON")
+    try:
+        spacing = float(payload.get("spacing", spacing))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="spacing must be a number of meters")
+    try:
+        return profile_lines(extract_lines(payload), spacing=spacing)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/dem/upload")
+async def dem_upload_endpoint(file: UploadFile = File(...), name: str = None):
+    """
+    Upload a drone / survey DEM (any GDAL-readable raster with a CRS)
+
+    The file is streamed to disk, reprojected to EPSG:4326 and stored as a tiled
+    GeoTIFF with overviews. Inside its footprint it replaces SRTM for contours,
+    slope/aspect, hydrology and point lookups.
+    """
+    try:
+        entry = await user_dem.handle_upload(file, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Rendered terrain tiles inside the new footprint are now stale
+    terrain_tiles.clear_cache()
+    return entry
+
+@app.get("/dem/uploads")
+def dem_uploads_endpoint():
+    """Registered user DEMs"""
+    return {"dems": user_dem.load_user_dems()}
 
 @app.get("/contours")
 def contour_endpoint(bbox: str, interval: float = 5, bold_interval: int = None):
@@ -141,10 +328,25 @@ def contour_export_endpoint(bbox: str, interval: float = 5, bold_interval: int =
         return {"error": "Unsupported format. Use 'geojson', 'json', or 'kml'"}
 
 @app.get("/hydrology")
-def hydro_endpoint(bbox: str):
-    """Generate hydrology data (catchments, flow accumulation, natural ponds)"""
+def hydro_endpoint(bbox: str, pour_points: str = None):
+    """
+    Generate hydrology data (catchments, flow accumulation, natural ponds)
+
+    pour_points: Optional catchment outlets as 'lon,lat|lon,lat'; by default
+        catchments are delineated at stream junctions and outlets
+    """
+    outlets = None
+    if pour_points:
+        try:
+            outlets = [tuple(map(float, pair.split(","))) for pair in pour_points.split("|")]
+            if any(len(point) != 2 for point in outlets):
+                raise ValueError
+        except ValueError:
+            raise HTTPException(status_code=400, detail="pour_points must look like 'lon,lat|lon,lat'")
     try:
-        return run_hydrology(bbox)
+        return run_hydrology(bbox, pour_points=outlets)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"[HYDRO ENDPOINT] Error: {e}")
         return {
@@ -153,11 +355,44 @@ def hydro_endpoint(bbox: str):
             "error": str(e)
         }
 
+@app.post("/hydrology/edit")
+async def hydro_edit_endpoint(request: Request):
+    """
+    Hydrology after design edits, recomputed only around them
+
+    Body: {"bbox": "minx,miny,maxx,maxy",
+           "edits": [{"geometry": <GeoJSON LineString/Polygon>, "height": m} or {..., "offset": m}],
+           "pour_points": [[lon, lat], ...] (optional)}
+    Send the full edit list each time; the cached result for the already-applied
+    prefix is reused.
+    """
+    payload = await read_json(request)
+    if not isinstance(payload, dict) or not isinstance(payload.get("bbox"), str) \
+            or not isinstance(payload.get("edits"), list):
+        raise HTTPException(status_code=400, detail="Body must be {\"bbox\": \"...\", \"edits\": [...]}")
+    try:
+        outlets = [(float(lon), float(lat)) for lon, lat in payload.get("pour_points") or []]
+        return edit_hydrology(payload["bbox"], payload["edits"], pour_points=outlets)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e) or "pour_points must be [[lon, lat], ...]")
+
 @app.get("/sun")
-def sun_endpoint(lat: float, lon: float, date: str = "2025-01-01"):
-    """Calculate sun path for given location and date"""
+def sun_endpoint(lat: float, lon: float, date: str = "2025-01-01", mode: str = "day",
+                 step: int = 1, tz: float = DEFAULT_TZ_HOURS):
+    """
+    Calculate sun path for given location and date
+
+    mode: "day" (hourly path for `date`), "year" (every day of date's year) or
+        "key" (solstices and equinoxes); the multi-day modes sample every `step`
+        minutes and report clock times `tz` hours ahead of UTC (default IST)
+    """
+    if mode != "day":
+        try:
+            return cached_sun_path_modes(lat, lon, date, mode=mode, step=step, tz=tz)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
-        return sun_path(lat, lon, date)
+        return cached_sun_path(lat, lon, date)
     except Exception as e:
         print(f"[SUN ENDPOINT] Error: {e}")
         # Return error response that won't break frontend
@@ -169,20 +404,57 @@ def sun_endpoint(lat: float, lon: float, date: str = "2025-01-01"):
             "error": str(e)
         }
 
+@app.get("/insolation")
+def insolation_endpoint(bbox: str, period: str = "annual", year: int = None, directions: int = 16,
+                        format: str = "json", layer: str = "sun_hours", compression: str = "none"):
+    """
+    Terrain-shaded sun hours and clear-sky irradiation over a bbox
+
+    Args:
+        bbox: Bounding box "minx,miny,maxx,maxy"
+        period: "annual", "winter", "summer", "monsoon" or "post_monsoon"
+        year: Calendar year (default: current)
+        directions: Horizon azimuths swept per cell (even, 4-64)
+        format: "json" (all layers) or "f32" / "i16" / "npy" (one `layer`, as /dem/tile)
+        layer: "sun_hours" (mean per day), "irradiation" (kWh/m² over the period) or "sky_view"
+        compression: "none", "gzip" or "zstd" (binary formats only)
+    """
+    if format not in ("json", "f32", "i16", "npy"):
+        raise HTTPException(status_code=400, detail="format must be 'json', 'f32', 'i16' or 'npy'")
+    try:
+        if format == "json":
+            return get_insolation(bbox, period, year, directions)
+        body, encoding = get_insolation_binary(bbox, layer, format, compression, period, year, directions)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if format == "npy":
+        headers["Content-Disposition"] = f"attachment; filename={layer}_{bbox.replace(',', '_')}.npy"
+    return Response(content=body, media_type="application/octet-stream", headers=headers)
+
 @app.post("/ai")
 async def ai_endpoint(q: str = Query(...)):
     return ask_ai(q)
 
 @app.get("/slope-aspect")
-def slope_aspect_endpoint(bbox: str):
+def slope_aspect_endpoint(bbox: str, output: str = "points",
+                          simplify: float = Query(0, ge=0), min_pixels: int = Query(0, ge=0)):
     """
     Generate slope and aspect from DEM
     
     Args:
         bbox: Bounding box "minx,miny,maxx,maxy"
+        output: "points" (sampled pixels, default) or "polygons" (connected class regions)
+        simplify: Polygon simplification tolerance in meters (0 = exact pixel edges)
+        min_pixels: Merge class regions smaller than this many pixels into their neighbour
     """
     try:
-        return generate_slope_aspect(bbox)
+        return generate_slope_aspect(bbox, output, simplify, min_pixels)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"[SLOPE-ASPECT ENDPOINT] Error: {e}")
         return {
@@ -192,17 +464,38 @@ def slope_aspect_endpoint(bbox: str):
         }
 
 @app.get("/slope")
-def slope_endpoint(bbox: str):
+def slope_endpoint(bbox: str, output: str = "points",
+                   simplify: float = Query(0, ge=0), min_pixels: int = Query(0, ge=0)):
     """Get slope data only"""
-    data = generate_slope_aspect(bbox)
+    try:
+        data = generate_slope_aspect(bbox, output, simplify, min_pixels, layers=("slope",))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return data['slope']
 
 @app.get("/aspect")
-def aspect_endpoint(bbox: str):
+def aspect_endpoint(bbox: str, output: str = "points",
+                    simplify: float = Query(0, ge=0), min_pixels: int = Query(0, ge=0)):
     """Get aspect data only"""
-    data = generate_slope_aspect(bbox)
+    try:
+        data = generate_slope_aspect(bbox, output, simplify, min_pixels, layers=("aspect",))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return data['aspect']
 
+@app.get("/terrain/{layer}/{z}/{x}/{y}.png")
+def terrain_tile_endpoint(layer: str, z: int, x: int, y: int):
+    """
+    Slope, aspect or hillshade as XYZ map tiles (same palettes as /slope-aspect)
+
+    Tiles below the minimum zoom are transparent; rendered tiles are served from a disk cache.
+    """
+    try:
+        png = terrain_tiles.get_tile(layer, z, x, y)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(content=png, media_type="image/png", headers={"Cache-Control": "public, max-age=86400"})
+
 # Run server
 if __name__ == "__main__":
     import os
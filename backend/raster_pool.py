@@ -0,0 +1,96 @@
+# raster_pool.py – Process-wide pool of open rasterio dataset handles
+# Hot tiles stay open between requests, so their headers are parsed once and
+# their decoded blocks stay warm in GDAL's block cache.
+import os
+import threading
+from contextlib import contextmanager
+from lru import LRUCache
+
+POOL_SIZE = int(os.environ.get("DEM_POOL_SIZE", "32"))
+GDAL_CACHE_MB = int(os.environ.get("DEM_GDAL_CACHE_MB", "512"))
+
+# GDAL sizes its block cache on first use, so this must be set before any dataset is opened
+os.environ.setdefault("GDAL_CACHEMAX", str(GDAL_CACHE_MB))
+
+import rasterio
+
+class _Handle:
+    """An open dataset plus the lock serialising access to it (GDAL handles are not thread-safe)"""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.lock = threading.Lock()
+        self._state = threading.Lock()
+        self.busy = False
+        self.retired = False
+        self.closed = False
+
+    def acquire(self):
+        """Lock the handle for reading; False if it was closed in the meantime"""
+        self.lock.acquire()
+        with self._state:
+            if self.closed:
+                self.lock.release()
+                return False
+            self.busy = True
+        return True
+
+    def release(self):
+        with self._state:
+            self.busy = False
+            if self.retired:
+                self._close()
+        self.lock.release()
+
+    def retire(self):
+        """Close now if idle, otherwise as soon as the current reader releases it"""
+        with self._state:
+            self.retired = True
+            if not self.busy:
+                self._close()
+
+    def _close(self):
+        if not self.closed:
+            self.dataset.close()
+            self.closed = True
+
+def _retire_handle(key, handle):
+    handle.retire()
+
+_pool = LRUCache(max_entries=POOL_SIZE, on_evict=_retire_handle)
+
+def _key(path):
+    path = os.path.abspath(path)
+    # Keyed on mtime so a rewritten file is never served from a stale handle
+    return path, os.path.getmtime(path)
+
+@contextmanager
+def open_dataset(path):
+    """
+    Borrow a pooled, open dataset for reading
+
+    The handle is locked for the duration of the `with` block and must not be
+    closed by the caller.
+    """
+    key = _key(path)
+    while True:
+        # Concurrent misses on the same key wait for one open instead of opening their own
+        handle = _pool.get_or_compute(key, lambda: _Handle(rasterio.open(path)))
+        # Evicted between lookup and lock: go round again
+        if handle.acquire():
+            break
+    try:
+        yield handle.dataset
+    finally:
+        handle.release()
+
+def evict(path):
+    """Close any pooled handle for a file (e.g. before deleting or rewriting it)"""
+    path = os.path.abspath(path)
+    for key in [k for k in _pool.keys() if k[0] == path]:
+        _pool.pop(key)
+
+def stats():
+    pool_stats = _pool.stats()
+    pool_stats["gdal_cache_mb"] = GDAL_CACHE_MB
+    return pool_stats
@@ -0,0 +1,109 @@
+# raster_vector.py – Turn classified/labelled rasters into GeoJSON polygons
+import math
+import numpy as np
+from rasterio.transform import Affine
+from rasterio import features
+
+# Meters per degree (latitude near 20°N, longitude at the equator), shared by every module
+# that converts between degrees and meters
+METERS_PER_DEG_LAT = 110700.0
+METERS_PER_DEG_LON = 111320.0
+
+def douglas_peucker(coords, tolerance):
+    """
+    Douglas-Peucker line simplification (iterative, vectorised per segment)
+
+    Args:
+        coords: (n, 2) sequence of x, y
+        tolerance: maximum deviation, in coordinate units
+
+    Returns:
+        (m, 2) array, first and last point always kept
+    """
+    pts = np.asarray(coords, dtype=np.float64)
+    if len(pts) < 3 or tolerance <= 0:
+        return pts
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        inner = pts[start + 1:end]
+        a, b = pts[start], pts[end]
+        dx, dy = b - a
+        length = math.hypot(dx, dy)
+        if length == 0:
+            # Closed ring: measure from the shared start/end point
+            dist = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            dist = np.abs(dx * (inner[:, 1] - a[1]) - dy * (inner[:, 0] - a[0])) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return pts[keep]
+
+def ring_area_m2(ring):
+    """Planar (shoelace) area of a lon/lat ring in square meters"""
+    pts = np.asarray(ring, dtype=np.float64)
+    x, y = pts[:, 0], pts[:, 1]
+    area_deg = 0.5 * abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+    return float(area_deg * METERS_PER_DEG_LON * METERS_PER_DEG_LAT * math.cos(math.radians(y.mean())))
+
+def simplify_polygon(rings, tolerance):
+    """Simplify polygon rings; holes that collapse are dropped, a collapsing exterior is kept as-is"""
+    if tolerance <= 0:
+        return rings
+    out = []
+    for index, ring in enumerate(rings):
+        simple = douglas_peucker(ring, tolerance)
+        if len(simple) >= 4:
+            out.append(simple.tolist())
+        elif index == 0:
+            out.append(ring)
+    return out
+
+def _to_lonlat(ring, transform):
+    """Pixel-coordinate ring to lon/lat, as the affine transform computes it"""
+    pts = np.asarray(ring, dtype=np.float64)
+    x = pts[:, 0] * transform.a + pts[:, 1] * transform.b + transform.c
+    y = pts[:, 0] * transform.d + pts[:, 1] * transform.e + transform.f
+    return list(zip(x.tolist(), y.tolist()))
+
+def polygonize(labels, transform, mask=None, simplify_m=0.0, min_pixels=0, connectivity=4, offset=(0, 0)):
+    """
+    Polygons for every connected region of equal label
+
+    Args:
+        labels: integer raster (uint8/int16/int32)
+        transform: affine transform of the raster (EPSG:4326)
+        mask: boolean raster, False pixels are excluded
+        simplify_m: Douglas-Peucker tolerance in meters (0 = off)
+        min_pixels: regions smaller than this are merged into their largest neighbour first
+        connectivity: 4 or 8
+        offset: (row, col) of labels[0, 0] when labels is a window of the grid `transform`
+            describes; vertices then match those traced on the whole grid exactly
+
+    Returns:
+        list of (label, rings, area_m2); rings[0] is the exterior
+    """
+    if min_pixels > 1:
+        labels = features.sieve(labels, size=int(min_pixels), mask=mask, connectivity=connectivity)
+
+    row_off, col_off = offset
+    # A window is traced in grid pixel coordinates, mapped with the grid transform afterwards
+    trace_transform = Affine.translation(col_off, row_off) if row_off or col_off else transform
+    tolerance = simplify_m / METERS_PER_DEG_LON
+    polygons = []
+    for geom, value in features.shapes(labels, mask=mask, connectivity=connectivity, transform=trace_transform):
+        rings = geom["coordinates"]
+        if trace_transform is not transform:
+            rings = [_to_lonlat(ring, transform) for ring in rings]
+        area = ring_area_m2(rings[0]) - sum(ring_area_m2(hole) for hole in rings[1:])
+        polygons.append((int(value), simplify_polygon(rings, tolerance), area))
+    return polygons
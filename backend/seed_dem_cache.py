@@ -0,0 +1,209 @@
+# seed_dem_cache.py – Offline bulk DEM cache seeding for India regions
+# Run before a field campaign so no user-facing request has to download a tile:
+#
+#   python seed_dem_cache.py --state kerala --state karnataka --workers 8
+#   python seed_dem_cache.py --bbox 76.5,9.5,77.5,10.5 --mmap
+#   python seed_dem_cache.py --lat-range 26 31 --lon-range 77 81
+#
+# Re-running is cheap: tiles already on disk are skipped, and tiles that failed
+# before (e.g. open sea) are skipped unless --retry-failed is given.
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils import DEM_FOLDER, dem_tile_path, download_single_dem_tile, is_india_region, tiles_for_bbox
+import dem_store
+
+MANIFEST_PATH = os.path.join(os.path.dirname(DEM_FOLDER), "seed_manifest.json")
+
+# Approximate state / UT extents (minLon, minLat, maxLon, maxLat); tiles are 1°, so coarse bounds are enough
+INDIA_STATES = {
+    "andhra_pradesh": (76.7, 12.6, 84.8, 19.9),
+    "arunachal_pradesh": (91.5, 26.6, 97.4, 29.5),
+    "assam": (89.7, 24.1, 96.1, 28.0),
+    "bihar": (83.3, 24.3, 88.3, 27.5),
+    "chhattisgarh": (80.2, 17.8, 84.4, 24.1),
+    "delhi": (76.8, 28.4, 77.4, 28.9),
+    "goa": (73.6, 14.9, 74.4, 15.8),
+    "gujarat": (68.1, 20.1, 74.5, 24.7),
+    "haryana": (74.4, 27.6, 77.6, 30.9),
+    "himachal_pradesh": (75.5, 30.4, 79.0, 33.3),
+    "jammu_kashmir": (73.3, 32.3, 76.8, 35.1),
+    "jharkhand": (83.3, 21.9, 87.9, 25.4),
+    "karnataka": (74.0, 11.5, 78.6, 18.5),
+    "kerala": (74.8, 8.2, 77.4, 12.8),
+    "ladakh": (75.3, 32.3, 80.3, 36.0),
+    "madhya_pradesh": (74.0, 21.0, 82.8, 26.9),
+    "maharashtra": (72.6, 15.6, 80.9, 22.1),
+    "manipur": (93.0, 23.8, 94.8, 25.7),
+    "meghalaya": (89.8, 25.0, 92.8, 26.1),
+    "mizoram": (92.2, 21.9, 93.5, 24.5),
+    "nagaland": (93.3, 25.2, 95.3, 27.0),
+    "odisha": (81.3, 17.8, 87.5, 22.6),
+    "punjab": (73.8, 29.5, 77.0, 32.5),
+    "rajasthan": (69.4, 23.0, 78.3, 30.2),
+    "sikkim": (88.0, 27.0, 88.9, 28.1),
+    "tamil_nadu": (76.2, 8.0, 80.4, 13.6),
+    "telangana": (77.2, 15.8, 81.3, 19.9),
+    "tripura": (91.1, 22.9, 92.4, 24.5),
+    "uttar_pradesh": (77.0, 23.8, 84.7, 30.4),
+    "uttarakhand": (77.5, 28.7, 81.1, 31.5),
+    "west_bengal": (85.8, 21.5, 89.9, 27.3),
+}
+
+def log(msg):
+    print(f"[SEED] {msg}", flush=True)
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"done": {}, "failed": {}}
+
+def save_manifest(manifest):
+    tmp = f"{MANIFEST_PATH}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, MANIFEST_PATH)
+
+def parse_bbox(text):
+    minx, miny, maxx, maxy = map(float, text.split(","))
+    if minx >= maxx or miny >= maxy:
+        raise argparse.ArgumentTypeError(f"Invalid bbox {text}: expected minLon,minLat,maxLon,maxLat")
+    return minx, miny, maxx, maxy
+
+def collect_tiles(args):
+    """Unique (tile_lat, tile_lon) pairs for every requested region, in a stable order"""
+    bboxes = []
+    for state in args.state or []:
+        key = state.lower().replace(" ", "_").replace("-", "_")
+        if key not in INDIA_STATES:
+            raise SystemExit(f"Unknown state '{state}'. Use --list-states to see the supported names.")
+        bboxes.append(INDIA_STATES[key])
+    bboxes.extend(args.bbox or [])
+    if args.lat_range or args.lon_range:
+        if not (args.lat_range and args.lon_range):
+            raise SystemExit("--lat-range and --lon-range must be given together")
+        bboxes.append((args.lon_range[0], args.lat_range[0], args.lon_range[1], args.lat_range[1]))
+
+    tiles = []
+    seen = set()
+    for bbox in bboxes:
+        # Same enumeration as download_dem, so every tile a request can ask for is seeded
+        for tile in tiles_for_bbox(bbox):
+            if tile not in seen:
+                seen.add(tile)
+                tiles.append(tile)
+    return tiles
+
+def seed_tile(tile_lat, tile_lon, args):
+    """Fetch, validate and (optionally) convert one tile; returns (status, bytes)"""
+    path = dem_tile_path(tile_lat, tile_lon)
+    if os.path.exists(path):
+        status = "cached"
+    else:
+        path = download_single_dem_tile(
+            tile_lat, tile_lon, is_india_region(tile_lat + 0.5, tile_lon + 0.5), api_fallback=args.api_fallback
+        )
+        if not path or not os.path.exists(path):
+            return "failed", 0
+        status = "downloaded"
+
+    if args.mmap:
+        npy_path, header_path = dem_store.store_paths(path)
+        if not os.path.exists(npy_path) or os.path.getmtime(npy_path) < os.path.getmtime(path):
+            dem_store.convert(path)
+
+    return status, os.path.getsize(path) if status == "downloaded" else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-download DEM tiles into the local cache")
+    parser.add_argument("--state", action="append", help="Indian state/UT name (repeatable)")
+    parser.add_argument("--bbox", action="append", type=parse_bbox, help="minLon,minLat,maxLon,maxLat (repeatable)")
+    parser.add_argument("--lat-range", nargs=2, type=float, metavar=("MIN", "MAX"))
+    parser.add_argument("--lon-range", nargs=2, type=float, metavar=("MIN", "MAX"))
+    parser.add_argument("--workers", type=int, default=8, help="Parallel downloads (default 8)")
+    parser.add_argument("--mmap", action="store_true", help="Also convert tiles into the memory-mapped store")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry tiles that failed in earlier runs")
+    parser.add_argument("--no-api-fallback", dest="api_fallback", action="store_false",
+                        help="Skip the slow OpenElevation synthesis when all tile sources fail")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the tiles that would be fetched")
+    parser.add_argument("--list-states", action="store_true", help="Print supported state names and exit")
+    args = parser.parse_args(argv)
+
+    if args.list_states:
+        for name, bbox in sorted(INDIA_STATES.items()):
+            print(f"{name:20s} {bbox}")
+        return 0
+
+    tiles = collect_tiles(args)
+    if not tiles:
+        parser.error("Give at least one --state, --bbox or --lat-range/--lon-range")
+
+    manifest = load_manifest()
+    todo = []
+    for tile_lat, tile_lon in tiles:
+        key = f"{tile_lat}_{tile_lon}"
+        if key in manifest["failed"] and not args.retry_failed:
+            continue
+        if os.path.exists(dem_tile_path(tile_lat, tile_lon)) and not args.mmap:
+            continue
+        todo.append((tile_lat, tile_lon))
+
+    log(f"{len(tiles)} tiles requested, {len(tiles) - len(todo)} already cached or known-failed, {len(todo)} to process")
+    if args.dry_run:
+        for tile_lat, tile_lon in todo:
+            print(f"{tile_lat}_{tile_lon}")
+        return 0
+
+    counts = {"downloaded": 0, "cached": 0, "failed": 0}
+    total_bytes = 0
+    lock = threading.Lock()
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(seed_tile, tile_lat, tile_lon, args): (tile_lat, tile_lon) for tile_lat, tile_lon in todo}
+        try:
+            for finished, future in enumerate(as_completed(futures), start=1):
+                tile_lat, tile_lon = futures[future]
+                key = f"{tile_lat}_{tile_lon}"
+                try:
+                    status, size = future.result()
+                except Exception as e:
+                    log(f"{key}: error - {e}")
+                    status, size = "failed", 0
+
+                with lock:
+                    counts[status] += 1
+                    total_bytes += size
+                    stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                    if status == "failed":
+                        manifest["failed"][key] = stamp
+                    else:
+                        manifest["failed"].pop(key, None)
+                        manifest["done"][key] = stamp
+                    # Persist after every tile so an interrupted run resumes where it stopped
+                    save_manifest(manifest)
+
+                elapsed = time.time() - start
+                rate = finished / elapsed if elapsed > 0 else 0.0
+                eta = (len(todo) - finished) / rate if rate > 0 else 0.0
+                log(f"[{finished}/{len(todo)}] {key}: {status} | {rate:.2f} tiles/s, "
+                    f"{total_bytes / 1e6 / max(elapsed, 1e-6):.2f} MB/s, ETA {eta:.0f}s")
+        except KeyboardInterrupt:
+            log("Interrupted - progress saved, re-run the same command to resume")
+            pool.shutdown(wait=False, cancel_futures=True)
+            return 130
+
+    elapsed = time.time() - start
+    log(f"Done in {elapsed:.1f}s: {counts['downloaded']} downloaded, {counts['cached']} already cached, "
+        f"{counts['failed']} failed, {total_bytes / 1e6:.1f} MB")
+    return 1 if counts["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
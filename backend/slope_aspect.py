@@ -1,20 +1,25 @@
 # slope_aspect.py – Generate slope and aspect from DEM
 import numpy as np
-import rasterio
-from rasterio.transform import from_bounds
-import json
 from utils import download_dem
+from raster_vector import polygonize
+import terrain
 
-def generate_slope_aspect(bbox):
+def generate_slope_aspect(bbox, output="points", simplify=0.0, min_pixels=0, layers=("slope", "aspect")):
     """
     Generate slope and aspect rasters from DEM
     
     Args:
         bbox: "minx,miny,maxx,maxy" bounding box string
+        output: "points" (sampled pixels) or "polygons" (full-resolution class regions)
+        simplify: Polygon simplification tolerance in meters (polygons only, 0 = off)
+        min_pixels: Merge regions smaller than this many pixels into a neighbour (polygons only)
+        layers: Which of 'slope' and 'aspect' to build
     
     Returns:
-        dict with 'slope' and 'aspect' GeoJSON FeatureCollections
+        dict with a GeoJSON FeatureCollection per requested layer
     """
+    if output not in ("points", "polygons"):
+        raise ValueError("output must be 'points' or 'polygons'")
     minx, miny, maxx, maxy = map(float, bbox.split(","))
     center_lat = (miny + maxy) / 2
     center_lon = (minx + maxx) / 2
@@ -27,149 +32,160 @@ def generate_slope_aspect(bbox):
     if not dem_path:
         raise Exception("Failed to download DEM")
     
-    with rasterio.open(dem_path) as src:
-        dem_data = src.read(1)
-        transform = src.transform
-        crs = src.crs
-        
-        # Calculate slope and aspect using numpy gradients
-        # Get pixel size in meters (approximate)
-        pixel_size_x = abs(transform[0]) * 111320  # degrees to meters
-        pixel_size_y = abs(transform[4]) * 111320
-        
-        # Calculate gradients
-        dy, dx = np.gradient(dem_data, pixel_size_y, pixel_size_x)
-        
-        # Calculate slope (in degrees)
-        slope_rad = np.arctan(np.sqrt(dx**2 + dy**2))
-        slope_deg = np.degrees(slope_rad)
-        
-        # Calculate aspect (in degrees, 0-360)
-        aspect_rad = np.arctan2(-dx, dy)
-        aspect_deg = np.degrees(aspect_rad)
-        aspect_deg = np.where(aspect_deg < 0, aspect_deg + 360, aspect_deg)
-        
-        # Convert to GeoJSON (simplified - return as classified polygons)
-        # For web display, we'll return classified zones
-        slope_features = classify_slope(slope_deg, minx, miny, maxx, maxy, transform)
-        aspect_features = classify_aspect(aspect_deg, minx, miny, maxx, maxy, transform)
-        
-        return {
-            'slope': {
-                'type': 'FeatureCollection',
-                'features': slope_features
-            },
-            'aspect': {
-                'type': 'FeatureCollection',
-                'features': aspect_features
-            }
-        }
-
-def classify_slope(slope_array, minx, miny, maxx, maxy, transform):
-    """Classify slope into categories"""
-    # Slope categories: 0-5° (flat), 5-15° (gentle), 15-30° (moderate), 30-45° (steep), >45° (very steep)
-    categories = {
-        'flat': (0, 5, '#90EE90'),      # Light green
-        'gentle': (5, 15, '#FFD700'),   # Gold
-        'moderate': (15, 30, '#FF8C00'), # Dark orange
-        'steep': (30, 45, '#FF4500'),    # Red orange
-        'very_steep': (45, 90, '#8B0000') # Dark red
+    # Gradients are computed once per DEM window and shared by every terrain product
+    window = terrain.load_window(dem_path, minx, miny, maxx, maxy)
+    transform = window.transform
+    window.prefetch(layers)
+    
+    builders = {
+        'slope': (classify_slope, slope_polygons),
+        'aspect': (classify_aspect, aspect_polygons),
     }
+    if output == "polygons":
+        inside = bbox_mask(window.shape, minx, miny, maxx, maxy, transform)
     
-    features = []
-    height, width = slope_array.shape
+    result = {}
+    for layer in layers:
+        as_points, as_polygons = builders[layer]
+        values = getattr(window, layer)
+        if output == "polygons":
+            features = as_polygons(values, inside, transform, simplify, min_pixels)
+        else:
+            features = as_points(values, minx, miny, maxx, maxy, transform)
+        result[layer] = {
+            'type': 'FeatureCollection',
+            'features': features
+        }
+    return result
+
+# Slope categories: 0-5° (flat), 5-15° (gentle), 15-30° (moderate), 30-45° (steep), >45° (very steep)
+SLOPE_CLASSES = ['flat', 'gentle', 'moderate', 'steep', 'very_steep']
+SLOPE_BREAKS = np.array([5, 15, 30, 45])
+SLOPE_COLORS = np.array([
+    '#90EE90',  # Light green
+    '#FFD700',  # Gold
+    '#FF8C00',  # Dark orange
+    '#FF4500',  # Red orange
+    '#8B0000',  # Dark red
+])
+
+# Aspect categories: 45° sectors centred on the cardinal/intercardinal directions
+ASPECT_CLASSES = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
+ASPECT_BREAKS = np.arange(45, 360, 45)   # Applied to aspect shifted by 22.5° so N wraps around 0°
+ASPECT_COLORS = np.array([
+    '#FF0000',  # Red
+    '#FF7F00',  # Orange
+    '#FFFF00',  # Yellow
+    '#7FFF00',  # Yellow-green
+    '#00FF00',  # Green
+    '#007FFF',  # Cyan-blue
+    '#0000FF',  # Blue
+    '#7F00FF',  # Purple
+])
+
+def slope_class_index(slope_array):
+    """Index into SLOPE_CLASSES for every pixel (NaN pixels get class 0)"""
+    return np.digitize(np.nan_to_num(slope_array), SLOPE_BREAKS)
+
+def aspect_class_index(aspect_array):
+    """Index into ASPECT_CLASSES for every pixel (NaN pixels get class 0)"""
+    return np.digitize((np.nan_to_num(aspect_array) + 22.5) % 360, ASPECT_BREAKS)
+
+def sample_grid(values, minx, miny, maxx, maxy, transform):
+    """
+    Subsampled pixels inside the bbox with their pixel-centre coordinates
+
+    Returns:
+        (values, lons, lats) flat arrays, NaN pixels removed
+    """
+    height, width = values.shape
     
     # Sample every 10th pixel for performance
     step = max(1, min(10, width // 50))
-    
-    for i in range(0, height, step):
-        for j in range(0, width, step):
-            slope_val = slope_array[i, j]
-            if np.isnan(slope_val) or slope_val < 0:
-                continue
-            
-            # Determine category
-            category = 'flat'
-            color = categories['flat'][2]
-            for cat_name, (min_val, max_val, cat_color) in categories.items():
-                if min_val <= slope_val < max_val:
-                    category = cat_name
-                    color = cat_color
-                    break
-            
-            # Convert pixel to lat/lon
-            lon, lat = rasterio.transform.xy(transform, i, j)
-            
-            if minx <= lon <= maxx and miny <= lat <= maxy:
-                features.append({
-                    'type': 'Feature',
-                    'geometry': {
-                        'type': 'Point',
-                        'coordinates': [lon, lat]
-                    },
-                    'properties': {
-                        'slope': round(float(slope_val), 1),
-                        'category': category,
-                        'color': color
-                    }
-                })
-    
-    return features
+    rows = np.arange(0, height, step)
+    cols = np.arange(0, width, step)
+    lats = transform.f + (rows + 0.5) * transform.e
+    lons = transform.c + (cols + 0.5) * transform.a
+
+    row_keep = (lats >= miny) & (lats <= maxy)
+    col_keep = (lons >= minx) & (lons <= maxx)
+    sampled = values[np.ix_(rows[row_keep], cols[col_keep])]
+    lat_grid, lon_grid = np.meshgrid(lats[row_keep], lons[col_keep], indexing='ij')
+
+    valid = ~np.isnan(sampled)
+    return sampled[valid], lon_grid[valid], lat_grid[valid]
+
+def point_features(lons, lats, properties):
+    """Point features from coordinate arrays and columnar {name: list} properties"""
+    names = list(properties)
+    columns = [properties[name] for name in names]
+    return [
+        {
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [lon, lat]
+            },
+            'properties': dict(zip(names, row))
+        }
+        for lon, lat, *row in zip(lons.tolist(), lats.tolist(), *columns)
+    ]
+
+def classify_slope(slope_array, minx, miny, maxx, maxy, transform):
+    """Classify slope into categories"""
+    values, lons, lats = sample_grid(slope_array, minx, miny, maxx, maxy, transform)
+    keep = values >= 0
+    values, lons, lats = values[keep], lons[keep], lats[keep]
+    index = slope_class_index(values)
+    return point_features(lons, lats, {
+        'slope': np.round(values, 1).tolist(),
+        'category': np.array(SLOPE_CLASSES)[index].tolist(),
+        'color': SLOPE_COLORS[index].tolist()
+    })
 
 def classify_aspect(aspect_array, minx, miny, maxx, maxy, transform):
     """Classify aspect into cardinal directions"""
-    # Aspect categories: N, NE, E, SE, S, SW, W, NW
-    categories = {
-        'N': (337.5, 22.5, '#FF0000'),    # Red
-        'NE': (22.5, 67.5, '#FF7F00'),    # Orange
-        'E': (67.5, 112.5, '#FFFF00'),    # Yellow
-        'SE': (112.5, 157.5, '#7FFF00'),  # Yellow-green
-        'S': (157.5, 202.5, '#00FF00'),   # Green
-        'SW': (202.5, 247.5, '#007FFF'),  # Cyan-blue
-        'W': (247.5, 292.5, '#0000FF'),   # Blue
-        'NW': (292.5, 337.5, '#7F00FF')   # Purple
-    }
-    
+    values, lons, lats = sample_grid(aspect_array, minx, miny, maxx, maxy, transform)
+    index = aspect_class_index(values)
+    return point_features(lons, lats, {
+        'aspect': np.round(values, 1).tolist(),
+        'direction': np.array(ASPECT_CLASSES)[index].tolist(),
+        'color': ASPECT_COLORS[index].tolist()
+    })
+
+def bbox_mask(shape, minx, miny, maxx, maxy, transform):
+    """True for pixels whose centre lies inside the bbox (drops the gradient halo)"""
+    lats = transform.f + (np.arange(shape[0]) + 0.5) * transform.e
+    lons = transform.c + (np.arange(shape[1]) + 0.5) * transform.a
+    return ((lats >= miny) & (lats <= maxy))[:, None] & ((lons >= minx) & (lons <= maxx))[None, :]
+
+def class_polygons(class_index, valid, transform, names, colors, name_key, simplify, min_pixels):
+    """Polygon features for connected same-class regions"""
     features = []
-    height, width = aspect_array.shape
-    
-    step = max(1, min(10, width // 50))
-    
-    for i in range(0, height, step):
-        for j in range(0, width, step):
-            aspect_val = aspect_array[i, j]
-            if np.isnan(aspect_val):
-                continue
-            
-            # Determine category (handle wrap-around for North)
-            category = 'N'
-            color = categories['N'][2]
-            for cat_name, (min_val, max_val, cat_color) in categories.items():
-                if cat_name == 'N':
-                    if aspect_val >= min_val or aspect_val < max_val:
-                        category = cat_name
-                        color = cat_color
-                        break
-                elif min_val <= aspect_val < max_val:
-                    category = cat_name
-                    color = cat_color
-                    break
-            
-            lon, lat = rasterio.transform.xy(transform, i, j)
-            
-            if minx <= lon <= maxx and miny <= lat <= maxy:
-                features.append({
-                    'type': 'Feature',
-                    'geometry': {
-                        'type': 'Point',
-                        'coordinates': [lon, lat]
-                    },
-                    'properties': {
-                        'aspect': round(float(aspect_val), 1),
-                        'direction': category,
-                        'color': color
-                    }
-                })
-    
+    for value, rings, area in polygonize(class_index.astype(np.uint8), transform, mask=valid,
+                                         simplify_m=simplify, min_pixels=min_pixels):
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': rings
+            },
+            'properties': {
+                name_key: names[value],
+                'color': colors[value],
+                'area_ha': round(area / 10000, 3)
+            }
+        })
     return features
 
+def slope_polygons(slope_array, inside, transform, simplify=0.0, min_pixels=0):
+    """Slope classes as polygons at full DEM resolution"""
+    valid = inside & ~np.isnan(slope_array) & (slope_array >= 0)
+    return class_polygons(slope_class_index(slope_array), valid, transform,
+                          SLOPE_CLASSES, SLOPE_COLORS.tolist(), 'category', simplify, min_pixels)
+
+def aspect_polygons(aspect_array, inside, transform, simplify=0.0, min_pixels=0):
+    """Aspect sectors as polygons at full DEM resolution"""
+    valid = inside & ~np.isnan(aspect_array)
+    return class_polygons(aspect_class_index(aspect_array), valid, transform,
+                          ASPECT_CLASSES, ASPECT_COLORS.tolist(), 'direction', simplify, min_pixels)
@@ -1,6 +1,11 @@
 # sun.py – Accurate solar path computation
-from datetime import datetime, timedelta
+import os
 import math
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+
+from lru import LRUCache
 
 # Try to import pysolar, but provide fallback if not available
 try:
@@ -45,6 +50,230 @@ def calculate_sun_position_simple(lat, lon, dt):
     
     return altitude_deg, azimuth_deg
 
+# ---- Vectorized solar position (NOAA solar calculator equations) -----
+
+# Default clock for the multi-day modes: India Standard Time
+DEFAULT_TZ_HOURS = 5.5
+# Apparent sunrise/sunset: solar disc radius plus standard refraction
+SUNRISE_ZENITH = 90.833
+
+def _solar_geometry(unix_seconds):
+    """
+    Declination (deg) and equation of time (minutes) for UTC unix timestamps
+
+    Returns:
+        (declination, equation_of_time) arrays
+    """
+    jc = (np.asarray(unix_seconds, dtype=np.float64) / 86400.0 + 2440587.5 - 2451545.0) / 36525.0
+    mean_long = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+    mean_anom = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    eccent = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    center = (np.sin(mean_anom) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+              + np.sin(2 * mean_anom) * (0.019993 - 0.000101 * jc)
+              + np.sin(3 * mean_anom) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * jc)
+    apparent_long = np.radians(np.degrees(mean_long) + center - 0.00569 - 0.00478 * np.sin(omega))
+    mean_obliq = 23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+    obliq = np.radians(mean_obliq + 0.00256 * np.cos(omega))
+
+    declination = np.degrees(np.arcsin(np.sin(obliq) * np.sin(apparent_long)))
+    y = np.tan(obliq / 2) ** 2
+    equation_of_time = 4 * np.degrees(
+        y * np.sin(2 * mean_long) - 2 * eccent * np.sin(mean_anom)
+        + 4 * eccent * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+        - 0.5 * y * y * np.sin(4 * mean_long) - 1.25 * eccent * eccent * np.sin(2 * mean_anom)
+    )
+    return declination, equation_of_time
+
+def _refraction(elevation):
+    """Atmospheric refraction correction in degrees for a true elevation in degrees"""
+    arcsec = np.zeros_like(elevation)
+    high = (elevation > 5) & (elevation <= 85)
+    low = (elevation > -0.575) & (elevation <= 5)
+    below = elevation <= -0.575
+    tan_e = np.tan(np.radians(elevation[high]))
+    arcsec[high] = 58.1 / tan_e - 0.07 / tan_e ** 3 + 0.000086 / tan_e ** 5
+    e = elevation[low]
+    arcsec[low] = 1735 + e * (-518.2 + e * (103.4 + e * (-12.79 + e * 0.711)))
+    arcsec[below] = -20.772 / np.tan(np.radians(elevation[below]))
+    return arcsec / 3600.0
+
+def _sampled_geometry(unix_seconds):
+    """
+    _solar_geometry for large timestamp arrays, interpolated from hourly knots
+
+    Declination and equation of time change by under 0.02° and 1 s per hour, so linear
+    interpolation stays far below the equations' own error.
+    """
+    start, stop = float(unix_seconds.min()), float(unix_seconds.max())
+    knots = np.arange(start, stop + 3600.0, 3600.0)
+    if knots.size * 4 >= unix_seconds.size:
+        return _solar_geometry(unix_seconds)
+    declination, equation_of_time = _solar_geometry(knots)
+    return np.interp(unix_seconds, knots, declination), np.interp(unix_seconds, knots, equation_of_time)
+
+def solar_position(unix_seconds, lat, lon, refraction=True):
+    """
+    Sun altitude and azimuth for arrays of UTC timestamps and locations in one call
+
+    Uses the NOAA solar calculator equations (altitude within ~0.02° over 1800-2100). All inputs
+    broadcast against each other.
+
+    Args:
+        unix_seconds: UTC timestamps (seconds since 1970-01-01)
+        lat, lon: Degrees (north, east positive)
+        refraction: Apply standard atmospheric refraction to the altitude
+
+    Returns:
+        (altitude, azimuth) arrays in degrees, azimuth clockwise from north
+    """
+    unix_seconds = np.asarray(unix_seconds, dtype=np.float64)
+    declination, equation_of_time = _sampled_geometry(unix_seconds)
+    utc_minutes = (unix_seconds % 86400.0) / 60.0
+    true_solar = (utc_minutes + equation_of_time + 4.0 * np.asarray(lon, dtype=np.float64)) % 1440.0
+    hour_angle = np.radians(true_solar / 4.0 - 180.0)
+
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    decl_rad = np.radians(declination)
+    cos_zenith = (np.sin(lat_rad) * np.sin(decl_rad)
+                  + np.cos(lat_rad) * np.cos(decl_rad) * np.cos(hour_angle))
+    altitude = 90.0 - np.degrees(np.arccos(np.clip(cos_zenith, -1.0, 1.0)))
+    azimuth = (np.degrees(np.arctan2(
+        np.sin(hour_angle),
+        np.cos(hour_angle) * np.sin(lat_rad) - np.tan(decl_rad) * np.cos(lat_rad)
+    )) + 180.0) % 360.0
+    if refraction:
+        altitude = altitude + _refraction(altitude)
+    return altitude, azimuth
+
+def sunrise_sunset(day_unix, lat, lon):
+    """
+    Sunrise, solar noon and sunset for UTC midnights, as UTC minutes of that day
+
+    Returns:
+        (sunrise, noon, sunset) arrays; sunrise/sunset are NaN during polar day or night
+    """
+    # Evaluate the sun's geometry at (approximate) local noon
+    noon_guess = np.asarray(day_unix, dtype=np.float64) + (720.0 - 4.0 * np.asarray(lon)) * 60.0
+    declination, equation_of_time = _solar_geometry(noon_guess)
+    noon = 720.0 - 4.0 * np.asarray(lon) - equation_of_time
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    decl_rad = np.radians(declination)
+    with np.errstate(invalid="ignore"):
+        cos_ha = (np.cos(np.radians(SUNRISE_ZENITH)) / (np.cos(lat_rad) * np.cos(decl_rad))
+                  - np.tan(lat_rad) * np.tan(decl_rad))
+        half_day = np.where(np.abs(cos_ha) <= 1, 4.0 * np.degrees(np.arccos(np.clip(cos_ha, -1, 1))), np.nan)
+    return noon - half_day, noon, noon + half_day
+
+def key_dates(year):
+    """
+    Dates of the March equinox, June solstice, September equinox and December solstice
+
+    Found from the engine's own declination: extremes for the solstices, sign changes
+    for the equinoxes.
+    """
+    days = np.arange(np.datetime64(f"{year}-01-01"), np.datetime64(f"{year + 1}-01-01"))
+    noon_unix = days.astype("datetime64[s]").astype(np.float64) + 43200.0
+    declination, _ = _solar_geometry(noon_unix)
+    crossings = np.flatnonzero(np.diff(np.sign(declination)) != 0) + 1
+    march = crossings[0]
+    september = crossings[-1]
+    # A crossing lands on the day whose noon declination is closest to zero
+    march -= abs(declination[march - 1]) < abs(declination[march])
+    september -= abs(declination[september - 1]) < abs(declination[september])
+    return {
+        "march_equinox": days[march],
+        "june_solstice": days[int(np.argmax(declination))],
+        "september_equinox": days[september],
+        "december_solstice": days[int(np.argmin(declination))],
+    }
+
+def _clock(minutes):
+    """HH:MM for local minutes of the day (None when undefined)"""
+    if not np.isfinite(minutes):
+        return None
+    minutes = int(round(minutes)) % 1440
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def sun_paths(lat, lon, dates, step=1, tz=DEFAULT_TZ_HOURS, labels=None):
+    """
+    Daylight sun paths for many days at `step`-minute resolution, computed in one call
+
+    Args:
+        dates: numpy datetime64[D] array (local calendar days)
+        step: Minutes between samples
+        tz: Clock offset from UTC in hours for the reported times
+        labels: Optional name per date
+
+    Returns:
+        list of per-day dicts with sunrise/noon/sunset clock times, day length and
+        columnar 'minutes' (local minute of day), 'altitude', 'azimuth' for the sun above the horizon
+    """
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    offset = tz * 3600.0
+    day_unix = dates.astype("datetime64[s]").astype(np.float64)
+    minutes = np.arange(0, 1440, step, dtype=np.float64)
+    # Local clock -> UTC
+    times = day_unix[:, None] + minutes[None, :] * 60.0 - offset
+    altitude, azimuth = solar_position(times, lat, lon)
+    sunrise, noon, sunset = sunrise_sunset(day_unix, lat, lon)
+    local = tz * 60.0
+
+    altitude = np.round(altitude, 2)
+    azimuth = np.round(azimuth, 2)
+    days = []
+    for i, date in enumerate(dates):
+        up = altitude[i] > 0
+        days.append({
+            "date": str(date),
+            "label": labels[i] if labels is not None else None,
+            "sunrise": _clock(sunrise[i] + local),
+            "solar_noon": _clock(noon[i] + local),
+            "sunset": _clock(sunset[i] + local),
+            "day_length_h": round(float(sunset[i] - sunrise[i]) / 60, 2) if np.isfinite(sunrise[i]) else None,
+            "max_altitude": float(altitude[i].max()),
+            "minutes": minutes[up].astype(int).tolist(),
+            "altitude": altitude[i][up].tolist(),
+            "azimuth": azimuth[i][up].tolist(),
+        })
+    return days
+
+def sun_path_modes(lat, lon, date="2025-01-01", mode="key", step=1, tz=DEFAULT_TZ_HOURS):
+    """
+    Multi-day sun paths from the vectorized engine
+
+    Args:
+        mode: "year" (every day of the date's year) or "key" (solstices and equinoxes)
+        step: Minutes between samples (1-60)
+        tz: Hours ahead of UTC for the reported clock times (default IST)
+
+    Raises:
+        ValueError for an unknown mode or step
+    """
+    if mode not in ("year", "key"):
+        raise ValueError("mode must be 'day', 'year' or 'key'")
+    if not 1 <= step <= 60:
+        raise ValueError("step must be between 1 and 60 minutes")
+    year = datetime.fromisoformat(date).year if isinstance(date, str) else date.year
+
+    if mode == "year":
+        dates = np.arange(np.datetime64(f"{year}-01-01"), np.datetime64(f"{year + 1}-01-01"))
+        labels = None
+    else:
+        named = key_dates(year)
+        dates = np.array(list(named.values()))
+        labels = list(named)
+
+    return {
+        "lat": float(lat),
+        "lon": float(lon),
+        "mode": mode,
+        "year": year,
+        "tz_hours": tz,
+        "step_minutes": step,
+        "days": sun_paths(lat, lon, dates, step=step, tz=tz, labels=labels)
+    }
+
 def sun_path(lat, lon, date="2025-01-01"):
     """
     Generate sun path for given location and date
@@ -107,3 +336,109 @@ def sun_path(lat, lon, date="2025-01-01"):
             "sun_path": [],
             "error": str(e)
         }
+
+# ---- Memoized /sun responses -----
+
+# Locations closer than this share a cached path (the sun moves well under 0.01° between them)
+CACHE_QUANTUM_DEG = 0.01
+CACHE_ENTRIES = int(os.environ.get("SUN_CACHE_ENTRIES", "20000"))
+CACHE_MB = int(os.environ.get("SUN_CACHE_MB", "128"))
+# Optional table of day paths over India's band, warmed at startup: grid step in degrees (0 = off)
+INDIA_TABLE_STEP_DEG = float(os.environ.get("SUN_INDIA_TABLE_STEP", "0"))
+INDIA_TABLE_DATES = os.environ.get("SUN_INDIA_TABLE_DATES", "2025-01-01").split(",")
+# Same box as utils.is_india_region: (min lat, max lat, min lon, max lon)
+INDIA_BOUNDS = (6.5, 37.5, 68.0, 97.5)
+
+def _path_nbytes(result):
+    """Rough in-memory size of a response (Python floats in lists cost ~32 bytes each)"""
+    if "days" in result:
+        return sum(len(day["minutes"]) for day in result["days"]) * 3 * 32 + len(result["days"]) * 512
+    return len(result.get("sun_path", ())) * 256 + 256
+
+_cache = LRUCache(max_entries=CACHE_ENTRIES, max_bytes=CACHE_MB * 1024 * 1024, sizeof=_path_nbytes)
+# Built once by warm_india_table and swapped in whole; read-only afterwards, so a plain dict
+_india_table = {}
+
+def _quantize(lat, lon):
+    return round(float(lat) / CACHE_QUANTUM_DEG), round(float(lon) / CACHE_QUANTUM_DEG)
+
+def _day_key(qlat, qlon, date):
+    """Cache key of a day path; None when the date does not parse (left to sun_path to report)"""
+    try:
+        parsed = datetime.fromisoformat(date) if isinstance(date, str) else date
+    except ValueError:
+        return None
+    return ("day", qlat, qlon, parsed.date().isoformat(), parsed.utcoffset())
+
+def _cacheable(result):
+    """A sun_path response, or None for an error response (get_or_compute does not cache None)"""
+    return None if "error" in result else result
+
+def cached_sun_path(lat, lon, date="2025-01-01"):
+    """
+    sun_path memoized per ~0.01° cell and calendar day
+
+    The path is computed once at the cell centre; the response echoes the requested location.
+    Error responses are never cached.
+    """
+    qlat, qlon = _quantize(lat, lon)
+    key = _day_key(qlat, qlon, date)
+    if key is None:
+        return sun_path(lat, lon, date)
+
+    result = _india_table.get(key)
+    if result is None:
+        result = _cache.get_or_compute(key, lambda: _cacheable(
+            sun_path(qlat * CACHE_QUANTUM_DEG, qlon * CACHE_QUANTUM_DEG, date)))
+    if result is None:
+        # The cell's path failed and was not cached; report the error for the requested location
+        return sun_path(lat, lon, date)
+    return {**result, "lat": float(lat), "lon": float(lon), "date": date}
+
+def cached_sun_path_modes(lat, lon, date="2025-01-01", mode="key", step=1, tz=DEFAULT_TZ_HOURS):
+    """
+    sun_path_modes memoized per ~0.01° cell, year, step and clock offset
+
+    Raises:
+        ValueError like sun_path_modes, or for an unparseable date
+    """
+    year = datetime.fromisoformat(date).year if isinstance(date, str) else date.year
+    qlat, qlon = _quantize(lat, lon)
+    key = (mode, qlat, qlon, year, step, float(tz))
+    result = _cache.get_or_compute(key, lambda: sun_path_modes(
+        qlat * CACHE_QUANTUM_DEG, qlon * CACHE_QUANTUM_DEG, f"{year}-01-01", mode=mode, step=step, tz=tz))
+    return {**result, "lat": float(lat), "lon": float(lon)}
+
+def warm_india_table(step_deg=INDIA_TABLE_STEP_DEG, dates=INDIA_TABLE_DATES):
+    """
+    Precompute day paths on a grid over India's band
+
+    Grid nodes lie on the cache lattice, so requests snapped to a node (or landing on one)
+    are served from the table without touching the LRU.
+
+    Returns:
+        Number of paths in the table
+    """
+    global _india_table
+    step = max(1, round(step_deg / CACHE_QUANTUM_DEG))
+    min_lat, max_lat, min_lon, max_lon = (round(v / CACHE_QUANTUM_DEG) for v in INDIA_BOUNDS)
+    table = {}
+    for date in dates:
+        for qlat in range(-(-min_lat // step) * step, max_lat + 1, step):
+            for qlon in range(-(-min_lon // step) * step, max_lon + 1, step):
+                result = sun_path(qlat * CACHE_QUANTUM_DEG, qlon * CACHE_QUANTUM_DEG, date)
+                key = _day_key(qlat, qlon, date)
+                if key is not None and "error" not in result:
+                    table[key] = result
+    _india_table = table
+    print(f"[SUN] India table: {len(table)} day paths every {step * CACHE_QUANTUM_DEG:g}° for {', '.join(dates)}")
+    return len(table)
+
+def start_india_table():
+    """Warm the India table in the background when SUN_INDIA_TABLE_STEP is set"""
+    if INDIA_TABLE_STEP_DEG > 0:
+        threading.Thread(target=warm_india_table, name="sun-india-table", daemon=True).start()
+
+def stats():
+    """Cache counters for /metrics"""
+    return {"paths": _cache.stats(), "india_table": {"entries": len(_india_table)}}
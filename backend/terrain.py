@@ -0,0 +1,191 @@
+# terrain.py – Terrain derivatives (slope, aspect, hillshade, curvature) computed once per DEM window
+# /slope, /aspect, /slope-aspect and the map tiles all read their products from here, so asking
+# for several layers over the same bbox costs one DEM read and one gradient pass.
+import os
+import math
+import numpy as np
+
+from rasterio.transform import Affine
+
+import blocks
+from dem import dem_window_slices, read_dem_pixels, _elevation
+from lru import LRUCache
+from raster_vector import METERS_PER_DEG_LAT, METERS_PER_DEG_LON
+
+CACHE_MB = int(os.environ.get("TERRAIN_CACHE_MB", "256"))
+# Windows larger than this are processed block-parallel (see blocks.py)
+BLOCKED_MIN_PIXELS = int(os.environ.get("TERRAIN_BLOCKED_MIN_PIXELS", str(2 * blocks.BLOCK_SIZE ** 2)))
+# Curvature differentiates twice, so blocks need two pixels of context
+BLOCK_HALO = 2
+
+PRODUCTS = ("slope", "aspect", "hillshade", "curvature")
+
+# Sun position for hillshade (the conventional north-west light)
+HILLSHADE_AZIMUTH = 315.0
+HILLSHADE_ALTITUDE = 45.0
+
+# Upper bound on arrays held per window relative to the elevation grid
+# (elevation, dy, dx, slope, aspect, hillshade, curvature)
+_ARRAYS_PER_WINDOW = 7
+
+def terrain_gradients(dem_data, transform):
+    """
+    Elevation gradients of a north-up EPSG:4326 grid in meters per meter
+
+    The east-west pixel size shrinks with cos(latitude), so it is computed per row.
+
+    Returns:
+        (dy, dx) arrays shaped like dem_data
+    """
+    rows = np.arange(dem_data.shape[0])
+    row_lats = transform.f + (rows + 0.5) * transform.e
+    pixel_size_x = abs(transform.a) * METERS_PER_DEG_LON * np.cos(np.radians(row_lats))
+    pixel_size_y = abs(transform.e) * METERS_PER_DEG_LAT
+    dy, dx = np.gradient(dem_data)
+    return dy / pixel_size_y, dx / pixel_size_x[:, None]
+
+class TerrainWindow:
+    """
+    Elevation grid with lazily computed, memoised derivative products
+
+    Gradients follow the slope_aspect convention: rows run south, dy/dx are
+    d(elevation)/d(row)/d(col) in meters per meter.
+    """
+
+    def __init__(self, elevation, transform):
+        self.elevation = elevation
+        self.transform = transform
+        self.dy, self.dx = terrain_gradients(elevation, transform)
+        self._products = {}
+
+    @property
+    def shape(self):
+        return self.elevation.shape
+
+    def _product(self, name, compute):
+        value = self._products.get(name)
+        if value is None:
+            value = self._products[name] = compute()
+        return value
+
+    @property
+    def slope(self):
+        """Slope in degrees"""
+        return self._product("slope", lambda: np.degrees(np.arctan(np.sqrt(self.dx ** 2 + self.dy ** 2))))
+
+    @property
+    def aspect(self):
+        """Aspect in degrees clockwise from north (0-360), the direction the slope faces"""
+        return self._product("aspect", lambda: np.degrees(np.arctan2(-self.dx, self.dy)) % 360)
+
+    @property
+    def hillshade(self):
+        """Lambertian hillshade in [0, 1] for the default sun position"""
+        return self._product("hillshade", lambda: hillshade(self.dy, self.dx))
+
+    @property
+    def curvature(self):
+        """
+        Laplacian curvature in 1/m: negative on convex ground (ridges, water sheds off),
+        positive in concave ground (hollows, water collects)
+        """
+        def compute():
+            d2y = terrain_gradients(self.dy, self.transform)[0]
+            d2x = terrain_gradients(self.dx, self.transform)[1]
+            return d2x + d2y
+        return self._product("curvature", compute)
+
+    def prefetch(self, names):
+        for name in names:
+            getattr(self, name)
+
+    def nbytes(self):
+        return self.elevation.nbytes * _ARRAYS_PER_WINDOW
+
+class BlockedTerrainWindow:
+    """
+    Derivative products of a large DEM window, computed block-parallel
+
+    Only the float32 products are kept; the elevation and gradients never exist as
+    full-window arrays. prefetch() computes several products in one pass over the DEM.
+    """
+
+    def __init__(self, dem_path, rows, cols, transform):
+        self.dem_path = dem_path
+        self.rows = rows
+        self.cols = cols
+        self.transform = transform
+        self.shape = (rows.stop - rows.start, cols.stop - cols.start)
+        self._products = {}
+
+    def prefetch(self, names):
+        missing = tuple(name for name in names if name not in self._products)
+        if missing:
+            self._products.update(blocks.map_blocks(
+                _terrain_block, self.shape,
+                args=(self.dem_path, self.rows.start, self.cols.start, self.transform, missing),
+                halo=BLOCK_HALO
+            ))
+
+    def _product(self, name):
+        self.prefetch((name,))
+        return self._products[name]
+
+    slope = property(lambda self: self._product("slope"))
+    aspect = property(lambda self: self._product("aspect"))
+    hillshade = property(lambda self: self._product("hillshade"))
+    curvature = property(lambda self: self._product("curvature"))
+
+    def nbytes(self):
+        return self.shape[0] * self.shape[1] * 4 * len(PRODUCTS)
+
+def _terrain_block(block, dem_path, row_off, col_off, transform, names):
+    """Worker: read one padded block, derive the products and crop them to the block core"""
+    pad_rows, pad_cols = block.padded
+    data, nodata = read_dem_pixels(
+        dem_path,
+        slice(row_off + pad_rows.start, row_off + pad_rows.stop),
+        slice(col_off + pad_cols.start, col_off + pad_cols.stop)
+    )
+    window = TerrainWindow(_elevation(data, nodata), transform * Affine.translation(pad_cols.start, pad_rows.start))
+    return {name: getattr(window, name)[block.inner].astype(np.float32) for name in names}
+
+def hillshade(dy, dx, azimuth=HILLSHADE_AZIMUTH, altitude=HILLSHADE_ALTITUDE):
+    """Lambertian hillshade in [0, 1] from terrain gradients (rows run south)"""
+    az, alt = math.radians(azimuth), math.radians(altitude)
+    light = (math.sin(az) * math.cos(alt), math.cos(az) * math.cos(alt), math.sin(alt))
+    # Surface normal in (east, north, up); dz/dnorth = -dy because rows increase southwards
+    shade = (-dx * light[0] + dy * light[1] + light[2]) / np.sqrt(1 + dx ** 2 + dy ** 2)
+    return np.clip(shade, 0, 1)
+
+_cache = LRUCache(max_entries=64, max_bytes=CACHE_MB * 1024 * 1024, sizeof=lambda window: window.nbytes())
+
+def load_window(dem_path, minx, miny, maxx, maxy):
+    """
+    Derivatives for the DEM pixels covering a bbox (plus a one-pixel halo), cached per window
+
+    Small windows are computed in-process; large ones become a BlockedTerrainWindow.
+
+    Raises:
+        Exception when the DEM does not cover the bbox
+    """
+    key = (os.path.abspath(dem_path), os.path.getmtime(dem_path),
+           round(minx, 7), round(miny, 7), round(maxx, 7), round(maxy, 7))
+    return _cache.get_or_compute(key, lambda: _load_window(dem_path, minx, miny, maxx, maxy))
+
+def _load_window(dem_path, minx, miny, maxx, maxy):
+    # The halo gives edge pixels real neighbours for the gradients
+    rows, cols, transform = dem_window_slices(dem_path, minx, miny, maxx, maxy, halo=1)
+    height, width = rows.stop - rows.start, cols.stop - cols.start
+    if height < 2 or width < 2:
+        raise Exception("DEM does not cover the requested area")
+
+    if height * width > BLOCKED_MIN_PIXELS:
+        return BlockedTerrainWindow(dem_path, rows, cols, transform)
+
+    data, nodata = read_dem_pixels(dem_path, rows, cols)
+    return TerrainWindow(_elevation(data, nodata), transform)
+
+def stats():
+    """Cache counters for /metrics"""
+    return _cache.stats()
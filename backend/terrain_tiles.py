@@ -0,0 +1,206 @@
+# terrain_tiles.py – XYZ PNG tiles for slope, aspect and hillshade
+# Tiles are rendered from bilinear DEM samples with the slope/aspect gradient math,
+# coloured through precomputed palettes and kept in a size-bounded disk cache.
+import os
+import math
+import time
+import zlib
+import struct
+import threading
+import numpy as np
+from rasterio.transform import Affine
+
+from dem import sample_elevations
+from lru import LRUCache
+from slope_aspect import slope_class_index, aspect_class_index, SLOPE_COLORS, ASPECT_COLORS
+from terrain import TerrainWindow
+
+TILE_SIZE = 256
+LAYERS = ("slope", "aspect", "hillshade")
+MIN_ZOOM = int(os.environ.get("TERRAIN_TILE_MIN_ZOOM", "10"))
+MAX_ZOOM = 18
+CACHE_FOLDER = os.environ.get("TERRAIN_TILE_CACHE", "data/terrain_tiles")
+CACHE_MB = int(os.environ.get("TERRAIN_TILE_CACHE_MB", "256"))
+
+def log(msg):
+    print(f"[TERRAIN_TILES] {msg}")
+
+def _palette(hex_colors):
+    """(n, 3) uint8 RGB palette from '#RRGGBB' strings"""
+    return np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in hex_colors], dtype=np.uint8)
+
+# Colour lookup tables; the last palette index is reserved for transparent nodata
+SLOPE_PALETTE = _palette(SLOPE_COLORS)
+ASPECT_PALETTE = _palette(ASPECT_COLORS)
+HILLSHADE_PALETTE = np.repeat(np.arange(255, dtype=np.uint8)[:, None], 3, axis=1)
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+def encode_png(indices, palette, transparent_index=None):
+    """
+    Encode an 8-bit palette PNG
+
+    Args:
+        indices: (h, w) uint8 palette indices
+        palette: (n, 3) uint8 RGB entries
+        transparent_index: palette index drawn fully transparent (appended if past the palette)
+    """
+    height, width = indices.shape
+    palette = np.asarray(palette, dtype=np.uint8)
+    alpha = np.full(len(palette), 255, dtype=np.uint8)
+    if transparent_index is not None:
+        if transparent_index >= len(palette):
+            palette = np.vstack([palette, np.zeros((transparent_index - len(palette) + 1, 3), dtype=np.uint8)])
+            alpha = np.append(alpha, np.full(transparent_index - len(alpha) + 1, 255, dtype=np.uint8))
+        alpha[transparent_index] = 0
+
+    # Filter type 0 (None) on every scanline
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), indices.astype(np.uint8)]).tobytes()
+    return b"".join([
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)),
+        _png_chunk(b"PLTE", palette.tobytes()),
+        _png_chunk(b"tRNS", alpha.tobytes()),
+        _png_chunk(b"IDAT", zlib.compress(raw, 6)),
+        _png_chunk(b"IEND", b""),
+    ])
+
+_EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint8), np.zeros((1, 3)), transparent_index=0)
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) of an XYZ tile in degrees"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+def render_tile(layer, z, x, y):
+    """
+    Render one tile
+
+    Returns:
+        PNG bytes, or None when no DEM covers the tile
+    """
+    west, south, east, north = tile_bounds(z, x, y)
+
+    # Regular lat/lon grid at the tile's pixel spacing plus a one-pixel halo for the gradients
+    dlon = (east - west) / TILE_SIZE
+    rows = int(math.ceil((north - south) / dlon))
+    dlat = (north - south) / rows
+    transform = Affine(dlon, 0, west - dlon, 0, -dlat, north + dlat)
+    lons = transform.c + (np.arange(TILE_SIZE + 2) + 0.5) * dlon
+    lats = transform.f - (np.arange(rows + 2) + 0.5) * dlat
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing="ij")
+    elevation = sample_elevations(lat_grid, lon_grid)
+    if np.all(np.isnan(elevation)):
+        return None
+
+    # Tile grids are never reused across requests, so the window is not cached
+    values = getattr(TerrainWindow(elevation, transform), layer)
+
+    # Output rows are evenly spaced in Web Mercator, not in latitude: pick the nearest grid row
+    merc = y + (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    out_lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * merc / 2 ** z))))
+    grid_rows = np.clip(np.rint((transform.f - out_lats) / dlat - 0.5).astype(np.int64), 1, rows)
+    values = values[grid_rows, 1:-1]
+    nodata = np.isnan(values)
+
+    if layer == "hillshade":
+        indices = np.rint(np.nan_to_num(values) * 254).astype(np.uint8)
+        palette = HILLSHADE_PALETTE
+    elif layer == "slope":
+        indices = slope_class_index(values).astype(np.uint8)
+        palette = SLOPE_PALETTE
+    else:
+        indices = aspect_class_index(values).astype(np.uint8)
+        palette = ASPECT_PALETTE
+
+    transparent = len(palette)
+    indices[nodata] = transparent
+    return encode_png(indices, palette, transparent_index=transparent)
+
+def _tile_path(key):
+    layer, z, x, y = key
+    return os.path.join(CACHE_FOLDER, layer, str(z), str(x), f"{y}.png")
+
+def _remove_tile(key, size):
+    try:
+        os.remove(_tile_path(key))
+    except FileNotFoundError:
+        pass
+
+# Disk cache index: key -> file size; eviction deletes the file
+_cache = LRUCache(max_entries=10 ** 7, max_bytes=CACHE_MB * 1024 * 1024,
+                  sizeof=lambda size: size, on_evict=_remove_tile)
+_cache_lock = threading.Lock()
+_cache_loaded = False
+
+def _load_cache_index():
+    """Adopt tiles left on disk by earlier runs, oldest first so they are evicted first"""
+    global _cache_loaded
+    with _cache_lock:
+        if _cache_loaded:
+            return
+        found = []
+        for layer in LAYERS:
+            for root, _, files in os.walk(os.path.join(CACHE_FOLDER, layer)):
+                for name in files:
+                    if not name.endswith(".png"):
+                        continue
+                    path = os.path.join(root, name)
+                    z, x = root.split(os.sep)[-2:]
+                    st = os.stat(path)
+                    found.append((st.st_mtime, (layer, int(z), int(x), int(name[:-4])), st.st_size))
+        for _, key, size in sorted(found):
+            _cache.put(key, size)
+        _cache_loaded = True
+        if found:
+            log(f"Indexed {len(found)} cached tiles ({_cache.stats()['bytes'] / 1e6:.1f} MB)")
+
+def get_tile(layer, z, x, y):
+    """PNG bytes for a tile, from the disk cache when possible"""
+    if layer not in LAYERS:
+        raise ValueError(f"Unknown layer '{layer}', expected one of {', '.join(LAYERS)}")
+    if z > MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError("Tile coordinates out of range")
+    if z < MIN_ZOOM:
+        return _EMPTY_TILE
+
+    _load_cache_index()
+    key = (layer, z, x, y)
+    path = _tile_path(key)
+    if _cache.get(key) is not None:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            _cache.pop(key)
+
+    start = time.time()
+    png = render_tile(layer, z, x, y)
+    if png is None:
+        # Not cached: the DEM may only be temporarily unavailable
+        return _EMPTY_TILE
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(png)
+    os.replace(tmp, path)
+    with _cache_lock:
+        if key not in _cache:
+            _cache.put(key, len(png))
+    log(f"Rendered {layer} {z}/{x}/{y} in {time.time() - start:.2f}s")
+    return png
+
+def clear_cache():
+    """Drop every cached tile (e.g. after a new DEM changes the terrain)"""
+    _load_cache_index()
+    _cache.clear()
+
+def stats():
+    """Disk cache counters for /metrics"""
+    return _cache.stats()
@@ -0,0 +1,200 @@
+# user_dem.py – Ingest and index user-uploaded DEMs (drone surveys, LiDAR, local surveys)
+# Uploads are streamed to disk, reprojected to EPSG:4326 block by block and written as a
+# tiled, overviewed GeoTIFF. Registered DEMs take precedence over SRTM inside their footprint.
+import os
+import json
+import math
+import time
+import uuid
+import threading
+import numpy as np
+import rasterio
+import rasterio.errors
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+import dem_store
+import raster_pool
+from raster_vector import METERS_PER_DEG_LON
+
+USER_DEM_FOLDER = os.environ.get("USER_DEM_FOLDER", "data/user_dems")
+USER_DEM_INDEX = os.path.join(USER_DEM_FOLDER, "index.json")
+MAX_UPLOAD_MB = int(os.environ.get("USER_DEM_MAX_MB", "2048"))
+
+UPLOAD_CHUNK = 1024 * 1024
+BLOCK_SIZE = 256          # Internal GeoTIFF tile size, also the reprojection window
+
+_index_lock = threading.Lock()
+
+def log(msg):
+    print(f"[USER_DEM] {msg}")
+
+def load_user_dems():
+    """Registered user-uploaded DEMs: list of {"id", "path", "bounds", "resolution", ...}"""
+    try:
+        with open(USER_DEM_INDEX) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return []
+    return [e for e in entries if os.path.exists(e.get("path", ""))]
+
+def register_user_dem(entry):
+    with _index_lock:
+        entries = load_user_dems()
+        entries.append(entry)
+        tmp = f"{USER_DEM_INDEX}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp, USER_DEM_INDEX)
+
+def find_covering_dem(minx, miny, maxx, maxy):
+    """Path of the finest registered DEM that fully contains the bbox, or None"""
+    covering = [
+        e for e in load_user_dems()
+        if e["bounds"][0] <= minx and e["bounds"][1] <= miny and e["bounds"][2] >= maxx and e["bounds"][3] >= maxy
+    ]
+    if not covering:
+        return None
+    return min(covering, key=lambda e: e["resolution"])["path"]
+
+def sample_user_dems(lats, lons, values=None):
+    """
+    Bilinear elevations from registered DEMs for points inside their footprints
+
+    Only points still NaN in `values` are filled, finest DEM first.
+    """
+    from dem import read_dem_window, bilinear_sample
+    if values is None:
+        values = np.full(lats.shape, np.nan, dtype=np.float64)
+    for entry in sorted(load_user_dems(), key=lambda e: e["resolution"]):
+        minx, miny, maxx, maxy = entry["bounds"]
+        inside = np.isnan(values) & (lons >= minx) & (lons <= maxx) & (lats >= miny) & (lats <= maxy)
+        if not np.any(inside):
+            continue
+        arr, transform, nodata = read_dem_window(
+            entry["path"], lons[inside].min(), lats[inside].min(), lons[inside].max(), lats[inside].max(), halo=1
+        )
+        values[inside] = bilinear_sample(arr, transform, lons[inside], lats[inside], nodata)
+    return values
+
+async def save_upload(upload, dest_path):
+    """Stream an UploadFile to disk in chunks; returns bytes written"""
+    limit = MAX_UPLOAD_MB * 1024 * 1024
+    written = 0
+    try:
+        with open(dest_path, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > limit:
+                    raise ValueError(f"Upload exceeds {MAX_UPLOAD_MB} MB")
+                out.write(chunk)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return written
+
+def ingest_user_dem(raw_path, name=None):
+    """
+    Reproject an uploaded raster to a tiled EPSG:4326 GeoTIFF with overviews and register it
+
+    Returns:
+        the index entry
+    """
+    dem_id = uuid.uuid4().hex[:12]
+    out_path = os.path.join(USER_DEM_FOLDER, f"{dem_id}.tif")
+    start = time.time()
+
+    try:
+        src = rasterio.open(raw_path)
+    except rasterio.errors.RasterioIOError:
+        raise ValueError("Uploaded file is not a GDAL-readable raster")
+
+    with src:
+        if src.crs is None:
+            raise ValueError("Uploaded raster has no coordinate reference system")
+        src_nodata = src.nodata
+
+        # The VRT warps lazily, so each read below only touches the source blocks it needs
+        with WarpedVRT(src, crs="EPSG:4326", resampling=Resampling.bilinear,
+                       src_nodata=src_nodata, nodata=np.nan, dtype="float32") as vrt:
+            profile = {
+                "driver": "GTiff",
+                "width": vrt.width,
+                "height": vrt.height,
+                "count": 1,
+                "dtype": "float32",
+                "crs": "EPSG:4326",
+                "transform": vrt.transform,
+                "nodata": np.nan,
+                "tiled": True,
+                "blockxsize": BLOCK_SIZE,
+                "blockysize": BLOCK_SIZE,
+                "compress": "deflate",
+                "predictor": 3,
+                "BIGTIFF": "IF_SAFER",
+            }
+            lo, hi = np.inf, -np.inf
+            with rasterio.open(out_path, "w", **profile) as dst:
+                # One output tile per pass: peak memory stays flat however wide the upload is
+                for _, window in dst.block_windows(1):
+                    block = vrt.read(1, window=window)
+                    if src_nodata is not None and not np.isnan(src_nodata):
+                        block[block == src_nodata] = np.nan
+                    if np.any(~np.isnan(block)):
+                        lo = min(lo, float(np.nanmin(block)))
+                        hi = max(hi, float(np.nanmax(block)))
+                    dst.write(block, 1, window=window)
+
+            bounds = list(vrt.bounds)
+            res_deg = abs(vrt.transform.a)
+            width, height = vrt.width, vrt.height
+
+    if not np.isfinite(lo):
+        os.remove(out_path)
+        raise ValueError("Uploaded raster contains no valid elevation data")
+
+    # Overviews let coarse reads (resampled /dem/tile, low-zoom map tiles) skip full-resolution blocks
+    factors = [f for f in (2, 4, 8, 16, 32) if min(width, height) // f >= BLOCK_SIZE // 2]
+    if factors:
+        with rasterio.open(out_path, "r+") as dst:
+            dst.build_overviews(factors, Resampling.average)
+            dst.update_tags(ns="rio_overview", resampling="average")
+    dem_store.evict(out_path)
+    raster_pool.evict(out_path)
+
+    mid_lat = (bounds[1] + bounds[3]) / 2
+    entry = {
+        "id": dem_id,
+        "name": name or dem_id,
+        "path": out_path,
+        "bounds": bounds,
+        "resolution": res_deg,
+        "resolution_m": round(res_deg * METERS_PER_DEG_LON * math.cos(math.radians(mid_lat)), 2),
+        "width": width,
+        "height": height,
+        "min_elevation": round(lo, 2),
+        "max_elevation": round(hi, 2),
+        "uploaded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    register_user_dem(entry)
+    log(f"Ingested {entry['name']} ({width}x{height}, {entry['resolution_m']}m) in {time.time() - start:.1f}s")
+    return entry
+
+async def handle_upload(upload, name=None):
+    """Stream, ingest and register an uploaded DEM; the raw upload is removed afterwards"""
+    from starlette.concurrency import run_in_threadpool
+
+    os.makedirs(USER_DEM_FOLDER, exist_ok=True)
+    suffix = os.path.splitext(upload.filename or "")[1] or ".tif"
+    raw_path = os.path.join(USER_DEM_FOLDER, f"upload_{uuid.uuid4().hex}{suffix}")
+    try:
+        size = await save_upload(upload, raw_path)
+        log(f"Received {upload.filename} ({size / 1e6:.1f} MB)")
+        # Reprojection is CPU/disk bound: keep it off the event loop
+        return await run_in_threadpool(ingest_user_dem, raw_path, name or upload.filename)
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
@@ -9,7 +9,14 @@ import math
 import numpy as np
 from io import BytesIO
 import zipfile
-import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import dem_store
+import elevation_providers
+import raster_pool
+import user_dem
 try:
     from scipy import ndimage
     SCIPY_AVAILABLE = True
@@ -31,32 +38,63 @@ def get_srtm_tile_name(lat, lon):
     ew = 'E' if lon >= 0 else 'W'
     return f"{ns}{abs(int(lat)):02d}{ew}{abs(int(lon)):03d}"
 
+def tiles_for_bbox(bbox):
+    """(tile_lat, tile_lon) pairs that download_dem fetches for a (minx, miny, maxx, maxy) bbox"""
+    minx, miny, maxx, maxy = bbox
+    return [
+        (tile_lat, tile_lon)
+        for tile_lat in range(int(math.floor(miny)), int(math.ceil(maxy)) + 1)
+        for tile_lon in range(int(math.floor(minx)), int(math.ceil(maxx)) + 1)
+    ]
+
+def dem_tile_path(tile_lat, tile_lon):
+    """Cache path of a 1° DEM tile"""
+    return f"{DEM_FOLDER}/{tile_lat}_{tile_lon}.tif"
+
+# Grids synthesized from point lookups are a coarse stopgap: they live under their own
+# name and the real tile sources are retried once they are older than this (seconds)
+SYNTH_TILE_TTL = int(os.environ.get("DEM_SYNTH_TILE_TTL", "86400"))
+
+def synth_tile_path(tile_lat, tile_lon):
+    """Cache path of a 1° tile synthesized from point lookups"""
+    return f"{DEM_FOLDER}/{tile_lat}_{tile_lon}.synth.tif"
+
+def cached_tile_path(tile_lat, tile_lon):
+    """Real cached tile, else a synthesized one that has not expired, else None"""
+    path = dem_tile_path(tile_lat, tile_lon)
+    if os.path.exists(path):
+        return path
+    synth_path = synth_tile_path(tile_lat, tile_lon)
+    try:
+        if time.time() - os.path.getmtime(synth_path) < SYNTH_TILE_TTL:
+            return synth_path
+    except OSError:
+        pass
+    return None
+
 # Improved DEM downloader with India-specific sources and better accuracy
 def download_dem(lat, lon, bbox=None):
     """
     Download DEM with multiple sources, optimized for India
     bbox: (minx, miny, maxx, maxy) for downloading multiple tiles
     """
+    # Uploaded survey/drone DEMs are finer than any tile source inside their footprint
+    user_path = user_dem.find_covering_dem(*(bbox or (lon, lat, lon, lat)))
+    if user_path:
+        return user_path
+
     # For India, prioritize high-resolution sources
     is_india = is_india_region(lat, lon)
-    
+
     # If bbox provided, download and merge multiple tiles
     if bbox:
-        minx, miny, maxx, maxy = bbox
         tiles = []
         
-        # Calculate tile grid needed
-        lat_start = int(math.floor(miny))
-        lat_end = int(math.ceil(maxy))
-        lon_start = int(math.floor(minx))
-        lon_end = int(math.ceil(maxx))
-        
         # Download all tiles in bounding box
-        for tile_lat in range(lat_start, lat_end + 1):
-            for tile_lon in range(lon_start, lon_end + 1):
-                tile_path = download_single_dem_tile(tile_lat, tile_lon, is_india)
-                if tile_path and os.path.exists(tile_path):
-                    tiles.append(tile_path)
+        for tile_lat, tile_lon in tiles_for_bbox(bbox):
+            tile_path = download_single_dem_tile(tile_lat, tile_lon, is_india)
+            if tile_path and os.path.exists(tile_path):
+                tiles.append(tile_path)
         
         if not tiles:
             raise Exception("Failed to download any DEM tiles")
@@ -70,128 +108,33 @@ def download_dem(lat, lon, bbox=None):
     # Single tile download
     return download_single_dem_tile(int(lat), int(lon), is_india)
 
-def download_single_dem_tile(tile_lat, tile_lon, is_india=False):
+def download_single_dem_tile(tile_lat, tile_lon, is_india=False, api_fallback=True):
     """Download a single DEM tile with improved sources"""
-    tile = f"{tile_lat}_{tile_lon}.tif"
-    path = f"{DEM_FOLDER}/{tile}"
+    path = dem_tile_path(tile_lat, tile_lon)
+    synth_path = synth_tile_path(tile_lat, tile_lon)
 
-    if os.path.exists(path):
-        return path
+    # An unexpired synthesized stand-in will do unless the caller wants real tiles only
+    cached = cached_tile_path(tile_lat, tile_lon)
+    if cached == path or (cached and api_fallback):
+        return cached
 
-    # Priority sources for India - SRTM 30m from multiple sources
-    # Using correct SRTM tile naming: N/S + lat + E/W + lon (e.g., N26E088)
-    srtm_tile = get_srtm_tile_name(tile_lat, tile_lon)
+    # Sources are tried fastest-healthy-first; see elevation_providers for the list
+    provider = elevation_providers.fetch_tile(tile_lat, tile_lon, path, is_india)
+    if provider:
+        if os.path.exists(synth_path):
+            os.remove(synth_path)
+            dem_store.evict(synth_path)
+            raster_pool.evict(synth_path)
+        return path
     
-    if is_india:
-        sources = [
-            # Source 1: Terrain Tiles (SRTM 30m, reliable)
-            {
-                'url': f"https://s3.amazonaws.com/elevation-tiles-prod/terrarium/{tile_lat}/{tile_lon}.png",
-                'type': 'png',
-                'description': 'Terrain Tiles SRTM 30m'
-            },
-            # Source 2: AWS SRTM Skadi (correct format: N/S + lat + E/W + lon)
-            {
-                'url': f"https://s3.amazonaws.com/elevation-tiles-prod/skadi/{srtm_tile}.tif",
-                'type': 'tif',
-                'description': 'SRTM 30m via AWS Skadi (correct naming)'
-            },
-            # Source 3: Alternative AWS endpoint
-            {
-                'url': f"https://elevation-tiles-prod.s3.amazonaws.com/skadi/{srtm_tile}.tif",
-                'type': 'tif',
-                'description': 'SRTM 30m via AWS (alt)'
-            },
-            # Source 4: Mapbox Terrain (SRTM-based)
-            {
-                'url': f"https://api.mapbox.com/v4/mapbox.terrain-rgb/{tile_lon}/{tile_lat}/10.pngraw?access_token=pk.eyJ1IjoibWFwYm94IiwiYSI6ImNpejY4NXV4NTYyZ2gycXA4N2pmbDZmangifQ.-g_vE53SD2WrJ6tFX7QHmA",
-                'type': 'png',
-                'description': 'Mapbox Terrain RGB (SRTM-based)',
-                'requires_processing': True  # Needs conversion from RGB to elevation
-            },
-            # Source 5: OpenTopoMap DEM (SRTM-based)
-            {
-                'url': f"https://opentopomap.org/dem/{tile_lat}_{tile_lon}.tif",
-                'type': 'tif',
-                'description': 'OpenTopoMap DEM (SRTM-based)'
-            },
-        ]
-    else:
-        # Global sources
-        sources = [
-            {
-                'url': f"https://s3.amazonaws.com/elevation-tiles-prod/skadi/{srtm_tile}.tif",
-                'type': 'tif'
-            },
-            {
-                'url': f"https://elevation-tiles-prod.s3.amazonaws.com/skadi/{srtm_tile}.tif",
-                'type': 'tif'
-            },
-            {
-                'url': f"https://opentopomap.org/dem/{tile_lat}_{tile_lon}.tif",
-                'type': 'tif'
-            },
-        ]
+    if not api_fallback:
+        print(f"[UTILS] All DEM tile sources failed for {tile_lat}_{tile_lon}")
+        return None
     
-    for source in sources:
-        try:
-            # Skip sources that require auth (for now)
-            if source.get('requires_auth', False):
-                continue
-            
-            # Try primary URL first
-            url = source['url']
-            source_type = source.get('type', 'tif')
-            description = source.get('description', 'Unknown')
-            
-            print(f"[UTILS] Trying {description}: {url}")
-            
-            r = requests.get(url, timeout=15, headers={'User-Agent': 'Permaculture-App/1.0'}, allow_redirects=True)
-            
-            if r.status_code == 200 and len(r.content) > 1000:
-                with open(path, "wb") as f:
-                    f.write(r.content)
-                
-                # Verify it's a valid GeoTIFF with real terrain data
-                try:
-                    with rasterio.open(path) as src:
-                        if src.count > 0 and src.width > 0 and src.height > 0:
-                            # Check if data is valid (not all zeros or nodata)
-                            data = src.read(1)
-                            valid_data = data[(data != src.nodata) & (data != 0) & ~np.isnan(data)]
-                            
-                            if len(valid_data) == 0:
-                                # No valid data
-                                print(f"[UTILS] {description}: No valid data")
-                                if os.path.exists(path):
-                                    os.remove(path)
-                                continue
-                            
-                            # CRITICAL: Check if data actually varies (not uniform)
-                            data_std = np.std(valid_data)
-                            data_range = np.max(valid_data) - np.min(valid_data)
-                            
-                            # Require at least 1m variation and 0.5m standard deviation
-                            if data_std < 0.5 or data_range < 1.0:
-                                # Uniform/invalid data - reject
-                                print(f"[UTILS] {description}: Uniform data (std={data_std:.2f}, range={data_range:.2f})")
-                                if os.path.exists(path):
-                                    os.remove(path)
-                                continue
-                            
-                            # Valid DEM with real terrain variation
-                            print(f"[UTILS] ✅ Successfully downloaded {description}: {len(valid_data)} points, range {np.min(valid_data):.1f}m - {np.max(valid_data):.1f}m")
-                            return path
-                except Exception as e:
-                    print(f"[UTILS] {description}: Invalid file format: {e}")
-                    if os.path.exists(path):
-                        os.remove(path)
-                    continue
-            else:
-                print(f"[UTILS] {description}: HTTP {r.status_code}, content length: {len(r.content)}")
-        except Exception as e:
-            print(f"[UTILS] {source.get('description', 'Unknown')}: Error - {e}")
-            continue
+    # Sources are still down: keep the expired stand-in for another TTL instead of re-sampling it
+    if os.path.exists(synth_path):
+        os.utime(synth_path)
+        return synth_path
     
     # If all sources fail, try OpenElevation API as last resort
     print(f"[UTILS] All DEM tile sources failed for {tile_lat}_{tile_lon}, trying OpenElevation API...")
@@ -201,10 +144,86 @@ def download_single_dem_tile(tile_lat, tile_lon, is_india=False):
         print(f"[UTILS] OpenElevation API also failed: {e}")
         return None
 
-def create_dem_from_elevation_api(tile_lat, tile_lon, resolution=30):
+OPEN_ELEVATION_URL = "https://api.open-elevation.com/api/v1/lookup"
+ELEVATION_API_WORKERS = int(os.environ.get("ELEVATION_API_WORKERS", "8"))
+ELEVATION_API_BATCH = int(os.environ.get("ELEVATION_API_BATCH", "250"))
+
+_api_session = None
+_api_session_lock = threading.Lock()
+
+def get_api_session():
+    """Shared HTTP session with a connection pool sized for the parallel workers"""
+    global _api_session
+    with _api_session_lock:
+        if _api_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=ELEVATION_API_WORKERS,
+                max_retries=Retry(total=2, backoff_factor=0.5,
+                                  status_forcelist=[429, 502, 503, 504],
+                                  allowed_methods=["POST"])
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({'User-Agent': 'Permaculture-App/1.0'})
+            _api_session = session
+        return _api_session
+
+def fetch_elevations_api(lats, lons, url=OPEN_ELEVATION_URL, timeout=30):
     """
-    Create DEM from OpenElevation API when tile sources fail
-    Samples elevation points and creates a GeoTIFF
+    Look up elevations for coordinate arrays with parallel batched POSTs
+
+    Returns:
+        float32 array shaped like `lats`, NaN where the API had no answer
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    flat_lats = lats.ravel()
+    flat_lons = np.asarray(lons, dtype=np.float64).ravel()
+    values = np.full(flat_lats.shape, np.nan, dtype=np.float32)
+    session = get_api_session()
+
+    def fetch_batch(start):
+        stop = min(start + ELEVATION_API_BATCH, len(flat_lats))
+        locations = [{"latitude": la, "longitude": lo}
+                     for la, lo in zip(flat_lats[start:stop].tolist(), flat_lons[start:stop].tolist())]
+        response = session.post(url, json={"locations": locations}, timeout=timeout)
+        if response.status_code != 200:
+            raise Exception(f"HTTP {response.status_code}")
+        results = response.json().get('results', [])[:stop - start]
+        elevs = np.array([np.nan if r.get('elevation') is None else r['elevation'] for r in results],
+                         dtype=np.float32)
+        elevs[elevs == -32768] = np.nan
+        values[start:start + len(elevs)] = elevs
+
+    with ThreadPoolExecutor(max_workers=ELEVATION_API_WORKERS) as pool:
+        futures = [pool.submit(fetch_batch, start) for start in range(0, len(flat_lats), ELEVATION_API_BATCH)]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"[UTILS] Batch elevation request failed: {e}")
+
+    return values.reshape(lats.shape)
+
+def fill_nodata_nearest(grid):
+    """Fill NaN holes with the nearest valid value (mean fill without scipy)"""
+    holes = np.isnan(grid)
+    if not np.any(holes):
+        return grid
+    if SCIPY_AVAILABLE:
+        indices = ndimage.distance_transform_edt(holes, return_distances=False, return_indices=True)
+        return grid[tuple(indices)]
+    filled = grid.copy()
+    filled[holes] = np.nanmean(grid)
+    return filled
+
+def create_dem_from_elevation_api(tile_lat, tile_lon, resolution=30, grid_size=100):
+    """
+    Create DEM from point providers (OpenElevation) when tile sources fail
+    Samples a grid of elevation points and writes it next to the DEM tile cache
+    under synth_tile_path, so it is served until SYNTH_TILE_TTL expires but never
+    mistaken for the real tile
     """
     from rasterio.transform import from_bounds
     
@@ -214,42 +233,12 @@ def create_dem_from_elevation_api(tile_lat, tile_lon, resolution=30):
     maxx = minx + 1.0
     maxy = miny + 1.0
     
-    # Sample grid - for better resolution, sample every ~0.0005 degrees (~50m)
-    step = 0.0005
-    lats = np.linspace(miny, maxy, 100)
-    lons = np.linspace(minx, maxx, 100)
+    # Row 0 is the northern edge, matching the GeoTIFF layout
+    lats = np.linspace(maxy, miny, grid_size)
+    lons = np.linspace(minx, maxx, grid_size)
+    lat_grid, lon_grid = np.meshgrid(lats, lons, indexing='ij')
     
-    # Prepare batch request
-    locations = []
-    grid_indices = []
-    for i, lat in enumerate(lats):
-        for j, lon in enumerate(lons):
-            locations.append({"latitude": float(lat), "longitude": float(lon)})
-            grid_indices.append((len(lats) - 1 - i, j))
-    
-    # Request elevations in batches (API limit ~1000 points)
-    elevation_grid = np.full((len(lats), len(lons)), np.nan, dtype=np.float32)
-    batch_size = 100
-    
-    for i in range(0, len(locations), batch_size):
-        batch = locations[i:i+batch_size]
-        try:
-            response = requests.post(
-                "https://api.open-elevation.com/api/v1/lookup",
-                json={"locations": batch},
-                timeout=30
-            )
-            if response.status_code == 200:
-                results = response.json().get('results', [])
-                for idx, result in enumerate(results):
-                    if idx < len(batch) and i + idx < len(grid_indices):
-                        elev = result.get('elevation')
-                        if elev is not None and elev != -32768:
-                            grid_idx = grid_indices[i + idx]
-                            elevation_grid[grid_idx] = float(elev)
-        except Exception as e:
-            print(f"[UTILS] Batch elevation request failed: {e}")
-            continue
+    elevation_grid = elevation_providers.lookup_elevations(lat_grid, lon_grid).astype(np.float32)
     
     # Check if we got valid data
     valid_data = elevation_grid[~np.isnan(elevation_grid)]
@@ -262,39 +251,19 @@ def create_dem_from_elevation_api(tile_lat, tile_lon, resolution=30):
     if data_std < 0.5 or data_range < 1.0:
         raise Exception(f"API elevation data is uniform (std={data_std:.2f}m, range={data_range:.2f}m)")
     
-    # Fill NaN with interpolation
-    if SCIPY_AVAILABLE:
-        try:
-            mask = ~np.isnan(elevation_grid)
-            if np.any(mask):
-                elevation_grid = ndimage.generic_filter(
-                    elevation_grid,
-                    lambda x: x[~np.isnan(x)][0] if np.any(~np.isnan(x)) else np.nan,
-                    size=3,
-                    mode='nearest'
-                )
-                if np.any(np.isnan(elevation_grid)):
-                    mean_elev = np.nanmean(elevation_grid)
-                    elevation_grid[np.isnan(elevation_grid)] = mean_elev
-        except:
-            mean_elev = np.nanmean(elevation_grid)
-            elevation_grid[np.isnan(elevation_grid)] = mean_elev
-    else:
-        mean_elev = np.nanmean(elevation_grid)
-        elevation_grid[np.isnan(elevation_grid)] = mean_elev
+    elevation_grid = fill_nodata_nearest(elevation_grid)
     
-    # Create GeoTIFF
-    transform = from_bounds(minx, miny, maxx, maxy, len(lons), len(lats))
-    temp_file = tempfile.NamedTemporaryFile(suffix='.tif', delete=False)
-    temp_path = temp_file.name
-    temp_file.close()
+    # Rename into place so readers never see a partial file
+    path = synth_tile_path(tile_lat, tile_lon)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    transform = from_bounds(minx, miny, maxx, maxy, grid_size, grid_size)
     
     with rasterio.open(
         temp_path,
         'w',
         driver='GTiff',
-        height=len(lats),
-        width=len(lons),
+        height=grid_size,
+        width=grid_size,
         count=1,
         dtype=elevation_grid.dtype,
         crs='EPSG:4326',
@@ -303,16 +272,21 @@ def create_dem_from_elevation_api(tile_lat, tile_lon, resolution=30):
         nodata=np.nan
     ) as dst:
         dst.write(elevation_grid, 1)
+    os.replace(temp_path, path)
+    dem_store.evict(path)
+    raster_pool.evict(path)
     
     print(f"[UTILS] Created DEM from API: {len(valid_data)} points, range {np.min(valid_data):.1f}m - {np.max(valid_data):.1f}m, std={data_std:.2f}m")
-    return temp_path
+    return path
 
 def merge_dem_tiles(tile_paths, bbox):
     """Merge multiple DEM tiles into one"""
     minx, miny, maxx, maxy = bbox
     merged_path = f"{DEM_FOLDER}/merged_{minx:.2f}_{miny:.2f}_{maxx:.2f}_{maxy:.2f}.tif"
     
-    if os.path.exists(merged_path):
+    # Reuse a merge only if no input (e.g. a synthesized tile replaced by a real one) is newer
+    if os.path.exists(merged_path) and \
+            os.path.getmtime(merged_path) >= max(os.path.getmtime(path) for path in tile_paths):
         return merged_path
     
     try:
@@ -335,6 +309,8 @@ def merge_dem_tiles(tile_paths, bbox):
         # Write merged file
         with rasterio.open(merged_path, "w", **out_meta) as dest:
             dest.write(mosaic)
+        dem_store.evict(merged_path)
+        raster_pool.evict(merged_path)
         
         # Close all source files
         for src in src_files: